@@ -0,0 +1,157 @@
+'''
+PDFコンバーターの各プロファイル（fast / balanced / accurate）の変換時間とメモリ使用量を計測する
+（ピークメモリを比較するため、プロファイルごとに別プロセスで変換する）
+
+例:
+    python -m benchmark.converter_profiles
+    python -m benchmark.converter_profiles -i input/2021r03h_nw_pm1_qs.pdf -p fast accurate
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+from src.modules.utils import CONVERTER_PROFILES, get_converter_options
+
+
+# プロセスのピークメモリ使用量（MB）
+def peak_rss_mb():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxは KB、macOSは byte 単位
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+
+# 1つのプロファイルで変換し、計測結果を返す（子プロセスで実行する）
+#   sample_dir を指定した場合は、見比べられるよう切り出した表と図の画像を保存する
+def measure_profile(profile, pdf_path, sample_dir=None):
+    from src.modules.utils import setup_pdf_converter
+    from src.modules.convert import convert_pdf
+
+    rss_start = peak_rss_mb()
+
+    # ＜コンバーターの生成（モデルの読み込み）＞
+    start_time = time.perf_counter()
+    pdf_converter = setup_pdf_converter(profile)
+    setup_time = time.perf_counter() - start_time
+    rss_setup = peak_rss_mb()
+
+    # ＜変換＞
+    start_time = time.perf_counter()
+    images = convert_pdf(pdf_converter, pdf_path)[0]
+    convert_time = time.perf_counter() - start_time
+    rss_convert = peak_rss_mb()
+
+    num_pages = max(len(images["pages"]), 1)
+    result = {
+        "profile": profile,
+        "options": get_converter_options(profile),
+        "pages": len(images["pages"]),
+        "setup_time": setup_time,
+        "convert_time": convert_time,
+        "time_per_page": convert_time / num_pages,
+        "peak_rss_mb": {"start": rss_start, "setup": rss_setup, "convert": rss_convert},
+        # 変換中に増えたピークメモリの1ページあたりの量
+        "rss_per_page_mb": (rss_convert - rss_setup) / num_pages,
+        "page_size": list(images["pages"][0][1].size) if len(images["pages"]) > 0 else None,
+        "tables": len(images["tables"]),
+        "pictures": len(images["pictures"]),
+    }
+
+    if sample_dir is not None:
+        os.makedirs(sample_dir, exist_ok=True)
+        for image_type in ("tables", "pictures"):
+            for i, image in enumerate(images[image_type][:3]):
+                image.save(os.path.join(sample_dir, f"{image_type[:-1]}-{i + 1}.png"))
+
+    return result
+
+
+# プロファイルごとに子プロセスで計測する
+def run_profile(profile, pdf_path, sample_dir):
+    command = [
+        sys.executable, "-m", "benchmark.converter_profiles",
+        "--worker", profile, "-i", pdf_path, "-o", sample_dir,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": "."})
+    if result.returncode != 0:
+        return {"profile": profile, "error": result.stderr.strip().splitlines()[-1]}
+    # 最終行が計測結果（それ以前はdoclingのログなど）
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# 結果を表形式で表示
+def print_results(results):
+    print(f"\n=============== 計測結果 ===============")
+    print(
+        f"{'プロファイル':<12}{'ページ':>6}{'生成(s)':>10}{'変換(s)':>10}{'s/ページ':>10}"
+        f"{'RSS(MB)':>10}{'MB/ページ':>10}{'表':>5}{'図':>5}")
+    for result in results["profiles"]:
+        if "error" in result:
+            print(f"{result['profile']:<12}エラー: {result['error']}")
+            continue
+        print(
+            f"{result['profile']:<12}{result['pages']:>6}{result['setup_time']:>10.2f}{result['convert_time']:>10.2f}"
+            f"{result['time_per_page']:>10.2f}{result['peak_rss_mb']['convert']:>10.0f}"
+            f"{result['rss_per_page_mb']:>10.1f}{result['tables']:>5}{result['pictures']:>5}")
+    print()
+
+
+def main(pdf_path, profiles, output_dir):
+
+    print(f"=============== 変換プロファイルの計測開始 ===============")
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    work_dir = os.path.join(output_dir, f"converter_profiles_{timestamp}")
+    if pdf_path is None:
+        # 入力の指定がない場合は、ベンチマーク用の試験PDFを生成
+        from benchmark.synthetic_exam import generate_exam_pdfs
+
+        pdf_path, _, _ = generate_exam_pdfs(os.path.join(work_dir, "input"))
+
+    results = {
+        "timestamp": timestamp,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "pdf_path": pdf_path,
+        "profiles": [],
+    }
+    for profile in profiles:
+        print(f"=============== {profile} 計測中 ===============")
+        results["profiles"].append(run_profile(profile, pdf_path, os.path.join(work_dir, profile)))
+
+    print_results(results)
+
+    result_path = os.path.join(work_dir, "converter_profiles.json")
+    with open(result_path, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果: {result_path}（切り出した表と図は各プロファイルのディレクトリ）")
+
+    print(f"=============== 変換プロファイルの計測終了 ===============")
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="PDFコンバーターのプロファイルの計測")
+    parser.add_argument("-i", "--input_pdf", default=None, help="計測に使うPDFを指定してください。省略時は生成します。")
+    parser.add_argument(
+        "-p", "--profiles", nargs="+", default=list(CONVERTER_PROFILES), help="計測するプロファイルを指定してください。")
+    parser.add_argument("-o", "--output_dir", default="output/benchmark", help="結果の出力先を指定してください。")
+    # 子プロセスとして1つのプロファイルを計測する場合に指定する
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(measure_profile(args.worker, args.input_pdf, args.output_dir), ensure_ascii=False))
+    else:
+        main(args.input_pdf, args.profiles, args.output_dir)
@@ -0,0 +1,160 @@
+'''
+CLIの各サブコマンドの起動時間（モジュールの読み込み時間）を計測する
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import yaml
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+from benchmark.synthetic_exam import generate_exam_pdfs
+
+
+# サブコマンドごとに読み込むモジュール
+COMMAND_MODULES = {
+    "pdf2md": "src.pdf2md",
+    "review": "src.exam_review",
+    "agent": "src.exam_agent",
+    "batch": "src.batch",
+    "convert-server": "src.convert_server",
+    "benchmark": "benchmark.run_benchmark",
+}
+
+
+# コマンドを別プロセスで実行し、所要時間（s）を返す
+def time_command(command, stdin_text=None):
+    start_time = time.perf_counter()
+    result = subprocess.run(
+        command, input=stdin_text, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": "."})
+    elapsed = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} が失敗しました\n{result.stderr}")
+    return elapsed
+
+
+# モジュールの読み込みにかかる時間と、時間のかかっているモジュールの上位を取得（-X importtime）
+def import_profile(module_name, top_n=5):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        capture_output=True, text=True, env={**os.environ, "PYTHONPATH": "."})
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1]}
+
+    # 「import time: self [us] | cumulative | imported package」の形式
+    entries = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+    names = [name for _, _, name in entries]
+    if module_name not in names:
+        return {"total": None, "top_imports": []}
+
+    # 対象モジュールが直接読み込んだモジュール（対象の行より前に、1段深いインデントで出力される）
+    index = names.index(module_name)
+    total, indent, _ = entries[index]
+    children = []
+    for cumulative, child_indent, name in reversed(entries[:index]):
+        if child_indent <= indent:
+            break
+        if child_indent == indent + 2:
+            children.append((cumulative, name))
+    return {
+        "total": total / 1e6,
+        "top_imports": [
+            {"module": name, "time": cumulative / 1e6}
+            for cumulative, name in sorted(children, reverse=True)[:top_n]
+        ],
+    }
+
+
+# ドライラン・エージェント起動用の入力を作成
+def prepare_inputs(work_dir):
+    qs_pdf_path, ans_pdf_path, split_page = generate_exam_pdfs(
+        os.path.join(work_dir, "input"), num_sections=2, pages_per_section=2, ans_pages=1)
+    config_path = os.path.join(work_dir, "config_pdf2md.yml")
+    with open(config_path, mode="w") as f:
+        yaml.safe_dump({
+            "output_dir": os.path.join(work_dir, "output"),
+            "pdf_path": qs_pdf_path,
+            "ans_pdf_path": ans_pdf_path,
+            "split_page": split_page,
+        }, f)
+
+    # exam_agent が読み込む問題と解説
+    mon_dir = os.path.join(work_dir, "output", "bench_qs_20000101000000", "mon1")
+    os.makedirs(mon_dir, exist_ok=True)
+    for file_name in ("bench_mon1.md", "bench_mon1_review.md"):
+        with open(os.path.join(mon_dir, file_name), mode="w", encoding="utf-8") as f:
+            f.write("問1 ベンチマーク用の文章\n")
+    return config_path, mon_dir
+
+
+def main(output_dir, repeat, budget):
+
+    print(f"=============== 起動時間の計測開始 ===============")
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    work_dir = os.path.join(output_dir, f"import_time_{timestamp}")
+    config_path, mon_dir = prepare_inputs(work_dir)
+
+    cli = [sys.executable, "-m", "src.cli"]
+    cases = [("cli --help", cli + ["--help"], None)]
+    cases += [(f"{command} --help", cli + [command, "--help"], None) for command in COMMAND_MODULES]
+    cases += [
+        ("pdf2md --dry-run", cli + ["pdf2md", "-c", config_path, "--dry-run"], None),
+        # 最初の入力待ちまでの起動時間（すぐに終了する）
+        ("agent startup", cli + ["agent", "-i", mon_dir], "q\n"),
+    ]
+
+    results = {
+        "timestamp": timestamp,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "budget": budget,
+        "commands": {},
+        "imports": {},
+    }
+
+    # 各コマンドの所要時間（中央値）
+    for name, command, stdin_text in cases:
+        times = [time_command(command, stdin_text) for _ in range(repeat)]
+        median = statistics.median(times)
+        results["commands"][name] = {"median": median, "times": times, "within_budget": median <= budget}
+        print(f"{name:<28}{median:>8.3f}s{'' if median <= budget else '  （上限超過）'}")
+
+    # 各サブコマンドのモジュールの読み込み時間
+    for command, module_name in COMMAND_MODULES.items():
+        results["imports"][command] = import_profile(module_name)
+
+    result_path = os.path.join(work_dir, "import_time.json")
+    with open(result_path, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果: {result_path}")
+
+    print(f"=============== 起動時間の計測終了 ===============")
+
+    return all(result["within_budget"] for result in results["commands"].values())
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="CLIの起動時間の計測")
+    parser.add_argument("-o", "--output_dir", default="output/benchmark", help="結果の出力先を指定してください。")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="各コマンドの実行回数を指定してください。")
+    parser.add_argument("--budget", type=float, default=1.0, help="起動時間の上限（s）を指定してください。")
+
+    args = parser.parse_args()
+
+    sys.exit(0 if main(args.output_dir, args.repeat, args.budget) else 1)
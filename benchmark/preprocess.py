@@ -0,0 +1,195 @@
+'''
+ページ画像の前処理（傾き補正・フッター除去・空白の行の詰め）を、固定のしきい値・適応的な2値化のそれぞれで行った場合と、
+前処理なしの固定のしきい値での2値化を比較する（画素数・バイト数・推定トークン数・処理時間・文字の保持）
+
+ベンチマーク用のページを生成し、そのままのページ（clean）と、傾き・地色のむら・ノイズを加えたページ（scanned）で計測する
+文字の保持は、元のページの本文の文字の連結成分数に対する、送信画像の連結成分数の比で見る
+（1に近いほど良い。ノイズが残ると大きく、文字が潰れると小さくなる）
+
+例:
+    python -m benchmark.preprocess
+    python -m benchmark.preprocess -n 10 --max_angle 2.5
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.modules.image import optimize_page_image, DEFAULT_IMAGE_OPTIONS
+from src.modules.preprocess import DEFAULT_PREPROCESS_OPTIONS
+from benchmark.synthetic_exam import PAGE_SIZE, render_page
+
+
+# 比較する方法（None は前処理なしの、固定のしきい値での2値化）
+METHODS = {
+    "none": None,
+    "global": {**DEFAULT_PREPROCESS_OPTIONS, "binarize_method": "global"},
+    "adaptive": {**DEFAULT_PREPROCESS_OPTIONS, "binarize_method": "adaptive"},
+}
+
+# doclingのページ画像と同じく、2倍の解像度にする
+PAGE_SCALE = 2
+# 生成したページのフッター（ページ番号・コピーライト）の開始位置（下端からのpx、PAGE_SIZE基準）
+FOOTER_HEIGHT = 90
+
+
+# ベンチマーク用のページを作成（2倍の解像度のPIL画像のリスト）
+def generate_pages(num_pages, seed=0):
+    rng = random.Random(seed)
+    size = (PAGE_SIZE[0] * PAGE_SCALE, PAGE_SIZE[1] * PAGE_SCALE)
+    return [
+        render_page(rng, page_no, with_table=page_no % 2 == 0, with_figure=page_no % 2 == 1).resize(size, Image.LANCZOS)
+        for page_no in range(1, num_pages + 1)
+    ]
+
+
+# スキャンしたページを模擬（傾き・紙の地色と明るさのむら・ノイズ）
+def simulate_scan(page, angle, rng):
+    rotated = np.asarray(page.convert("L").rotate(angle, resample=Image.BICUBIC, fillcolor=255), dtype=np.float32)
+    height, width = rotated.shape
+    # 左上から右下に向かって暗くなる地色（右下は固定のしきい値を下回る）
+    shading = np.linspace(0, 0.5, width)[None, :] + np.linspace(0, 0.5, height)[:, None]
+    paper = 235 - 115 * shading
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 8, rotated.shape)
+    scanned = rotated / 255 * paper + noise
+    return Image.fromarray(np.clip(scanned, 0, 255).astype(np.uint8))
+
+
+# 2値画像の文字などの連結成分数（小さすぎる点は除く）
+def count_components(binary_image, min_area=2):
+    _, _, component_stats, _ = cv2.connectedComponentsWithStats((binary_image < 128).astype(np.uint8), connectivity=8)
+    return int(np.count_nonzero(component_stats[1:, cv2.CC_STAT_AREA] >= min_area))
+
+
+# 元のページの本文（フッターを除く）の連結成分数（送信画像と同じ倍率に縮小してから数える）
+def reference_components(page, scale):
+    gray = np.asarray(page.convert("L"))
+    gray = gray[:gray.shape[0] - FOOTER_HEIGHT * PAGE_SCALE]
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return count_components(np.where(gray < 128, 0, 255).astype(np.uint8))
+
+
+# 1ページを1つの方法で処理し、計測結果を返す（reference は傾き・ノイズを加える前のページ）
+def measure_page(page, reference, preprocess_options, image_options, sample_path=None):
+    start_time = time.perf_counter()
+    image_bytes, _, stats = optimize_page_image(
+        page, binarize=True, image_options=image_options, preprocess_options=preprocess_options)
+    elapsed = time.perf_counter() - start_time
+
+    image_array = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if sample_path is not None:
+        cv2.imwrite(sample_path, image_array)
+    return {
+        "time": elapsed,
+        "size": list(stats["size"]),
+        "pixel_reduction": stats["pixel_reduction"],
+        "bytes": stats["bytes"],
+        "tokens": stats["tokens"],
+        "skew_angle": stats.get("skew_angle", 0.0),
+        "footer_removed": stats.get("footer_rows", 0) > 0,
+        "component_ratio": count_components(image_array) / max(reference_components(reference, stats["scale"]), 1),
+    }
+
+
+# 方法ごとの平均
+def summarize(page_results):
+    return {
+        key: statistics.mean(float(result[key]) for result in page_results)
+        for key in ("time", "pixel_reduction", "bytes", "tokens", "component_ratio", "footer_removed")
+    }
+
+
+# 結果を表形式で表示
+def print_results(results):
+    print(f"\n=============== 計測結果 ===============")
+    print(
+        f"{'ページ':<10}{'方法':<10}{'時間(ms)':>10}{'画素削減':>10}{'bytes':>12}{'tokens':>8}"
+        f"{'成分比':>8}{'フッター':>8}{'傾き誤差':>10}")
+    for case, case_results in results["cases"].items():
+        for method, method_results in case_results.items():
+            summary = method_results["summary"]
+            angle_errors = [
+                abs(page["skew_angle"] + angle)
+                for page, angle in zip(method_results["pages"], results["angles"][case])
+            ]
+            print(
+                f"{case:<10}{method:<10}{summary['time'] * 1000:>10.0f}{summary['pixel_reduction']:>10.0%}"
+                f"{summary['bytes']:>12,.0f}{summary['tokens']:>8.0f}{summary['component_ratio']:>8.2f}"
+                f"{summary['footer_removed']:>8.0%}{statistics.mean(angle_errors):>9.2f}°")
+    print()
+
+
+def main(num_pages, max_angle, output_dir, seed=0):
+
+    print(f"=============== 前処理の計測開始 ===============")
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    work_dir = os.path.join(output_dir, f"preprocess_{timestamp}")
+    os.makedirs(work_dir, exist_ok=True)
+    image_options = dict(DEFAULT_IMAGE_OPTIONS)
+
+    rng = random.Random(seed)
+    pages = generate_pages(num_pages, seed)
+    angles = [rng.uniform(-max_angle, max_angle) for _ in pages]
+    cases = {
+        "clean": (pages, [0.0] * len(pages)),
+        "scanned": ([simulate_scan(page, angle, rng) for page, angle in zip(pages, angles)], angles),
+    }
+
+    results = {
+        "timestamp": timestamp,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "image_options": image_options,
+        "preprocess_options": METHODS,
+        "angles": {case: case_angles for case, (_, case_angles) in cases.items()},
+        "cases": {},
+    }
+    for case, (case_pages, _) in cases.items():
+        results["cases"][case] = {}
+        for method, preprocess_options in METHODS.items():
+            print(f"=============== {case} / {method} 計測中 ===============")
+            page_results = [
+                measure_page(
+                    page, reference, preprocess_options, image_options,
+                    # 見比べられるよう、最初のページの送信画像を保存
+                    os.path.join(work_dir, f"{case}_{method}.png") if i == 0 else None)
+                for i, (page, reference) in enumerate(zip(case_pages, pages))
+            ]
+            results["cases"][case][method] = {"summary": summarize(page_results), "pages": page_results}
+
+    print_results(results)
+
+    result_path = os.path.join(work_dir, "preprocess.json")
+    with open(result_path, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果: {result_path}（最初のページの送信画像は同じディレクトリ）")
+
+    print(f"=============== 前処理の計測終了 ===============")
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="ページ画像の前処理の計測")
+    parser.add_argument("-n", "--num_pages", type=int, default=6, help="計測するページ数を指定してください。")
+    parser.add_argument("--max_angle", type=float, default=2.0, help="scanned のページの傾きの上限（度）を指定してください。")
+    parser.add_argument("-o", "--output_dir", default="output/benchmark", help="結果の出力先を指定してください。")
+
+    args = parser.parse_args()
+
+    main(args.num_pages, args.max_angle, args.output_dir)
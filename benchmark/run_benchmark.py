@@ -0,0 +1,201 @@
+'''
+OpenAIに接続せずに、pdf2md → exam_review の処理時間を計測する
+'''
+
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import platform
+from datetime import datetime
+
+from langchain_core.globals import set_llm_cache
+
+from src import exam_review
+from src.pdf2md import MODEL_NAME, prepare_exam, convert_exam, process_exam
+from src.modules.utils import setup_pdf_converter
+from src.modules.convert_client import ConverterClient
+from src.modules.cache import setup_llm_cache
+from src.modules.metrics import MetricsLedger
+from src.modules.llm import set_chat_model_factory, create_chat_model
+from src.modules.chat_models import FakeChatModel
+from src.modules.scheduler import setup_scheduler
+from benchmark.synthetic_exam import generate_exam_pdfs
+
+
+# ベンチマーク固有の項目（これ以外のシナリオの項目は、pdf2mdの設定として渡す）
+SCENARIO_KEYS = ("name", "runs", "cache", "fake_model")
+
+
+# ステージごとの計測結果を集計
+#   wall はセクションごとの経過時間（最初の開始〜最後の終了）の合計で、
+#   並列に呼び出した場合は latency の合計より短くなる
+def stage_timings(events):
+    stages = {}
+    for event in events:
+        stage = stages.setdefault(event["stage"], {"calls": 0, "latency": 0.0, "spans": {}})
+        stage["calls"] += 1
+        stage["latency"] += event["latency"]
+        span = stage["spans"].setdefault(event["section"], [event["start"], event["start"] + event["latency"]])
+        span[0] = min(span[0], event["start"])
+        span[1] = max(span[1], event["start"] + event["latency"])
+
+    return {
+        name: {
+            "calls": stage["calls"],
+            "wall": sum(end - start for start, end in stage["spans"].values()),
+            "latency": stage["latency"],
+        }
+        for name, stage in stages.items()
+    }
+
+
+# シナリオを1回実行し、計測結果を返す
+def run_scenario(scenario, exam_configs, fake_options, converter, run_dir, run_review):
+    configs = {
+        **exam_configs,
+        **{key: value for key, value in scenario.items() if key not in SCENARIO_KEYS},
+        "output_dir": run_dir,
+    }
+
+    # 偽のモデルを使うよう差し替え
+    fake_options = {**fake_options, **scenario.get("fake_model", {})}
+    set_chat_model_factory(
+        lambda model_name, temperature: FakeChatModel(
+            model_name=model_name, temperature=temperature, **fake_options))
+
+    # LLMキャッシュ（シナリオ内の2回目以降の実行はキャッシュが効く）
+    llm_cache = None
+    if scenario.get("cache", False):
+        llm_cache = setup_llm_cache(os.path.join(os.path.dirname(run_dir), "llm_cache.sqlite3"))
+    else:
+        set_llm_cache(None)
+
+    ledger = MetricsLedger(os.path.join(run_dir, "metrics.jsonl"))
+    start_time = time.perf_counter()
+
+    exam = prepare_exam(configs, ledger=ledger)
+    # プロセスプールで変換する場合は、各プロセスでコンバーターを生成する
+    images_dict = convert_exam(exam, converter if configs.get("convert_workers", 1) <= 1 else None)
+
+    scheduler = setup_scheduler(configs.get("rate_limit"))
+    chat_model = create_chat_model(MODEL_NAME, temperature=0, scheduler=scheduler)
+    process_exam(exam, images_dict, chat_model)
+    if run_review:
+        exam_review.main(exam["output_dir"], chat_model=chat_model, ledger=ledger)
+
+    wall_time = time.perf_counter() - start_time
+    summary = ledger.summary()
+    return {
+        "wall_time": wall_time,
+        "stages": stage_timings(ledger.events),
+        "prompt_tokens": summary["total"]["prompt_tokens"],
+        "completion_tokens": summary["total"]["completion_tokens"],
+        "image_bytes": summary["total"]["image_bytes"],
+        "cost": summary["total"]["cost"],
+        "cache_hits": summary["total"]["cache_hits"],
+        "throttle": summary["total"]["throttle"],
+        "retries": summary["total"]["retries"],
+        "cache": llm_cache.stats() if llm_cache is not None else None,
+        "scheduler": scheduler.stats() if scheduler is not None else None,
+        "output_dir": exam["output_dir"],
+    }
+
+
+# 結果を表形式で表示
+def print_results(results, stage_names):
+    print(f"\n=============== ベンチマーク結果 ===============")
+    header = f"{'シナリオ':<24}{'全体(s)':>10}" + "".join(f"{name:>12}" for name in stage_names)
+    print(header + f"{'Tokens':>10}{'Cost(USD)':>12}{'Cache':>7}{'待機(s)':>10}{'再試行':>7}")
+    for scenario in results["scenarios"]:
+        for i, run in enumerate(scenario["runs"]):
+            label = f"{scenario['name']}#{i + 1}"
+            stages = "".join(
+                f"{run['stages'].get(name, {}).get('wall', 0.0):>12.2f}" for name in stage_names)
+            print(
+                f"{label:<24}{run['wall_time']:>10.2f}{stages}"
+                f"{run['prompt_tokens'] + run['completion_tokens']:>10}{run['cost']:>12.4f}{run['cache_hits']:>7}"
+                f"{run['throttle']:>10.2f}{run['retries']:>7}")
+    print()
+
+
+def main(bench_configs):
+
+    print(f"=============== ベンチマーク開始 ===============")
+
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    bench_dir = os.path.join(bench_configs.get("output_dir", "output/benchmark"), timestamp)
+    fake_options = bench_configs.get("fake_model", {})
+    run_review = bench_configs.get("run_review", True)
+
+    # 試験PDFを生成
+    exam_options = bench_configs.get("exam", {})
+    qs_pdf_path, ans_pdf_path, split_page = generate_exam_pdfs(os.path.join(bench_dir, "input"), **exam_options)
+    exam_configs = {"pdf_path": qs_pdf_path, "ans_pdf_path": ans_pdf_path, "split_page": split_page}
+
+    # PDFコンバーターの生成（モデルの読み込み）は1回のみ行い、別に計測する
+    #   doclingの変換時間を計測するため、変換サーバーは使わない
+    start_time = time.perf_counter()
+    converter = ConverterClient(None, pdf_converter=setup_pdf_converter())
+    converter_setup_time = time.perf_counter() - start_time
+
+    results = {
+        "timestamp": timestamp,
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "exam": {**exam_options, "split_page": split_page},
+        "fake_model": fake_options,
+        "converter_setup_time": converter_setup_time,
+        "scenarios": [],
+    }
+
+    try:
+        for scenario in bench_configs["scenarios"]:
+            print(f"=============== {scenario['name']} 計測中 ===============")
+            runs = []
+            for i in range(scenario.get("runs", 1)):
+                run_dir = os.path.join(bench_dir, scenario["name"], f"run{i + 1}")
+                runs.append(run_scenario(scenario, exam_configs, fake_options, converter, run_dir, run_review))
+            results["scenarios"].append({
+                "name": scenario["name"],
+                "options": {key: value for key, value in scenario.items() if key not in ("name", "runs")},
+                "runs": runs,
+            })
+    finally:
+        set_chat_model_factory(None)
+        set_llm_cache(None)
+
+    # 比較しやすいよう、結果をJSONで保存
+    result_path = os.path.join(bench_dir, "benchmark.json")
+    with open(result_path, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+    print_results(results, ["split", "convert", "image_prep", "ocr", "format", "review"])
+    print(f"PDFコンバーターの生成: {converter_setup_time:.2f}s")
+    print(f"結果: {result_path}")
+
+    print(f"=============== ベンチマーク終了 ===============")
+
+    return result_path
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="オフラインのベンチマーク")
+    parser.add_argument(
+        "-c", "--config", default="configs/config_benchmark.yml",
+        help="ベンチマーク設定ファイルのパスを指定してください。")
+
+    args = parser.parse_args()
+
+    # 設定ファイル読み込み
+    with open(args.config) as file:
+        bench_configs = yaml.safe_load(file)
+
+    main(bench_configs)
@@ -0,0 +1,126 @@
+'''
+ベンチマーク用の試験PDF（問題・解答例）を生成
+'''
+
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+
+# A4（150dpi）
+PAGE_SIZE = (1240, 1754)
+
+
+# 文章の行を描画し、次の描画位置を返す
+def draw_paragraph(draw, rng, top, num_lines):
+    for _ in range(num_lines):
+        words = [
+            "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+            for _ in range(rng.randint(10, 16))
+        ]
+        draw.text((100, top), " ".join(words), fill="black")
+        top += 28
+    return top + 20
+
+
+# 罫線付きの表を描画し、次の描画位置を返す
+def draw_table(draw, rng, top, table_no):
+    num_rows = rng.randint(3, 6)
+    num_cols = rng.randint(3, 5)
+    cell_width = (PAGE_SIZE[0] - 200) // num_cols
+    cell_height = 40
+
+    draw.text((100, top), f"Table {table_no}  Configuration list", fill="black")
+    top += 30
+    for row in range(num_rows + 1):
+        draw.line((100, top + row * cell_height, 100 + num_cols * cell_width, top + row * cell_height), fill="black", width=2)
+    for col in range(num_cols + 1):
+        draw.line((100 + col * cell_width, top, 100 + col * cell_width, top + num_rows * cell_height), fill="black", width=2)
+    for row in range(num_rows):
+        for col in range(num_cols):
+            text = f"item-{row}-{col}" if row > 0 else f"column {col + 1}"
+            draw.text((110 + col * cell_width, top + row * cell_height + 12), text, fill="black")
+    return top + num_rows * cell_height + 40
+
+
+# ネットワーク構成図風の図を描画し、次の描画位置を返す
+def draw_figure(draw, rng, top, figure_no):
+    num_nodes = rng.randint(3, 6)
+    height = 320
+    centers = []
+    for i in range(num_nodes):
+        x = 150 + i * (PAGE_SIZE[0] - 300) // max(num_nodes - 1, 1)
+        y = top + rng.randint(40, height - 80)
+        centers.append((x, y))
+    for (x1, y1), (x2, y2) in zip(centers, centers[1:]):
+        draw.line((x1, y1, x2, y2), fill="black", width=3)
+    for i, (x, y) in enumerate(centers):
+        if i % 2 == 0:
+            draw.rectangle((x - 50, y - 30, x + 50, y + 30), outline="black", width=3, fill="white")
+        else:
+            draw.ellipse((x - 50, y - 30, x + 50, y + 30), outline="black", width=3, fill="white")
+        draw.text((x - 25, y - 6), f"node{i + 1}", fill="black")
+    draw.text((PAGE_SIZE[0] // 2 - 80, top + height - 30), f"Figure {figure_no}  Network", fill="black")
+    return top + height + 20
+
+
+# 1ページ分の画像を作成（文章・表・図を組み合わせる）
+def render_page(rng, page_no, heading=None, with_table=False, with_figure=False):
+    image = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(image)
+
+    top = 120
+    if heading is not None:
+        draw.text((100, top), heading, fill="black")
+        top += 50
+    top = draw_paragraph(draw, rng, top, rng.randint(6, 12))
+    if with_table:
+        top = draw_table(draw, rng, top, page_no)
+    if with_figure:
+        top = draw_figure(draw, rng, top, page_no)
+    draw_paragraph(draw, rng, top, rng.randint(4, 8))
+
+    # ページ番号とコピーライト（OCRで除外される部分）
+    draw.text((PAGE_SIZE[0] // 2 - 10, PAGE_SIZE[1] - 80), f"- {page_no} -", fill="black")
+    draw.text((PAGE_SIZE[0] - 400, PAGE_SIZE[1] - 50), "(c) synthetic exam", fill="black")
+    return image
+
+
+# 画像のリストを複数ページのPDFとして保存
+def save_pdf(images, pdf_path):
+    images[0].save(pdf_path, save_all=True, append_images=images[1:], resolution=150)
+
+
+# 問題PDF・解答例PDFを生成し、(問題PDFのパス, 解答例PDFのパス, 各問題のページ範囲) を返す
+#   問題PDFは表紙1ページの後に、問題ごとに pages_per_section ページが続く
+def generate_exam_pdfs(output_dir, exam_name="bench", num_sections=3, pages_per_section=5, ans_pages=2, seed=0):
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    # 問題PDF
+    images = [render_page(rng, 1, heading="Synthetic Exam  Afternoon I")]
+    split_page = []
+    for section_no in range(1, num_sections + 1):
+        start_page = len(images) + 1
+        for i in range(pages_per_section):
+            page_no = len(images) + 1
+            images.append(render_page(
+                rng, page_no,
+                heading=f"Question {section_no}" if i == 0 else None,
+                with_table=i % 2 == 0,
+                with_figure=i % 2 == 1,
+            ))
+        split_page.append([start_page, len(images)])
+    qs_pdf_path = os.path.join(output_dir, f"{exam_name}_qs.pdf")
+    save_pdf(images, qs_pdf_path)
+
+    # 解答例PDF
+    images = [
+        render_page(rng, page_no, heading="Answers" if page_no == 1 else None, with_table=True)
+        for page_no in range(1, ans_pages + 1)
+    ]
+    ans_pdf_path = os.path.join(output_dir, f"{exam_name}_ans.pdf")
+    save_pdf(images, ans_pdf_path)
+
+    return qs_pdf_path, ans_pdf_path, split_page
@@ -0,0 +1,147 @@
+import os
+import yaml
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from src import exam_review
+from src.pdf2md import MODEL_NAME, prepare_exam, convert_exam, process_exam
+from src.modules.convert_client import ConverterClient, DEFAULT_SERVER_URL
+from src.modules.cache import setup_llm_cache
+from src.modules.manifest import find_latest_output_dir
+from src.modules.metrics import MetricsLedger
+from src.modules.page_filter import setup_page_index
+from src.modules.llm import create_chat_model
+from src.modules.scheduler import setup_scheduler
+
+# .envファイルから環境変数を読み込み
+load_dotenv()
+
+
+# バッチ設定から、試験ごとの設定のリストを作成
+#   exams 以外の項目は全試験の既定値とし、各試験で config を指定した場合はそのYAMLを読み込む
+def load_exam_configs(batch_configs):
+    defaults = {key: value for key, value in batch_configs.items() if key != "exams"}
+
+    exam_configs = []
+    for exam in batch_configs["exams"]:
+        configs = dict(defaults)
+        if "config" in exam:
+            with open(exam["config"]) as file:
+                configs.update(yaml.safe_load(file))
+        configs.update({key: value for key, value in exam.items() if key != "config"})
+        exam_configs.append(configs)
+
+    return exam_configs
+
+
+# 1試験分のLLM処理（OCR・整形・解説作成）を実施
+def run_llm_stages(exam, images_dict, chat_model, run_review):
+    process_exam(exam, images_dict, chat_model)
+    if run_review:
+        exam_review.main(exam["output_dir"], chat_model=chat_model, ledger=exam["ledger"])
+    return exam["output_dir"]
+
+
+def main(batch_configs):
+
+    print(f"=============== バッチ実行開始 ===============")
+
+    exam_configs = load_exam_configs(batch_configs)
+    exam_concurrency = batch_configs.get("exam_concurrency", 2)
+    run_review = batch_configs.get("run_review", True)
+
+    # LLMキャッシュを設定
+    llm_cache = setup_llm_cache(
+        batch_configs.get("cache_path", ".cache/llm_cache.sqlite3"),
+        max_size_mb=batch_configs.get("cache_max_size_mb", 1024),
+    )
+    # 全試験の呼び出しを1つのスケジューラーに通し、アカウントのレート制限内に収める
+    scheduler = setup_scheduler(batch_configs.get("rate_limit"))
+    # 全試験で共有するPDFコンバーターとLLMインスタンス（HTTPクライアントを使い回す）
+    #   変換サーバーが起動していればサーバーで、起動していなければプロセス内の1つのコンバーターで変換する
+    converter = ConverterClient(batch_configs.get("convert_server_url", DEFAULT_SERVER_URL))
+    chat_model = create_chat_model(MODEL_NAME, temperature=0, scheduler=scheduler)
+    # 全試験の計測結果を1つの台帳に記録
+    ledger_dir = batch_configs.get("output_dir", "output")
+    ledger = MetricsLedger(os.path.join(ledger_dir, f"batch_metrics_{datetime.now().strftime('%Y%m%d%H%M%S')}.jsonl"))
+    # 全試験で共有するページの索引（ある試験でOCRしたページとほぼ同じページは、他の試験でも使い回す）
+    page_index = setup_page_index(batch_configs.get("page_filter"))
+
+    # 変換済みでLLM処理待ちの試験数を制限（変換画像をメモリに溜め込みすぎないため）
+    pending = threading.BoundedSemaphore(exam_concurrency * 2)
+
+    def release_pending(future):
+        pending.release()
+
+    # doclingの変換（CPU）はメインスレッドで順に行い、
+    # GPTの処理（ネットワーク）は、次の試験の変換と並行してスレッドで実施
+    futures = []
+    with ThreadPoolExecutor(max_workers=exam_concurrency) as executor:
+        for configs in exam_configs:
+            resume_dir = None
+            if configs.get("resume", False):
+                exam_id = os.path.splitext(os.path.basename(configs["pdf_path"]))[0]
+                resume_dir = find_latest_output_dir(configs["output_dir"], exam_id)
+
+            pending.acquire()
+            try:
+                print(f"=============== {configs['pdf_path']} 変換中 ===============")
+                exam = prepare_exam(configs, resume_dir, ledger=ledger, page_index=page_index)
+                images_dict = convert_exam(exam, converter)
+            except Exception as e:
+                pending.release()
+                print(f"{configs['pdf_path']} の変換でエラーが出ました\n{e}")
+                futures.append((configs, None))
+                continue
+
+            future = executor.submit(run_llm_stages, exam, images_dict, chat_model, run_review)
+            future.add_done_callback(release_pending)
+            futures.append((configs, future))
+
+        # 結果を集計（1試験の失敗で他の試験は止めない）
+        failed_list = []
+        for configs, future in futures:
+            if future is None:
+                failed_list.append(configs["pdf_path"])
+                continue
+            try:
+                output_dir = future.result()
+                print(f"{configs['pdf_path']} 完了: {output_dir}")
+            except Exception as e:
+                print(f"{configs['pdf_path']} の処理でエラーが出ました\n{e}")
+                failed_list.append(configs["pdf_path"])
+
+    if llm_cache is not None:
+        llm_cache.print_stats()
+    if scheduler is not None:
+        scheduler.print_stats()
+    if page_index is not None:
+        page_index.print_stats()
+
+    # 計測結果を集計
+    ledger.print_summary()
+    ledger.save_summary(ledger.jsonl_path.replace(".jsonl", "_summary.json"))
+
+    print(f"成功: {len(exam_configs) - len(failed_list)}件, 失敗: {len(failed_list)}件")
+    for pdf_path in failed_list:
+        print(f"  失敗: {pdf_path}")
+
+    print(f"=============== バッチ実行終了 ===============")
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="複数試験の一括変換")
+    parser.add_argument("-c", "--config", help="バッチ設定ファイルのパスを指定してください。")
+
+    args = parser.parse_args()
+
+    # 設定ファイル読み込み
+    with open(args.config) as file:
+        batch_configs = yaml.safe_load(file)
+
+    main(batch_configs)
@@ -0,0 +1,132 @@
+'''
+各処理をサブコマンドで実行するCLI
+（各サブコマンドで必要なモジュールは、そのサブコマンドを実行する時点で読み込む）
+
+例:
+    python -m src.cli pdf2md -c configs/config_pdf2md.yml
+    python -m src.cli pdf2md -c configs/config_pdf2md.yml --resume --dry-run
+    python -m src.cli review -i output/2021r03h_nw_pm1_qs_20241110070344
+    python -m src.cli agent -i output/2021r03h_nw_pm1_qs_20241110070344/mon1
+    python -m src.cli agent -i output/2021r03h_nw_pm1_qs_20241110070344/mon1 -s 20241110080000
+'''
+
+import sys
+import argparse
+
+
+# 設定ファイル読み込み
+def load_config(config_path):
+    import yaml
+
+    with open(config_path) as file:
+        return yaml.safe_load(file)
+
+
+def run_pdf2md(args):
+    from src import pdf2md
+
+    configs = load_config(args.config)
+    resume_dir = pdf2md.resolve_resume_dir(configs, args.resume)
+    if args.dry_run:
+        return 0 if pdf2md.dry_run(configs, resume_dir) else 1
+    pdf2md.main(configs, resume_dir=resume_dir)
+    return 0
+
+
+def run_review(args):
+    from src import exam_review
+
+    exam_review.main(args.input_dir, max_concurrency=args.max_concurrency, configs=load_config(args.config))
+    return 0
+
+
+def run_agent(args):
+    from src import exam_agent
+
+    exam_agent.main(args.input_dir, load_config(args.config), args.session_id)
+    return 0
+
+
+def run_batch(args):
+    from src import batch
+
+    batch.main(load_config(args.config))
+    return 0
+
+
+def run_convert_server(args):
+    from src import convert_server
+
+    convert_server.main(args.host, args.port, args.profile)
+    return 0
+
+
+def run_benchmark(args):
+    from benchmark import run_benchmark
+
+    run_benchmark.main(load_config(args.config))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="IPA試験問題の変換・解説作成")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # PDFをマークダウンに変換
+    sub = subparsers.add_parser("pdf2md", help="問題・解答例のPDFをマークダウンに変換します。")
+    sub.add_argument("-c", "--config", required=True, help="設定ファイルのパスを指定してください。")
+    sub.add_argument(
+        "--resume", nargs="?", const="latest", default=None,
+        help="既存の出力ディレクトリから再開します。ディレクトリ省略時は最新のものを使用します。")
+    sub.add_argument(
+        "--dry-run", action="store_true",
+        help="変換・LLM呼び出しを行わず、入力の検証と実行内容の表示のみ行います。")
+    sub.set_defaults(func=run_pdf2md)
+
+    # 解説の作成
+    sub = subparsers.add_parser("review", help="変換結果から各問題の解説を作成します。")
+    sub.add_argument(
+        "-i", "--input_dir", nargs="+", required=True, help="pdf2mdの出力ディレクトリを指定してください（複数指定可）。")
+    sub.add_argument("--max_concurrency", type=int, default=4, help="同時に作成する解説の数を指定してください。")
+    sub.add_argument(
+        "-c", "--config", default="configs/config_review.yml", help="設定ファイルのパスを指定してください。")
+    sub.set_defaults(func=run_review)
+
+    # 質問応答エージェント
+    sub = subparsers.add_parser("agent", help="試験問題の質問応答エージェントを起動します。")
+    sub.add_argument("-i", "--input_dir", required=True, help="問題ごとの出力ディレクトリ（monN）を指定してください。")
+    sub.add_argument(
+        "-c", "--config", default="configs/config_agent.yml", help="設定ファイルのパスを指定してください。")
+    sub.add_argument("-s", "--session_id", default=None, help="再開するセッションIDを指定してください。")
+    sub.set_defaults(func=run_agent)
+
+    # 複数試験の一括変換
+    sub = subparsers.add_parser("batch", help="複数の試験を一括で変換します。")
+    sub.add_argument("-c", "--config", required=True, help="バッチ設定ファイルのパスを指定してください。")
+    sub.set_defaults(func=run_batch)
+
+    # 変換サーバー
+    sub = subparsers.add_parser("convert-server", help="doclingの変換サーバーを起動します。")
+    sub.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレスを指定してください。")
+    sub.add_argument("--port", type=int, default=8765, help="待ち受けるポートを指定してください。")
+    sub.add_argument(
+        "--profile", default="accurate", help="起動時に読み込む変換プロファイル（fast / balanced / accurate）を指定してください。")
+    sub.set_defaults(func=run_convert_server)
+
+    # オフラインのベンチマーク
+    sub = subparsers.add_parser("benchmark", help="OpenAIに接続せずに処理時間を計測します。")
+    sub.add_argument(
+        "-c", "--config", default="configs/config_benchmark.yml",
+        help="ベンチマーク設定ファイルのパスを指定してください。")
+    sub.set_defaults(func=run_benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+'''
+doclingのモデルを読み込んだまま待機し、PDFの変換を受け付けるサーバー
+（pdf2md.py などは、起動していればこのサーバーで変換する）
+'''
+
+import io
+import json
+import time
+import base64
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from docling.datamodel.base_models import DocumentStream
+
+from src.modules.utils import DEFAULT_CONVERTER_PROFILE, converter_profile_key, setup_pdf_converter
+from src.modules.convert import IMAGE_TYPES, convert_pdf, sections_to_json
+
+
+# プロファイルのPDFコンバーターを取得（起動時のプロファイル以外は、初めて使う時点で生成して保持する）
+def get_pdf_converter(server, profile):
+    key = converter_profile_key(profile)
+    if key not in server.pdf_converters:
+        print(f"変換プロファイル {profile} のコンバーターを生成します。")
+        server.pdf_converters[key] = setup_pdf_converter(profile)
+    return server.pdf_converters[key]
+
+
+class ConvertRequestHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # 稼働確認
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"status": "ok", "jobs": self.server.jobs})
+
+    # 変換の依頼
+    #   {"pdf_path": パス} または {"pdf_bytes": base64, "name": ファイル名} と、
+    #   "page_ranges"（省略時はPDF全体）, "image_types"（省略時は全種類）,
+    #   "profile"（省略時はサーバー起動時のプロファイル）を受け取る
+    def do_POST(self):
+        if self.path != "/convert":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        try:
+            job = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if "pdf_bytes" in job:
+                source = DocumentStream(
+                    name=job.get("name", "input.pdf"), stream=io.BytesIO(base64.b64decode(job["pdf_bytes"])))
+            else:
+                source = job["pdf_path"]
+            image_types = job.get("image_types", IMAGE_TYPES)
+            profile = job.get("profile") or self.server.profile
+
+            start_time = time.perf_counter()
+            # doclingのコンバーターは同時に1件ずつ使う
+            with self.server.convert_lock:
+                pdf_converter = get_pdf_converter(self.server, profile)
+                sections = convert_pdf(pdf_converter, source, job.get("page_ranges"))
+                self.server.jobs += 1
+            print(f"{job.get('pdf_path', job.get('name'))} を変換しました（{time.perf_counter() - start_time:.1f}s）")
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        self._send_json(200, {"sections": sections_to_json(sections, image_types)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(host, port, profile=DEFAULT_CONVERTER_PROFILE):
+
+    print(f"=============== 変換サーバー起動中 ===============")
+
+    server = ThreadingHTTPServer((host, port), ConvertRequestHandler)
+    # モデルの読み込みは起動時に1回のみ
+    server.profile = profile
+    server.pdf_converters = {}
+    get_pdf_converter(server, profile)
+    server.convert_lock = threading.Lock()
+    server.jobs = 0
+
+    print(f"http://{host}:{port} で待機しています。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    print(f"=============== 変換サーバー終了 ===============")
+
+
+if __name__=="__main__":
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="PDF変換サーバー")
+    # ローカルのファイルを読むため、既定では外部から接続できないようにする
+    parser.add_argument("--host", default="127.0.0.1", help="待ち受けるアドレスを指定してください。")
+    parser.add_argument("--port", type=int, default=8765, help="待ち受けるポートを指定してください。")
+    parser.add_argument(
+        "--profile", default=DEFAULT_CONVERTER_PROFILE, help="起動時に読み込む変換プロファイルを指定してください。")
+
+    args = parser.parse_args()
+
+    main(args.host, args.port, args.profile)
@@ -1,70 +1,202 @@
 import os
-import base64
+import time
+import yaml
+import argparse
+import threading
+from concurrent.futures import Future
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from typing import Annotated  # 型ヒント用のモジュール
 from typing_extensions import TypedDict  # 型ヒント用の拡張モジュール
-from langgraph.graph import StateGraph
-from langgraph.graph.message import add_messages
 
 from langchain_core.prompts import PromptTemplate
 
+from src.modules.llm import create_chat_model, estimate_message_tokens
+from src.modules.metrics import MetricsLedger
+from src.modules.agent_memory import get_memory_options, apply_memory
+from src.modules.retrieval import get_retrieval_options, load_index, format_chunks
+from src.modules.exam_files import exam_id_of, find_mon_md_path, review_md_path
+from src.modules.ocr import encode_image
+from src.modules.agent_session import get_session_options, new_session_id, session_thread_id, open_checkpointer
+
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
-def main():
 
-    input_dir = "output/2021r03h_nw_pm1_qs_20241110070344/mon1"
+# システムプロンプト
+SYSTEM_PROMPT = \
+"""
+あなたは、ネットワークのスペシャリストです。
+ユーザーからの質問に、分かりやすく回答してください。
+"""
 
-    # 情報取得
-    mon_id = input_dir.split("/")[-1]
-    exam_id = "_".join(input_dir.split("/")[-2].split("_")[0:-1])
-    exam_id = exam_id.replace('_qs', '')
+# 検索した部分のみを渡す場合のシステムプロンプト
+RETRIEVAL_SYSTEM_PROMPT = \
+"""
+あなたは、ネットワークのスペシャリストです。
+ユーザーからの質問に、分かりやすく回答してください。
+質問ごとに、関連する試験問題・解説・解答例の抜粋を<参考資料>として渡します。
+参考資料に基づいて回答し、どの試験・問題についての回答かを示してください。
+参考資料に該当する内容が無い場合は、その旨を伝えてください。
+"""
 
-    mon_md_path = os.path.join(input_dir, f"{exam_id}_{mon_id}.md")
-    with open(mon_md_path, mode="r") as f:
-        mon_md_text = f.read()
-    review_md_path = os.path.join(input_dir, f"{exam_id}_{mon_id}_review.md")
-    with open(review_md_path, mode="r") as f:
-        review_md_text = f.read()
-    
-    # 状態の型定義。messagesにチャットのメッセージ履歴を保持する
+
+# チャットボットのグラフを構築
+#   memory_options は会話履歴の管理方法（agent_memory.DEFAULT_MEMORY_OPTIONS）
+#   ledger を渡した場合は、各ターンのLLM呼び出しを記録する
+#   retriever（retrieval.RetrievalIndex）を渡した場合は、質問ごとに関連する部分を top_k 件検索して渡す
+#   figure_dir（monN）を渡した場合は、図・表の画像をLLMがツールで必要な時だけ取得する
+#   context_messages（システムプロンプト・試験問題・解説）は状態に含めず、毎回先頭に付けて送る
+#   （同じ問題の全てのセッションで共有し、チェックポイントには会話のみを保存する）
+#   checkpointer を渡した場合は、スレッドID（試験・問題・セッション）ごとに会話の状態を保存する
+#   （langgraph・langchain_openaiは読み込みに時間がかかるため、ここで読み込む）
+def build_agent(memory_options=None, ledger=None, exam_id=None, section=None, retriever=None, top_k=5,
+                figure_dir=None, context_messages=(), checkpointer=None):
+    from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage, RemoveMessage, convert_to_messages
+    from langchain_core.runnables import RunnableConfig
+    from langchain_core.runnables.config import merge_configs
+    from langchain_core.tools import tool
+    from langgraph.graph import StateGraph
+    from langgraph.graph.message import add_messages
+    from langgraph.prebuilt import ToolNode, tools_condition
+
+    memory_options = get_memory_options(memory_options)
+    context_messages = convert_to_messages(context_messages)
+
+    # 状態の型定義。messagesにチャットのメッセージ履歴（試験問題・解説の後の会話）を保持する
+    #   summary, summarized: 古い会話の要約と、要約済みの会話数
+    #   prompt_stats: 直前のLLM呼び出しで送ったプロンプトの統計
     class State(TypedDict):
         messages: Annotated[list, add_messages]
+        summary: str
+        summarized: int
+        prompt_stats: dict
     
     # グラフビルダーを作成し、チャットボットのフローを定義
     graph_builder = StateGraph(State)
 
     # OpenAIのLLMインスタンス作成
-    chat_model = ChatOpenAI(model="gpt-4o-mini", temperature=1)
-
-    # チャットボット関数。状態に応じてLLMが応答を生成
-    def chatbot(state: State):
-        return {"messages": [chat_model.invoke(state["messages"])]}
+    chat_model = create_chat_model("gpt-4o-mini", temperature=1, streaming=True)
+    # 会話の要約には、ツールを渡さないモデルを使う（要約の代わりにツールを呼び出さないよう、またツールの定義を送らないため）
+    memory_model = chat_model
+
+    # ＜図・表の取得ツール＞
+    #   ツールの結果（ToolMessage）には画像のパスのみを持たせ、画像はその回答を作る呼び出しにだけ添付する
+    #   （base64に変換した画像はセッション中キャッシュし、会話履歴には残さない）
+    tools = []
+    image_cache = {}
+
+    def fetch_image(kind, file_prefix, number):
+        image_path = os.path.join(figure_dir, f"{file_prefix}-{number}.png")
+        if not os.path.exists(image_path):
+            numbers = sorted(
+                int(file_name[len(file_prefix) + 1:-4]) for file_name in os.listdir(figure_dir)
+                if file_name.startswith(f"{file_prefix}-") and file_name.endswith(".png"))
+            return f"{kind}{number}はありません（取得できる{kind}: {numbers}）。", None
+        return f"{kind}{number}の画像を添付します。", {"kind": kind, "number": number, "path": image_path}
+
+    @tool(response_format="content_and_artifact")
+    def get_figure(number: int):
+        """試験問題の図の画像を取得する。図の内容（構成・接続関係・ラベルなど）を確認する必要がある場合にのみ使う。
+
+        Args:
+            number: 図の番号（図1なら1）
+        """
+        return fetch_image("図", "picture", number)
+
+    @tool(response_format="content_and_artifact")
+    def get_table(number: int):
+        """試験問題の表の画像を取得する。問題文の表の内容を画像で確認する必要がある場合にのみ使う。
+
+        Args:
+            number: 表の番号（表1なら1）
+        """
+        return fetch_image("表", "table", number)
+
+    if figure_dir is not None:
+        tools = [get_figure, get_table]
+        chat_model = chat_model.bind_tools(tools)
+
+    # 今回の質問の中で取得した図・表の画像を、1つのメッセージにまとめる（無い場合はNone）
+    def fetched_images_message(messages):
+        content = []
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, ToolMessage) and message.artifact:
+                image_path = message.artifact["path"]
+                if image_path not in image_cache:
+                    image_cache[image_path] = encode_image(image_path)
+                content[:0] = [
+                    {"type": "text", "text": f"{message.artifact['kind']}{message.artifact['number']}"},
+                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_cache[image_path]}"}},
+                ]
+        return HumanMessage(content=content) if content else None
+
+    # ノードのconfig（ストリーミングのコールバックを含む）に、計測台帳とタグを追加する
+    #   回答の呼び出しは、ストリーミングで表示する対象として stage をタグに付ける
+    def run_config(config, stage):
+        extra = ledger.config(stage=stage, exam=exam_id, section=section) if ledger is not None else {}
+        return merge_configs(config, {**extra, "tags": [stage]})
+
+    # チャットボット関数。会話履歴を絞り込んだ上で、LLMが応答を生成
+    def chatbot(state: State, config: RunnableConfig):
+        # 試験問題・解説は常に送り、以降の会話は設定に応じて絞り込む
+        prompt_messages, updates, stats = apply_memory(
+            {**state, "messages": context_messages + state["messages"], "pinned": len(context_messages)},
+            memory_model, memory_options, config=run_config(config, "agent_memory"))
+        if retriever is not None:
+            # 今回の質問で検索し（見つからない場合は直前の質問も含める）、参考資料を質問の直前に置く
+            #   （参考資料は履歴に残さないため、ターンごとのプロンプトの大きさは一定になる）
+            questions = [message.content for message in state["messages"] if isinstance(message, HumanMessage)]
+            results = retriever.search(questions[-1], top_k)
+            if len(results) == 0:
+                results = retriever.search("\n".join(questions[-2:]), top_k)
+            question_index = max(
+                i for i, message in enumerate(prompt_messages) if isinstance(message, HumanMessage))
+            prompt_messages = prompt_messages[:question_index] + \
+                [SystemMessage(content=format_chunks(results))] + prompt_messages[question_index:]
+            stats = {**stats, "retrieved_chunks": len(results)}
+        images_message = fetched_images_message(state["messages"])
+        if images_message is not None:
+            prompt_messages = prompt_messages + [images_message]
+            stats = {**stats, "figures": len(images_message.content) // 2}
+        if retriever is not None or images_message is not None:
+            stats = {**stats, "prompt_tokens": estimate_message_tokens(prompt_messages)}
+        response = chat_model.invoke(prompt_messages, config=run_config(config, "agent"))
+        if response.tool_calls:
+            return {"messages": [response], **updates, "prompt_stats": stats}
+
+        # 回答が出たら、今回の質問の中のツール呼び出しとその結果は会話履歴から除く
+        #   （取得した画像は、その質問への回答にのみ使う）
+        removals = []
+        for message in reversed(state["messages"]):
+            if isinstance(message, HumanMessage):
+                break
+            removals.append(RemoveMessage(id=message.id))
+        return {"messages": removals + [response], **updates, "prompt_stats": stats}
     
-    # グラフを構築
+    # グラフを構築（ツールを呼び出した場合は、結果を受けてもう一度回答を作る）
     graph_builder.add_node("chatbot", chatbot)
     graph_builder.set_entry_point("chatbot")
+    if len(tools) > 0:
+        graph_builder.add_node("tools", ToolNode(tools))
+        graph_builder.add_conditional_edges("chatbot", tools_condition)
+        graph_builder.add_edge("tools", "chatbot")
 
     # グラフをコンパイル
-    agent = graph_builder.compile()
+    return graph_builder.compile(checkpointer=checkpointer)
 
-    # チャットヒストリーを作成
-    state = {"messages": []}
 
-    # システムプロンプトを設定
-    system_prompt = \
-"""
-あなたは、ネットワークのスペシャリストです。
-ユーザーからの質問に、分かりやすく回答してください。
-"""
-    system_message = {
-        "role": "system",
-        "content": system_prompt
-    }
-    state["messages"].append(system_message)
+# 問題ごとの出力ディレクトリ（monN）から、試験問題と解説のメッセージを作成
+#   （図・表は番号の一覧のみで、画像は含めない）
+def load_exam_messages(input_dir, exam_id):
+    with open(find_mon_md_path(input_dir, exam_id, formatted=False), mode="r") as f:
+        mon_md_text = f.read()
+    with open(review_md_path(input_dir, exam_id), mode="r") as f:
+        review_md_text = f.read()
 
+    messages = []
 
     # 最初のユーザープロンプトを設定
     prompt_template1 = PromptTemplate(
@@ -82,47 +214,28 @@ def main():
         "exam_content": mon_md_text
     })
     user_prompt_text = user_prompt.text
-    user_content = []
-
-    # 図の設定
-    image_path_list = []
-    for file_name in os.listdir(input_dir):
-        if file_name.startswith("picture-"):
-            image_path = os.path.join(input_dir, file_name)
-            image_path_list.append(image_path)
-    image_path_list.sort()
-    
-    user_prompt_text += f"\n\n<図の詳細>"
-    for i in range(len(image_path_list)):
-        user_prompt_text += f"\n{i+1}つ目の画像:図{i+1}"
-    user_prompt_text += f"\n</図の詳細>"
-
-    
-    user_content.append(
-        {
-        "type": "text",
-        "text": user_prompt_text
-        }
-    )
 
-    for image_path in image_path_list:
-        # 画像をbase64形式のデータに変換
-        with open(image_path, "rb") as image_file:
-            # base64エンコード
-            encoded_string = base64.b64encode(image_file.read())
-            # バイト列を文字列にデコードして返す
-            image_data = encoded_string.decode('utf-8')
-
-            user_content.append(
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
-                }
-            )
-
-    state["messages"].append({
+    # 図・表の設定（画像は添付せず、番号の一覧のみ伝える。画像はLLMがツールで必要な時だけ取得する）
+    figure_lists = []
+    for kind, file_prefix, tool_name in (("図", "picture", "get_figure"), ("表", "table", "get_table")):
+        numbers = sorted(
+            int(file_name[len(file_prefix) + 1:-4]) for file_name in os.listdir(input_dir)
+            if file_name.startswith(f"{file_prefix}-") and file_name.endswith(".png")
+            and file_name[len(file_prefix) + 1:-4].isdigit())
+        if len(numbers) > 0:
+            figure_lists.append(
+                f"{'、'.join(f'{kind}{number}' for number in numbers)}（画像は {tool_name} で取得できます）")
+
+    if len(figure_lists) > 0:
+        user_prompt_text += f"\n\n<図の詳細>"
+        for figure_list in figure_lists:
+            user_prompt_text += f"\n{figure_list}"
+        user_prompt_text += f"\n</図の詳細>"
+        user_prompt_text += f"\n図や表の内容を確認する必要がある場合のみ、画像を取得してください。"
+
+    messages.append({
             "role": "user", 
-            "content": user_content
+            "content": user_prompt_text
         },
     )
 
@@ -143,23 +256,136 @@ def main():
         "exam_review": review_md_text
     })
 
-    state["messages"].append(
+    messages.append(
         {"role": "assistant", "content": assistant_prompt.text},
     )
 
+    return messages
+
+
+def main(input_dir, configs=None, session_id=None):
+    configs = configs or {}
+
+    retrieval_options = get_retrieval_options(configs.get("retrieval"))
+    session_options = get_session_options(configs.get("session"))
+
+    # 情報取得
+    mon_id = os.path.basename(os.path.normpath(input_dir))
+    exam_id = exam_id_of(os.path.dirname(os.path.normpath(input_dir)))
+    if retrieval_options["enabled"]:
+        # 試験全体や複数の試験を対象にできるため、入力ディレクトリ名で記録する
+        exam_id, mon_id = os.path.basename(os.path.normpath(input_dir)), "all"
+
+    # セッション（会話の状態は、試験・問題・セッションごとに保存し、セッションIDを指定すると再開できる）
+    resume = session_id is not None
+    session_id = session_id or new_session_id()
+    agent_config = {"configurable": {"thread_id": session_thread_id(exam_id, mon_id, session_id)}}
+    print(f"セッションID: {session_id}（-s {session_id} で再開できます）")
+
+    # システムプロンプトを設定
+    context_messages = [{
+        "role": "system",
+        "content": RETRIEVAL_SYSTEM_PROMPT if retrieval_options["enabled"] else SYSTEM_PROMPT
+    }]
+
+    if not retrieval_options["enabled"]:
+        # 試験問題と解説を最初に渡す
+        context_messages += load_exam_messages(input_dir, exam_id)
+
+    # グラフの構築（モジュールの読み込みを含む）は、ユーザーの入力を待つ間にバックグラウンドで行う
+    #   （すぐに終了した場合に構築を待たないよう、デーモンスレッドで行う）
+    agent_future = Future()
+
+    # 各ターンのLLM呼び出しの計測台帳
+    ledger = MetricsLedger(os.path.join(input_dir, "agent_metrics.jsonl"))
+    memory_options = configs.get("memory")
+
+    def build_agent_in_background():
+        try:
+            retriever = None
+            if retrieval_options["enabled"]:
+                # 索引は試験の出力ディレクトリごとに保存し、元のファイルが変わった場合のみ作り直す
+                retriever = load_index(input_dir, retrieval_options["max_chunk_chars"])
+            # 図・表の取得ツールは、問題ごとのディレクトリ（monN）を指定した場合のみ使う
+            figure_dir = None if retrieval_options["enabled"] else input_dir
+            agent_future.set_result(build_agent(
+                memory_options, ledger, exam_id, mon_id, retriever, retrieval_options["top_k"], figure_dir,
+                context_messages, open_checkpointer(session_options["db_path"])))
+        except Exception as e:
+            agent_future.set_exception(e)
+
+    threading.Thread(target=build_agent_in_background, daemon=True).start()
+
+    # 途中で止まった回答があるかどうか（エラーで中断した場合など）
+    def has_pending_turn():
+        return agent_future.done() and agent_future.exception() is None and \
+            len(agent_future.result().get_state(agent_config).next) > 0
+
+    if resume:
+        # 保存済みの会話を読み込む（試験問題・解説は毎回ファイルから作るため、会話のみ）
+        messages = agent_future.result().get_state(agent_config).values.get("messages", [])
+        num_turns = sum(1 for message in messages if message.type == "human")
+        if num_turns == 0:
+            print(f"セッション {session_id} の会話はありません。新しく開始します。")
+        else:
+            print(f"セッション {session_id} の会話（{num_turns}件）を再開します。")
+            if messages[-1].type == "ai":
+                print("Assistant (前回の最後の回答):", messages[-1].content)
+
 
     # ユーザーの入力に基づいてチャットボットが応答を生成し、その過程をリアルタイムでストリームする関数
-    def stream_graph_updates(user_input: str):
-        # ユーザーの入力をメッセージに追加
-        state["messages"].append(("user", user_input))  
+    #   user_input が None の場合は、保存済みの状態から中断したところを再実行する
+    def stream_graph_updates(user_input):
+        # ユーザーの入力をメッセージに追加（会話の状態はチェックポイントに保存される）
+        graph_input = None if user_input is None else {"messages": [("user", user_input)]}
         
-        # グラフのstreamメソッドを使用して、メッセージに応じたイベントを処理
-        for event in agent.stream(state):
-            for value in event.values():
-                # チャットボットの応答をメッセージに追加
+        # グラフのstreamメソッドを使用して、回答をトークン単位で表示しつつ、ノードの結果で状態を更新
+        agent = agent_future.result()
+        start_time = time.perf_counter()
+        first_token_time = None
+        # 図・表を取得した場合は、1回の質問でLLMを複数回呼び出すため、入力トークン数は合計する
+        prompt_tokens = 0
+        # 中断した場合やツールの呼び出しのみの場合は、回答・統計が無いことがある
+        stats = {}
+        response = None
+        for mode, event in agent.stream(graph_input, agent_config, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                message_chunk, metadata = event
+                # 会話の要約の呼び出しは表示しない
+                if "agent" not in metadata.get("tags", []) or not message_chunk.content:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start_time
+                    print("Assistant: ", end="")
+                print(message_chunk.content, end="", flush=True)
+                continue
+
+            for value in (value for node, value in event.items() if node == "chatbot"):
+                stats = value["prompt_stats"]
+                prompt_tokens += stats["prompt_tokens"]
                 response = value["messages"][-1].content
-                state["messages"].append(("assistant", response))  # 応答もメッセージリストに追加
-                print("Assistant:", response)
+
+        # ストリーミングで返ってこなかった場合は、まとめて表示
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - start_time
+            print("Assistant:", response or "（回答を得られませんでした）", end="")
+        total_time = time.perf_counter() - start_time
+        print()
+        if len(stats) > 0:
+            print(
+                f"（プロンプト: 推定 {prompt_tokens} tokens、直近の会話 {stats['history_turns']}件、"
+                f"省略した会話 {stats['dropped_turns']}件、要約 {stats['summary_tokens']} tokens"
+                f"{'、取得した図・表 ' + str(stats['figures']) + '枚' if 'figures' in stats else ''}"
+                f"{'、参考資料 ' + str(stats['retrieved_chunks']) + '件' if 'retrieved_chunks' in stats else ''}、"
+                f"最初の応答まで {first_token_time:.2f}s、全体 {total_time:.2f}s）")
+        # ターンごとの体感の待ち時間（最初のトークンまで）と全体の時間を記録
+        ledger.record(
+            "agent_turn", exam=exam_id, section=mon_id, latency=total_time,
+            ttft=first_token_time, estimated_prompt_tokens=prompt_tokens)
+
+    if resume and has_pending_turn():
+        print("中断した回答を再実行します。")
+        stream_graph_updates(None)
 
     # 無限ループを使用してユーザー入力を連続的に処理
     while True:
@@ -170,6 +396,8 @@ def main():
             # "quit", "exit", "q"の入力でループを終了
             if user_input.lower() in ["quit", "exit", "q"]:
                 print("Goodbye!")  # 終了メッセージを表示
+                if len(ledger.events) > 0:
+                    ledger.print_summary()
                 break  # ループを抜ける
 
             # ユーザーの入力を基にチャットボットが応答を生成し、リアルタイムで出力
@@ -178,9 +406,30 @@ def main():
         except Exception as e:
 
             print(f"エラーが出ました\n{e}")  # 既定のユーザー入力を表示
-            stream_graph_updates(user_input)  # その入力に対してチャットボットが応答を生成
+            # 会話は保存済みのため、途中で止まった回答があれば保存済みの状態から再実行する
+            try:
+                if has_pending_turn():
+                    stream_graph_updates(None)
+            finally:
+                print(f"セッション {session_id} は -s {session_id} で再開できます。")
             break  # エラーハンドリング後にループを終了
 
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="試験問題の質問応答エージェント")
+    parser.add_argument(
+        "-i", "--input_dir", default="output/2021r03h_nw_pm1_qs_20241110070344/mon1",
+        help="問題ごとの出力ディレクトリ（monN）を指定してください。")
+    parser.add_argument(
+        "-c", "--config", default="configs/config_agent.yml", help="設定ファイルのパスを指定してください。")
+    parser.add_argument("-s", "--session_id", default=None, help="再開するセッションIDを指定してください。")
+
+    args = parser.parse_args()
+
+    # 設定ファイル読み込み
+    with open(args.config) as file:
+        configs = yaml.safe_load(file)
+
+    main(args.input_dir, configs, args.session_id)
\ No newline at end of file
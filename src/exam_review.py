@@ -1,42 +1,34 @@
 import os
+import yaml
+import argparse
 
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import MarkdownListOutputParser
 from langchain_core.output_parsers import StrOutputParser
-from langchain_community.callbacks.manager import get_openai_callback
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+from src.modules.cache import setup_llm_cache
+from src.modules.manifest import Manifest, hash_values
+from src.modules.metrics import MetricsLedger
+from src.modules.llm import create_chat_model, estimate_tokens
+from src.modules.answer_index import build_answer_index, answer_slice, find_question_no
+from src.modules.exam_files import find_exam_files, review_md_path
+from src.modules.scheduler import setup_scheduler
+from src.modules.utils import write_text_atomic
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
-def main():
-    input_dir = "output/2021r03h_nw_pm1_qs_20241110070344"
-
-    # 情報取得
-    exam_id = "_".join(input_dir.split("/")[-1].split("_")[0:-1])
-    exam_id = exam_id.replace('_qs', '')
-
-    ans_md_path = os.path.join(input_dir, "ans", f"{exam_id}_ans.md")
 
-    mon_md_path_list = []
-    for dir in os.listdir(input_dir):
-        if dir.startswith("mon"):
-            mon_dir_path = os.path.join(input_dir, dir)
-            mon_md_path = os.path.join(
-                input_dir, dir, f"{exam_id}_mon{dir.replace('mon', '')}_md.md"
-            )
-            mon_md_path_list.append((mon_dir_path, mon_md_path))
-    mon_md_path_list.sort()
+# 使用するモデル
+MODEL_NAME = "gpt-4o"
 
-    # OpenAIのLLMインスタンス作成
-    chat_model = ChatOpenAI(model="gpt-4o", temperature=0)
-
-    # プロンプトテンプレートの準備
-    prompt_template = PromptTemplate(
-        input_variables=["exam_content", "exam_ans"],
-        template=\
+# プロンプトテンプレート
+PROMPT_TEMPLATE = PromptTemplate(
+    input_variables=["exam_content", "exam_ans"],
+    template=\
 """
 
 あなたは天才的な試験解説者です。
@@ -56,43 +48,165 @@ def main():
 
 出力には、必ず解答例と解説のみで、余計な文章は含めないでください。
 """,
-    )
+)
 
-    # OutputParserの準備
-    output_parser = StrOutputParser()
 
-    chain = prompt_template | chat_model | output_parser
+# 1試験分の、解説の作成が必要な問題の一覧を作成（入力が変わっていない問題は省略）
+def prepare_review_jobs(input_dir, manifest, ledger):
+    exam_id, ans_md_path, mon_md_path_list = find_exam_files(input_dir)
 
     with open(ans_md_path, mode="r") as f:
         exam_ans_text = f.read()
 
+    # 解答例を問題ごとに分割し、各問題には該当する部分のみ渡す
+    ans_index = build_answer_index(exam_ans_text)
+    ans_tokens = estimate_tokens(exam_ans_text)
+
+    jobs = []
     for i, (mon_dir_path, mon_md_path) in enumerate(mon_md_path_list):
 
-        # if i != 1:
-        #     continue
-
-        with get_openai_callback() as cb:
-            with open(mon_md_path, mode="r") as f:
-                exam_mon_text = f.read()
-
-            output = chain.invoke(
-                {   
-                    "exam_content": exam_mon_text,
-                    "exam_ans": exam_ans_text,
-                })
-            
-            output_path = os.path.join(mon_dir_path, f"{exam_id}_mon{i+1}_review.md")
-            with open(output_path, mode="w") as f:
-                f.write(output)
-            
-            
-            print(f"\nTotal Tokens: {cb.total_tokens}")
-            print(f"Prompt Tokens: {cb.prompt_tokens}")
-            print(f"Completion Tokens: {cb.completion_tokens}")
-            print(f"Total Cost (USD): ${cb.total_cost}\n")
-            
-        
+        with open(mon_md_path, mode="r") as f:
+            exam_mon_text = f.read()
+
+        # 問題番号は問題文の見出しから取得し、見つからない場合はディレクトリの順番とする
+        section_name = os.path.basename(mon_dir_path)
+        question_no = find_question_no(exam_mon_text) or i + 1
+        exam_ans_slice = answer_slice(ans_index, question_no)
+        if not exam_ans_slice:
+            print(f"{section_name}: 解答例に問{question_no}が見つからないため、解答例全体を渡します。")
+            exam_ans_slice = exam_ans_text
+
+        # 入力が変わっていなければ省略（他の問題の解答例が変わっても作り直さない）
+        input_hash = hash_values(exam_mon_text, exam_ans_slice, PROMPT_TEMPLATE.template, MODEL_NAME)
+        if manifest.is_fresh("review", section_name, input_hash):
+            print(f"{exam_id} {section_name} の解説は作成済みのため、省略します。")
+            continue
+
+        tokens_saved = ans_tokens - estimate_tokens(exam_ans_slice)
+        if exam_ans_slice is not exam_ans_text:
+            print(f"{exam_id} {section_name}: 解答例は問{question_no}の部分のみ渡します（推定 {tokens_saved} tokens 削減）")
+
+        jobs.append({
+            "exam_id": exam_id,
+            "section": section_name,
+            "inputs": {"exam_content": exam_mon_text, "exam_ans": exam_ans_slice},
+            "input_hash": input_hash,
+            "output_path": review_md_path(mon_dir_path, exam_id),
+            "tokens_saved": tokens_saved,
+            "manifest": manifest,
+            "ledger": ledger,
+        })
+
+    return jobs
+
+
+# 1問分の解説を作成して保存（失敗した場合は例外を返す）
+#   一時的なエラーの再試行は、スケジューラー（無い場合はOpenAIのクライアント）が行う
+def review_one(chain, job):
+    config = job["ledger"].config(
+        stage="review", exam=job["exam_id"], section=job["section"], priority=2,
+        prompt_tokens_saved=job["tokens_saved"])
+    try:
+        output = chain.invoke(job["inputs"], config=config)
+        # 書き込み途中で中断しても、不完全な解説が残らないようにする
+        write_text_atomic(job["output_path"], output)
+        job["manifest"].record("review", job["section"], job["input_hash"], [job["output_path"]])
+        print(f"{job['exam_id']} {job['section']} の解説を作成しました。")
+        return None
+    except Exception as e:
+        print(f"{job['exam_id']} {job['section']} の解説の作成に失敗しました: {e}")
+        job["manifest"].record_failure("review", job["section"], job["input_hash"], e)
+        return e
+
+
+# 全ての問題の解説を並列に作成し、失敗した (試験ID, 問題) のリストを返す
+#   1問が失敗しても、他の問題の処理は続ける
+def run_review_jobs(chain, jobs, max_concurrency=4):
+    if len(jobs) == 0:
+        return []
+
+    # 同時リクエスト数を制限して並列実行（コールバックのコンテキストをスレッドに引き継ぐ）
+    with ContextThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [executor.submit(review_one, chain, job) for job in jobs]
+        results = [future.result() for future in futures]
+
+    return [(job["exam_id"], job["section"]) for job, result in zip(jobs, results) if result is not None]
+
+
+# 解説を作成する
+#   input_dirs はpdf2mdの出力ディレクトリ（複数の試験をまとめて処理する場合はリスト）
+#   chat_model・ledger を渡した場合はそれを共有し、渡さない場合は作成する
+def main(input_dirs, chat_model=None, ledger=None, max_concurrency=4, configs=None):
+    configs = configs or {}
+    cache_path = configs.get("cache_path", ".cache/llm_cache.sqlite3")
+    cache_max_size_mb = configs.get("cache_max_size_mb", 1024)
+    # レート制限（pdf2mdと同じく、指定しない場合はスケジューラーを使わない）
+    rate_limit = configs.get("rate_limit")
+    if rate_limit:
+        rate_limit = {"max_concurrency": max_concurrency, **rate_limit}
+    if isinstance(input_dirs, str):
+        input_dirs = [input_dirs]
+
+    # OpenAIのLLMインスタンス作成（渡された場合はそれを共有する）
+    llm_cache = None
+    scheduler = None
+    if chat_model is None:
+        # LLMキャッシュを設定
+        llm_cache = setup_llm_cache(cache_path, max_size_mb=cache_max_size_mb)
+        # レート制限内で送信し、一時的なエラーは再試行する
+        scheduler = setup_scheduler(rate_limit)
+        chat_model = create_chat_model(MODEL_NAME, temperature=0, scheduler=scheduler)
+
+    # OutputParserの準備
+    output_parser = StrOutputParser()
+
+    chain = PROMPT_TEMPLATE | chat_model | output_parser
+
+    # 全試験の、解説の作成が必要な問題を集める
+    jobs = []
+    own_ledgers = []
+    for input_dir in input_dirs:
+        # 各ステージの実行状況を記録するマニフェスト
+        manifest = Manifest(input_dir)
+        # LLM呼び出しの計測台帳（渡された場合はそれに記録し、渡さない場合は試験ごとに作成する）
+        exam_ledger = ledger
+        if exam_ledger is None:
+            exam_ledger = MetricsLedger(os.path.join(input_dir, "metrics.jsonl"))
+            own_ledgers.append(exam_ledger)
+        jobs += prepare_review_jobs(input_dir, manifest, exam_ledger)
+
+    failures = run_review_jobs(chain, jobs, max_concurrency=max_concurrency)
+
+    print(f"解答例の絞り込みで削減したプロンプト: 推定 {sum(job['tokens_saved'] for job in jobs)} tokens")
+    for exam_id, section_name in failures:
+        print(f"エラー: {exam_id} {section_name} の解説は作成できませんでした。")
+
+    if llm_cache is not None:
+        llm_cache.print_stats()
+    if scheduler is not None:
+        scheduler.print_stats()
+
+    for own_ledger in own_ledgers:
+        own_ledger.print_summary()
+
+    return failures
 
 
 if __name__=="__main__":
-    main()
\ No newline at end of file
+
+    # コマンドライン引数の取得
+    parser = argparse.ArgumentParser(description="試験解説の作成")
+    parser.add_argument(
+        "-i", "--input_dir", nargs="+", default=["output/2021r03h_nw_pm1_qs_20241110070344"],
+        help="pdf2md.pyの出力ディレクトリを指定してください（複数指定可）。")
+    parser.add_argument("--max_concurrency", type=int, default=4, help="同時に作成する解説の数を指定してください。")
+    parser.add_argument(
+        "-c", "--config", default="configs/config_review.yml", help="設定ファイルのパスを指定してください。")
+
+    args = parser.parse_args()
+
+    # 設定ファイル読み込み
+    with open(args.config) as file:
+        configs = yaml.safe_load(file)
+
+    main(args.input_dir, max_concurrency=args.max_concurrency, configs=configs)
@@ -0,0 +1,130 @@
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from src.modules.llm import estimate_tokens, estimate_message_tokens
+
+
+# 会話履歴の管理方法の既定値
+#   strategy: none（全て送る） / window（直近の会話のみ送る） / summarize（古い会話を要約して送る）
+#   window_turns: そのまま送る直近の会話（質問と回答）の数
+#   summarize_every: 要約する古い会話がこの数に達したら、まとめて要約する
+#   max_prompt_tokens: 1回の送信の入力トークン数の上限（推定値。超える場合は古い会話から外す）
+#   summary_max_tokens: 要約の長さの目安
+DEFAULT_MEMORY_OPTIONS = {
+    "strategy": "summarize",
+    "window_turns": 6,
+    "summarize_every": 4,
+    "max_prompt_tokens": 16000,
+    "summary_max_tokens": 800,
+}
+
+MEMORY_STRATEGIES = ("none", "window", "summarize")
+
+# 会話の要約のプロンプト
+SUMMARY_PROMPT = \
+"""
+以下は、試験問題についてのユーザーとアシスタントの会話です。
+<これまでの要約>がある場合はその内容も含めて、会話全体を{max_chars}文字以内で要約してください。
+ユーザーの疑問点と、それに対する回答の要点を残してください。
+
+<これまでの要約>
+{summary}
+</これまでの要約>
+
+<会話>
+{conversation}
+</会話>
+
+出力は、必ず要約の文章のみで、余計な文章は含めないでください。
+"""
+
+
+# 会話履歴の管理方法を取得（省略した項目は既定値）
+def get_memory_options(options=None):
+    options = {**DEFAULT_MEMORY_OPTIONS, **(options or {})}
+    if options["strategy"] not in MEMORY_STRATEGIES:
+        raise ValueError(f"会話履歴の管理方法が無効です: {options['strategy']}（{list(MEMORY_STRATEGIES)}）")
+    return options
+
+
+# 会話履歴を、ユーザーの質問から始まる会話（質問と回答）ごとに分割
+def split_turns(messages):
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or len(turns) == 0:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _message_text(message):
+    if isinstance(message.content, str):
+        return message.content
+    return "\n".join(part["text"] for part in message.content if part.get("type") == "text")
+
+
+# 古い会話を、これまでの要約に追加して要約し直す（要約が返らなかった場合は空文字列）
+def summarize_turns(chat_model, summary, turns, max_tokens, config=None):
+    conversation = "\n\n".join(
+        f"{'ユーザー' if isinstance(message, HumanMessage) else 'アシスタント'}: {_message_text(message)}"
+        for turn in turns for message in turn
+    )
+    prompt = SUMMARY_PROMPT.format(max_chars=max_tokens * 2, summary=summary, conversation=conversation)
+    return _message_text(chat_model.invoke([HumanMessage(content=prompt)], config=config)).strip()
+
+
+# 状態（会話履歴）から、今回LLMに送るメッセージを作成する
+#   state の messages は先頭 pinned 件（システムプロンプト・試験問題・解説）を常に送り、
+#   それ以降の会話は options の方法で絞り込む。履歴そのものは変更しない
+#   (送るメッセージ, 状態の更新, 統計) を返す
+def apply_memory(state, chat_model, options, config=None):
+    messages = state["messages"]
+    pinned = state.get("pinned", 0)
+    pinned_messages = list(messages[:pinned])
+    turns = split_turns(messages[pinned:])
+    summary = state.get("summary", "")
+    summarized = state.get("summarized", 0)
+    updates = {}
+
+    # ＜直近の会話に絞り込み＞（最後の会話は今回の質問）
+    if options["strategy"] == "window":
+        recent = turns[-(options["window_turns"] + 1):]
+    elif options["strategy"] == "summarize":
+        old_turns = turns[summarized:max(summarized, len(turns) - (options["window_turns"] + 1))]
+        if len(old_turns) >= options["summarize_every"]:
+            new_summary = summarize_turns(chat_model, summary, old_turns, options["summary_max_tokens"], config)
+            # 要約が空の場合は要約済みにせず、次回に要約し直す（古い会話が失われないように）
+            if new_summary:
+                summary, summarized = new_summary, summarized + len(old_turns)
+        recent = turns[summarized:]
+    else:
+        recent = turns
+
+    # ＜入力トークン数の上限＞（超える場合は古い会話から外す。要約する場合は要約に含める）
+    def build(recent_turns):
+        summary_messages = [SystemMessage(content=f"これまでの会話の要約:\n{summary}")] if summary else []
+        return pinned_messages + summary_messages + [message for turn in recent_turns for message in turn]
+
+    num_drop = 0
+    while num_drop < len(recent) - 1 and \
+            estimate_message_tokens(build(recent[num_drop:])) > options["max_prompt_tokens"]:
+        num_drop += 1
+    if num_drop > 0:
+        if options["strategy"] == "summarize":
+            new_summary = summarize_turns(
+                chat_model, summary, recent[:num_drop], options["summary_max_tokens"], config)
+            if new_summary:
+                summary, summarized = new_summary, summarized + num_drop
+        recent = recent[num_drop:]
+
+    if options["strategy"] == "summarize":
+        updates["summary"] = summary
+        updates["summarized"] = summarized
+
+    prompt_messages = build(recent)
+    stats = {
+        "prompt_tokens": estimate_message_tokens(prompt_messages),
+        "history_turns": len(recent) - 1,
+        "dropped_turns": len(turns) - len(recent),
+        "summary_tokens": estimate_tokens(summary) if summary else 0,
+    }
+    return prompt_messages, updates, stats
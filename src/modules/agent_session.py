@@ -0,0 +1,39 @@
+import os
+import uuid
+import sqlite3
+from datetime import datetime
+
+
+# セッションの保存の設定の既定値
+#   db_path: 会話の状態を保存するSQLiteファイル（全ての試験・問題のセッションを1つのファイルに保存する）
+DEFAULT_SESSION_OPTIONS = {
+    "db_path": "output/agent_sessions.sqlite",
+}
+
+
+# セッションの保存の設定を取得（省略した項目は既定値）
+def get_session_options(options=None):
+    return {**DEFAULT_SESSION_OPTIONS, **(options or {})}
+
+
+# 新しいセッションIDを作成（開始時刻＋UUID。同じ秒に開始したセッションも区別する）
+def new_session_id():
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex}"
+
+
+# チェックポイントのスレッドID（試験・問題・セッションごと）
+def session_thread_id(exam_id, section, session_id):
+    return f"{exam_id}/{section}/{session_id}"
+
+
+# 会話の状態を保存するチェックポインターを作成
+#   （グラフの構築と同じく、バックグラウンドのスレッドで作成してメインのスレッドで使うため、スレッドの確認はしない）
+def open_checkpointer(db_path):
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    checkpointer = SqliteSaver(sqlite3.connect(db_path, check_same_thread=False))
+    checkpointer.setup()
+    return checkpointer
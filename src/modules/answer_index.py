@@ -0,0 +1,99 @@
+import re
+import unicodedata
+
+
+# 問題の見出し（「問1」「## 問1」「| 問1 |」「【問1】」など。「問1の」「問1と」のような参照は除く）
+QUESTION_PATTERN = re.compile(r"^\s*(?:#+\s*|\|\s*|\*\*|【|\[)*問\s*(\d+)(?![\dのとで])")
+# 設問の見出し（表の行で問題の列に続く「| 問1 | 設問1 |」にも対応）
+SUBQUESTION_PATTERN = re.compile(
+    r"^\s*(?:#+\s*|\|\s*|\*\*|【|\[)*(?:問\s*\d+\s*(?:\*\*|】|\])?\s*\|?\s*)?設問\s*(\d+)(?![\dのとで])")
+# マークダウンの表の区切り行（「|---|---|」）
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\s*\|?\s*:?-{3,}")
+
+
+# 全角数字などを半角にそろえる
+def _normalize(line):
+    return unicodedata.normalize("NFKC", line)
+
+
+def _is_table_row(line):
+    return line.lstrip().startswith("|")
+
+
+# 解答例のマークダウンを問題（問N）と設問（設問N）ごとに分割した索引を作成（LLMは使わない）
+#   {"preamble": 最初の問題より前の文章, "questions": {問題番号: {"text": 文章, "subquestions": {設問番号: 文章}}}}
+#   同じ問題の見出しが複数回出てくる場合（ページをまたぐ場合など）は連結し、
+#   表の途中から始まる場合は、表の見出し行を先頭に付ける（既に見出し行を含む問題・設問には付けない）
+def build_answer_index(ans_text):
+    preamble = []
+    questions = {}
+    question = None
+    subquestion = None
+    table_header = None
+    # 今の表の見出し行を既に含む問題・設問（id）
+    header_holders = set()
+    prev_line = None
+
+    for line in ans_text.splitlines():
+        normalized = _normalize(line)
+        if not _is_table_row(normalized):
+            table_header = None
+        elif prev_line is not None and TABLE_SEPARATOR_PATTERN.match(normalized):
+            table_header = [prev_line, line]
+            header_holders = {id(target) for target in (question, subquestion) if target is not None}
+
+        match = QUESTION_PATTERN.match(normalized)
+        if match:
+            question = questions.setdefault(int(match.group(1)), {"lines": [], "subquestions": {}})
+            subquestion = None
+            if table_header is not None and id(question) not in header_holders:
+                question["lines"] += table_header
+                header_holders.add(id(question))
+
+        match = SUBQUESTION_PATTERN.match(normalized)
+        if match and question is not None:
+            subquestion = question["subquestions"].setdefault(int(match.group(1)), [])
+            if table_header is not None and id(subquestion) not in header_holders:
+                subquestion += table_header
+                header_holders.add(id(subquestion))
+
+        if question is None:
+            preamble.append(line)
+        else:
+            question["lines"].append(line)
+            if subquestion is not None:
+                subquestion.append(line)
+        prev_line = line
+
+    return {
+        "preamble": "\n".join(preamble).strip(),
+        "questions": {
+            question_no: {
+                "text": "\n".join(question["lines"]).strip(),
+                "subquestions": {
+                    subquestion_no: "\n".join(lines).strip()
+                    for subquestion_no, lines in question["subquestions"].items()
+                },
+            }
+            for question_no, question in questions.items()
+        },
+    }
+
+
+# 索引から問題（subquestion_no を指定した場合は設問）の解答例を取得（見つからない場合はNone）
+def answer_slice(index, question_no, subquestion_no=None):
+    question = index["questions"].get(question_no)
+    if question is None:
+        return None
+    if subquestion_no is None:
+        return question["text"]
+    return question["subquestions"].get(subquestion_no)
+
+
+# 問題文の最初の見出しから問題番号を取得（見つからない場合はNone）
+def find_question_no(text):
+    for line in text.splitlines():
+        match = QUESTION_PATTERN.match(_normalize(line))
+        if match:
+            return int(match.group(1))
+    return None
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import warnings
+import threading
+
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import BaseCache
+from langchain_core.globals import set_llm_cache
+from langchain_core.load import dumps, loads
+
+
+# LLM呼び出し結果を保存する、サイズ上限付き（LRU削除）の永続キャッシュ
+#   キーは (モデル名・温度などの設定, システムプロンプト・画像・テキストを含むプロンプト) のハッシュ
+class SQLiteLRUCache(BaseCache):
+
+    def __init__(self, cache_path, max_size_mb=1024):
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_path = cache_path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # 並列OCRから呼ばれるため、スレッド間で接続を共有してロックで保護する
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON llm_cache (last_access)"
+        )
+        self._conn.commit()
+
+    # プロンプトとLLM設定からキーを作成
+    @staticmethod
+    def _make_key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self._make_key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+
+        # キャッシュから返したことを計測側で判別できるよう印を付ける
+        #   （loads はベータ版の警告をヒットのたびに出すため、その警告のみ抑制する）
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", LangChainBetaWarning)
+            generations = [loads(generation) for generation in json.loads(row[0])]
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), "cache_hit": True}
+        return generations
+
+    def update(self, prompt, llm_string, return_val):
+        key = self._make_key(prompt, llm_string)
+        value = json.dumps([dumps(generation) for generation in return_val])
+        size = len(value.encode("utf-8"))
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    # 合計サイズが上限を超えた場合、最後に参照された時刻が古いものから削除
+    def _evict(self):
+        total_size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY last_access ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total_size <= self.max_size_bytes:
+                break
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total_size -= size
+            self.evictions += 1
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    # ヒット・ミスなどの統計情報を取得
+    def stats(self):
+        with self._lock:
+            entries, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_mb": total_size / (1024 * 1024),
+        }
+
+    # 統計情報を表示
+    def print_stats(self):
+        stats = self.stats()
+        print(f"\nCache Hits: {stats['hits']}")
+        print(f"Cache Misses: {stats['misses']}")
+        print(f"Cache Hit Rate: {stats['hit_rate']:.1%}")
+        print(f"Cache Evictions: {stats['evictions']}")
+        print(f"Cache Size: {stats['entries']} entries, {stats['size_mb']:.1f} MB\n")
+
+
+# LLMキャッシュを設定（全てのchat_model.invokeに適用される）
+def setup_llm_cache(cache_path, max_size_mb=1024):
+    if not cache_path:
+        return None
+
+    llm_cache = SQLiteLRUCache(cache_path, max_size_mb=max_size_mb)
+    set_llm_cache(llm_cache)
+    return llm_cache
@@ -0,0 +1,192 @@
+import re
+import json
+import time
+import random
+import hashlib
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.modules.llm import (
+    estimate_tokens,
+    estimate_image_url_tokens,
+    estimate_message_tokens,
+    split_message_contents,
+    result_total_tokens,
+)
+
+
+# 偽のモデルが返すレート制限エラー
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+# 全ての呼び出しを RequestScheduler 経由で行うモデル
+#   優先度は、呼び出し時の config の metadata["priority"] で指定する（小さいほど先、既定は1）
+#   キャッシュにある呼び出しはスケジューラーを通らない
+class ScheduledChatModel(BaseChatModel):
+    chat_model: BaseChatModel
+    scheduler: Any
+    # 出力トークン数の見積もり（tpmの消費量の見積もりに加算し、応答後に実績で補正する）
+    expected_completion_tokens: int = 1000
+
+    @property
+    def _llm_type(self):
+        return self.chat_model._llm_type
+
+    @property
+    def _identifying_params(self):
+        return self.chat_model._identifying_params
+
+    # キャッシュのキーは元のモデルと同じにする
+    def _get_llm_string(self, stop=None, **kwargs):
+        return self.chat_model._get_llm_string(stop=stop, **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        metadata = run_manager.metadata if run_manager is not None else {}
+        estimated_tokens = estimate_message_tokens(messages) + self.expected_completion_tokens
+
+        result, info = self.scheduler.run(
+            lambda: self.chat_model._generate(messages, stop=stop, **kwargs),
+            estimated_tokens,
+            priority=metadata.get("priority", 1),
+            usage_func=result_total_tokens,
+        )
+
+        # 待機時間・再試行回数を計測側に渡す
+        generation = result.generations[0]
+        generation.generation_info = {**(generation.generation_info or {}), **info}
+        return result
+
+
+# OpenAIに接続せず、決まった応答を返す偽のモデル（ベンチマーク・動作確認用）
+#   - 画像を含む入力: 画像から決まるページのテキストを返す（OCRの代わり）
+#   - システムプロンプト＋テキスト: テキストをそのまま返す（整形の代わり）
+#   - テキストのみ: 入力から決まる解説文を返す（解説作成の代わり）
+#   - ツールを指定した場合: 最後の質問に「図N」「表N」があれば、get_figure / get_table を呼び出す
+#   応答までの待ち時間は latency + latency_per_token * 出力トークン数
+#   （ストリーミングの場合は、latency の後に1トークンずつ latency_per_token ごとに返す）
+class FakeChatModel(BaseChatModel):
+    model_name: str = "gpt-4o"
+    temperature: float = 0
+    latency: float = 0.5
+    latency_per_token: float = 0.0
+    completion_tokens: int = 400
+    # 429エラーを返す確率（スケジューラーの再試行の確認用）
+    error_rate: float = 0.0
+    # 画像1枚あたりの入力トークン数。Noneの場合は画像サイズから推定する
+    image_tokens: Optional[int] = None
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self):
+        return {
+            "model_name": self.model_name,
+            "temperature": self.temperature,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    # ツールを受け付ける（呼び出し時に tools として渡される）
+    def bind_tools(self, tools, **kwargs):
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage = self._respond(messages)
+        tool_calls = self._tool_calls(messages, kwargs.get("tools"))
+        if tool_calls:
+            content = ""
+        time.sleep(self.latency + self.latency_per_token * usage["output_tokens"])
+        if random.random() < self.error_rate:
+            raise FakeRateLimitError("Rate limit reached (fake)")
+
+        message = AIMessage(content=content, tool_calls=tool_calls, usage_metadata=usage)
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"model_name": self.model_name},
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage = self._respond(messages)
+        tool_calls = self._tool_calls(messages, kwargs.get("tools"))
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise FakeRateLimitError("Rate limit reached (fake)")
+
+        # ツールを呼び出す場合は、呼び出しのみを返す
+        if tool_calls:
+            tool_call_chunks = [
+                {"name": tool_call["name"], "args": json.dumps(tool_call["args"]), "id": tool_call["id"], "index": i}
+                for i, tool_call in enumerate(tool_calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", tool_call_chunks=tool_call_chunks, usage_metadata=usage))
+            return
+
+        # 2文字（1トークン）ずつ返し、使用量は最後に返す
+        for i in range(0, len(content), 2):
+            time.sleep(self.latency_per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=content[i:i + 2]))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+    # 入力から (応答の文章, トークン数) を決める
+    def _respond(self, messages):
+        texts, images = split_message_contents(messages)
+        seed = hashlib.sha256(
+            "\0".join(texts + [image["url"] for image in images]).encode("utf-8")).hexdigest()
+        if len(images) > 0:
+            content = self._synthesize(seed, "page")
+        elif isinstance(messages[0], SystemMessage) and len(messages) > 1:
+            content = messages[-1].content if isinstance(messages[-1].content, str) else ""
+        else:
+            content = self._synthesize(seed, "review")
+
+        prompt_tokens = \
+            sum(estimate_tokens(text) for text in texts) + \
+            sum(self._image_tokens(image) for image in images)
+        completion_tokens = estimate_tokens(content)
+        return content, {
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    # 最後のメッセージがテキストの質問で「図N」「表N」を含み、対応するツールがある場合のツール呼び出し
+    def _tool_calls(self, messages, tools):
+        if not tools or not isinstance(messages[-1], HumanMessage) or not isinstance(messages[-1].content, str):
+            return []
+        tool_names = {tool["function"]["name"] for tool in tools}
+        tool_calls = []
+        for kind, number in re.findall(r"(図|表)\s*(\d+)", messages[-1].content):
+            name = "get_figure" if kind == "図" else "get_table"
+            if name in tool_names:
+                tool_calls.append({"name": name, "args": {"number": int(number)}, "id": f"call_{len(tool_calls) + 1}"})
+        return tool_calls
+
+    # 画像の入力トークン数
+    def _image_tokens(self, image):
+        if self.image_tokens is not None:
+            return self.image_tokens
+        return estimate_image_url_tokens(image)
+
+    # シード値から、およそ completion_tokens トークンの文章を作成
+    def _synthesize(self, seed, kind):
+        question_no = int(seed[:8], 16) % 3 + 1
+        if kind == "page":
+            lines = [f"問{question_no} 次の記述を読んで，設問に答えよ。"]
+        else:
+            lines = [f"## 問{question_no} 解答例と解説"]
+        line_no = 0
+        while estimate_tokens("\n".join(lines)) < self.completion_tokens:
+            line_no += 1
+            lines.append(f"設問{line_no} {seed[line_no % 56:line_no % 56 + 8]} に関する記述「ア」は，通信経路の冗長化による可用性の確保である。")
+        return "\n".join(lines)
@@ -0,0 +1,167 @@
+import io
+import os
+import base64
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from src.modules.utils import setup_pdf_converter
+
+
+# 変換結果から、ページ画像・表画像・図画像を取り出す
+#   page_ranges を指定した場合は、各要素のページ番号（provenance）で範囲ごとに振り分ける
+def extract_images(conv_res, page_ranges=None):
+    from docling_core.types.doc import PictureItem, TableItem
+
+    if page_ranges is None:
+        page_ranges = [(1, max(conv_res.document.pages.keys(), default=0))]
+
+    sections = [{"pages": [], "tables": [], "pictures": []} for _ in page_ranges]
+
+    # 指定したページ番号を含む範囲の番号を取得
+    def section_indices(page_no):
+        return [
+            i for i, (start_page, end_page) in enumerate(page_ranges)
+            if start_page <= page_no <= end_page
+        ]
+
+    # ページ画像（プロファイルで生成しない設定の場合は空）
+    for page_no, page in sorted(conv_res.document.pages.items()):
+        if page.image is None:
+            continue
+        for i in section_indices(page_no):
+            sections[i]["pages"].append((page_no, page.image.pil_image))
+
+    # 図と表（文書内の出現順）
+    for element, _level in conv_res.document.iterate_items():
+        if isinstance(element, TableItem):
+            kind = "tables"
+        elif isinstance(element, PictureItem):
+            kind = "pictures"
+        else:
+            continue
+        if element.image is None or len(element.prov) == 0:
+            continue
+        for i in section_indices(element.prov[0].page_no):
+            sections[i][kind].append(element.image.pil_image)
+
+    return sections
+
+
+# PDF全体を一度だけ変換し、ページ範囲ごとに画像を振り分ける
+#   変換対象は、全範囲を含む最小のページ範囲に限定する
+def convert_sections(pdf_converter, pdf_path, page_ranges):
+    invalid_ranges = [
+        (start_page, end_page) for start_page, end_page in page_ranges
+        if start_page < 1 or start_page > end_page
+    ]
+    if len(invalid_ranges) > 0:
+        raise ValueError(f"ページ範囲が無効です: {invalid_ranges}")
+
+    first_page = min(start_page for start_page, _ in page_ranges)
+    last_page = max(end_page for _, end_page in page_ranges)
+    conv_res = pdf_converter.convert(pdf_path, page_range=(first_page, last_page))
+    return extract_images(conv_res, page_ranges)
+
+
+# PDFを変換し、画像を取り出す（page_rangesを指定した場合は範囲ごとに振り分ける）
+def convert_pdf(pdf_converter, pdf_path, page_ranges=None):
+    if page_ranges is None:
+        return extract_images(pdf_converter.convert(pdf_path))
+    return convert_sections(pdf_converter, pdf_path, page_ranges)
+
+
+# ワーカープロセスごとに保持するPDFコンバーター
+_worker_converter = None
+
+
+# ワーカープロセスの初期化（コンバーターの生成はプロセスごとに1回のみ）
+def _init_worker(profile):
+    global _worker_converter
+    _worker_converter = setup_pdf_converter(profile)
+
+
+# ワーカープロセスで1件の変換を実施
+def _convert_job(job):
+    pdf_path, page_ranges = job
+    return convert_pdf(_worker_converter, pdf_path, page_ranges)
+
+
+# 複数のPDF（またはページ範囲）を、プロセスプールで並列に変換
+#   jobs は (pdf_path, page_ranges) のリストで、結果は jobs と同じ順に返す
+def convert_pdfs_in_pool(jobs, num_workers, profile=None):
+    num_workers = min(num_workers, len(jobs))
+    if num_workers <= 1:
+        pdf_converter = setup_pdf_converter(profile)
+        return [convert_pdf(pdf_converter, pdf_path, page_ranges) for pdf_path, page_ranges in jobs]
+
+    # doclingのモデル（torch）をforkで複製しないよう、spawnでプロセスを起動
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(profile,),
+    ) as executor:
+        return list(executor.map(_convert_job, jobs))
+
+
+# 画像の種類（ページ画像・表画像・図画像）
+IMAGE_TYPES = ("pages", "tables", "pictures")
+
+
+# PIL画像をbase64形式のPNGに変換
+def _encode_pil(pil_image):
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+# base64形式のPNGをPIL画像に変換
+def _decode_pil(image_data):
+    pil_image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+    pil_image.load()
+    return pil_image
+
+
+# 変換結果をJSONで送れる形式に変換（image_types に含まれない種類の画像は空にする）
+def sections_to_json(sections, image_types=IMAGE_TYPES):
+    return [
+        {
+            "pages": [
+                (page_no, _encode_pil(pil_image)) for page_no, pil_image in section["pages"]
+            ] if "pages" in image_types else [],
+            "tables": [
+                _encode_pil(pil_image) for pil_image in section["tables"]
+            ] if "tables" in image_types else [],
+            "pictures": [
+                _encode_pil(pil_image) for pil_image in section["pictures"]
+            ] if "pictures" in image_types else [],
+        }
+        for section in sections
+    ]
+
+
+# JSONで受け取った変換結果を、extract_images と同じ形式に戻す
+def sections_from_json(sections):
+    return [
+        {
+            "pages": [(page_no, _decode_pil(image_data)) for page_no, image_data in section["pages"]],
+            "tables": [_decode_pil(image_data) for image_data in section["tables"]],
+            "pictures": [_decode_pil(image_data) for image_data in section["pictures"]],
+        }
+        for section in sections
+    ]
+
+
+# 図と表の画像を保存
+def save_element_images(section, output_dir):
+    for i, pil_image in enumerate(section["tables"]):
+        element_image_filename = os.path.join(output_dir, f"table-{i+1}.png")
+        with open(element_image_filename, "wb") as fp:
+            pil_image.save(fp, "PNG")
+
+    for i, pil_image in enumerate(section["pictures"]):
+        element_image_filename = os.path.join(output_dir, f"picture-{i+1}.png")
+        with open(element_image_filename, "wb") as fp:
+            pil_image.save(fp, "PNG")
@@ -0,0 +1,94 @@
+import os
+import json
+import base64
+import urllib.error
+import urllib.request
+
+from src.modules.utils import converter_profile_key, setup_pdf_converter
+from src.modules.convert import IMAGE_TYPES, convert_pdf, sections_from_json
+
+
+# 変換サーバー（src/convert_server.py）の既定のURL
+DEFAULT_SERVER_URL = "http://127.0.0.1:8765"
+
+
+# 変換サーバーにPDFの変換を依頼するクライアント
+#   サーバーが起動していない場合は、プロセス内のPDFコンバーターで変換する
+#   （pdf_converter を渡した場合はそれを使い、渡さない場合は必要になった時点で生成する）
+#   profile は変換設定のプロファイル（utils.CONVERTER_PROFILES）で、convert_pdf ごとに変更もできる
+class ConverterClient:
+
+    def __init__(self, server_url=DEFAULT_SERVER_URL, pdf_converter=None, timeout=600, profile=None):
+        self.server_url = server_url.rstrip("/") if server_url else None
+        self.profile = profile
+        self.timeout = timeout
+        self._available = None
+        # プロファイルごとのPDFコンバーター
+        self._converters = {}
+        if pdf_converter is not None:
+            self._converters[converter_profile_key(profile)] = pdf_converter
+
+    # 変換サーバーが利用できるか（結果は保持し、接続に失敗した時点で無効にする）
+    def server_available(self):
+        if self.server_url is None:
+            return False
+        if self._available is None:
+            try:
+                with urllib.request.urlopen(f"{self.server_url}/health", timeout=1) as response:
+                    self._available = response.status == 200
+            except (urllib.error.URLError, OSError):
+                self._available = False
+            if self._available:
+                print(f"変換サーバー（{self.server_url}）で変換します。")
+            else:
+                print(f"変換サーバー（{self.server_url}）に接続できないため、プロセス内で変換します。")
+        return self._available
+
+    # PDF（パスまたはDocumentStream）を変換し、extract_images と同じ形式で画像を返す
+    #   page_ranges を指定した場合は範囲ごとに振り分け、image_types に含まれない種類の画像は空にする
+    def convert_pdf(self, source, page_ranges=None, image_types=IMAGE_TYPES, profile=None):
+        profile = self.profile if profile is None else profile
+        if self.server_available():
+            try:
+                return self._convert_remote(source, page_ranges, image_types, profile)
+            except (urllib.error.URLError, OSError) as e:
+                print(f"変換サーバーでの変換に失敗したため、プロセス内で変換します: {e}")
+                self._available = False
+
+        key = converter_profile_key(profile)
+        if key not in self._converters:
+            self._converters[key] = setup_pdf_converter(profile)
+        sections = convert_pdf(self._converters[key], source, page_ranges)
+        for section in sections:
+            for image_type in IMAGE_TYPES:
+                if image_type not in image_types:
+                    section[image_type] = []
+        return sections
+
+    def _convert_remote(self, source, page_ranges, image_types, profile):
+        job = {
+            "page_ranges": None if page_ranges is None else [list(page_range) for page_range in page_ranges],
+            "image_types": list(image_types),
+            "profile": profile,
+        }
+        if isinstance(source, str):
+            # サーバーは同じマシンで動くため、パスで渡す
+            job["pdf_path"] = os.path.abspath(source)
+        else:
+            job["name"] = source.name
+            job["pdf_bytes"] = base64.b64encode(source.stream.getvalue()).decode("utf-8")
+
+        request = urllib.request.Request(
+            f"{self.server_url}/convert",
+            data=json.dumps(job).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # サーバー側での変換エラー（PDFやページ範囲の誤り）は、そのまま呼び出し元に伝える
+            message = json.loads(e.read()).get("error", str(e))
+            raise RuntimeError(f"変換サーバーでエラーが出ました: {message}") from None
+        return sections_from_json(result["sections"])
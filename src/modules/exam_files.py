@@ -0,0 +1,42 @@
+import os
+
+
+# pdf2md.pyの出力ディレクトリ名（「試験ID_タイムスタンプ」）から、試験IDを取得
+#   試験IDは、問題PDF名から「_qs」を除いたもの
+def exam_id_of(exam_dir):
+    exam_id = "_".join(os.path.basename(os.path.normpath(exam_dir)).split("_")[0:-1])
+    return exam_id.replace('_qs', '')
+
+
+# 問題ごとのディレクトリ（monN）の、問題文のマークダウンのパスを取得
+#   formatted=True の場合は整形済みのもの（_md.md）、False の場合はOCRの結果（.md）
+#   「_qs」なしの名前が無い場合は、pdf2md.pyの出力名（問題PDF名の「_qs」付き）にする
+def find_mon_md_path(mon_dir, exam_id, formatted=True):
+    mon_id = os.path.basename(os.path.normpath(mon_dir))
+    suffix = "_md.md" if formatted else ".md"
+    md_path = os.path.join(mon_dir, f"{exam_id}_{mon_id}{suffix}")
+    if not os.path.exists(md_path):
+        md_path = os.path.join(mon_dir, f"{exam_id}_qs_{mon_id}{suffix}")
+    return md_path
+
+
+# 問題ごとのディレクトリ（monN）の、解説のマークダウンのパス
+def review_md_path(mon_dir, exam_id):
+    mon_id = os.path.basename(os.path.normpath(mon_dir))
+    return os.path.join(mon_dir, f"{exam_id}_{mon_id}_review.md")
+
+
+# 出力ディレクトリから、試験IDと解答例・各問題のマークダウンのパスを取得
+def find_exam_files(input_dir):
+    exam_id = exam_id_of(input_dir)
+
+    ans_md_path = os.path.join(input_dir, "ans", f"{exam_id}_ans.md")
+
+    mon_md_path_list = []
+    for dir in os.listdir(input_dir):
+        if dir.startswith("mon"):
+            mon_dir_path = os.path.join(input_dir, dir)
+            mon_md_path_list.append((mon_dir_path, find_mon_md_path(mon_dir_path, exam_id)))
+    mon_md_path_list.sort()
+
+    return exam_id, ans_md_path, mon_md_path_list
@@ -0,0 +1,150 @@
+import math
+import base64
+
+import cv2
+import numpy as np
+
+from src.modules.preprocess import preprocess_page
+
+
+# バイト列をbase64形式の文字列に変換
+def to_base64(image_bytes):
+    return base64.b64encode(image_bytes).decode('utf-8')
+
+
+# PIL画像をグレースケールのNumPy配列に変換
+def pil_to_gray_array(pil_image):
+    return np.asarray(pil_image.convert("L"))
+
+
+# グレースケール画像を2値化
+def binarize_image(gray_image, threshold_value=128):
+    _, binary_image = cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY)
+    return binary_image
+
+
+# 送信画像の最適化の既定値
+DEFAULT_IMAGE_OPTIONS = {
+    "trim_margins": True,     # 白い余白を切り取る
+    "margin": 16,             # 切り取り後に残す余白（px）
+    "max_long_edge": 2048,    # 長辺の上限（px）。Noneの場合は縮小しない
+    "max_tiles": None,        # 512pxタイル数の上限。Noneの場合は制限しない
+    "format": "png",          # png / jpeg / webp
+    "quality": 85,            # jpeg / webp の品質
+    "detail": "high",         # OpenAIのdetail（high / low / auto）
+}
+
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+# OpenAIのVision入力トークン数を推定（512pxタイル数から計算）
+def estimate_image_tokens(width, height, detail="high"):
+    if detail == "low":
+        return 85
+
+    # 2048px四方に収まるよう縮小した後、短辺が768pxになるよう縮小
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 170 * tiles + 85
+
+
+# 白い余白を切り取る
+def trim_margins(image_array, margin=16, threshold_value=250):
+    gray_image = image_array if image_array.ndim == 2 else cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY)
+    ink_rows = np.flatnonzero((gray_image < threshold_value).any(axis=1))
+    ink_cols = np.flatnonzero((gray_image < threshold_value).any(axis=0))
+    if len(ink_rows) == 0 or len(ink_cols) == 0:
+        return image_array
+
+    height, width = gray_image.shape
+    top = max(ink_rows[0] - margin, 0)
+    bottom = min(ink_rows[-1] + margin + 1, height)
+    left = max(ink_cols[0] - margin, 0)
+    right = min(ink_cols[-1] + margin + 1, width)
+    return image_array[top:bottom, left:right]
+
+
+# 長辺の上限とタイル数の上限に収まるよう縮小
+def downscale_image(image_array, max_long_edge=None, max_tiles=None, detail="high"):
+    height, width = image_array.shape[:2]
+    scale = 1.0
+    if max_long_edge is not None:
+        scale = min(scale, max_long_edge / max(width, height))
+    if max_tiles is not None and detail != "low":
+        # タイル数が上限以下になるまで段階的に縮小
+        while scale > 0.1:
+            tokens = estimate_image_tokens(width * scale, height * scale, detail)
+            if (tokens - 85) // 170 <= max_tiles:
+                break
+            scale *= 0.9
+    if scale >= 1.0:
+        return image_array
+
+    new_size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    return cv2.resize(image_array, new_size, interpolation=cv2.INTER_AREA)
+
+
+# NumPy配列の画像を指定形式のバイト列にエンコード
+def encode_image_array(image_array, image_format="png", quality=85):
+    if image_format == "png":
+        params = []
+    elif image_format == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        raise ValueError(f"対応していない画像形式です: {image_format}")
+
+    success, buffer = cv2.imencode(f".{'jpg' if image_format == 'jpeg' else image_format}", image_array, params)
+    if not success:
+        raise ValueError(f"{image_format}へのエンコードに失敗しました。")
+    return buffer.tobytes()
+
+
+# ページ画像を送信用に最適化（2値化・余白除去・縮小・エンコード）
+#   preprocess_options（preprocess.DEFAULT_PREPROCESS_OPTIONS）を渡した場合は、
+#   固定のしきい値での2値化の代わりに前処理（適応的2値化・傾き補正・フッター除去・空白の行の詰め）を行う
+#   measure_original=True の場合は、元のページ画像をPNGにエンコードしたバイト数も計測する（ページごとにエンコードするため遅くなる）
+#   (画像のバイト列, MIMEタイプ, 削減量の統計) を返す
+def optimize_page_image(pil_image, binarize=False, image_options=None, preprocess_options=None, measure_original=False):
+    options = {**DEFAULT_IMAGE_OPTIONS, **(image_options or {})}
+    original_width, original_height = pil_image.size
+
+    preprocess_stats = {}
+    if preprocess_options is not None:
+        image_array, preprocess_stats = preprocess_page(pil_image, binarize, preprocess_options)
+    elif binarize:
+        image_array = binarize_image(pil_to_gray_array(pil_image))
+    else:
+        image_array = cv2.cvtColor(np.asarray(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+    if options["trim_margins"]:
+        image_array = trim_margins(image_array, margin=options["margin"])
+    unscaled_width = image_array.shape[1]
+    image_array = downscale_image(
+        image_array, options["max_long_edge"], options["max_tiles"], options["detail"])
+    image_bytes = encode_image_array(image_array, options["format"], options["quality"])
+
+    height, width = image_array.shape[:2]
+    original_pixels = original_width * original_height
+    stats = {
+        **preprocess_stats,
+        "original_size": (original_width, original_height),
+        "size": (width, height),
+        # 送信する画素数の削減率
+        "pixel_reduction": 1 - width * height / max(original_pixels, 1),
+        # 縮小の倍率
+        "scale": width / unscaled_width,
+        "bytes": len(image_bytes),
+        "original_tokens": estimate_image_tokens(original_width, original_height, "high"),
+        "tokens": estimate_image_tokens(width, height, options["detail"]),
+    }
+    if measure_original:
+        # 最適化する前に送っていた、元のページ画像のPNGのバイト数
+        original_array = cv2.cvtColor(np.asarray(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+        stats["original_bytes"] = len(encode_image_array(original_array, "png"))
+    return image_bytes, MIME_TYPES[options["format"]], stats
@@ -0,0 +1,64 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+
+# ページごとのOCR結果を、完了した順にJSONL形式で追記するジャーナル
+#   途中で異常終了しても完了済みのページは残り、再実行時はここから読み込む
+class PageJournal:
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        journal_dir = os.path.dirname(journal_path)
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+
+    # 1ページ分の結果（またはエラー）を追記し、ディスクに書き出す
+    def append(self, page_no, input_hash, text=None, error=None):
+        entry = {
+            "page_no": page_no,
+            "input_hash": input_hash,
+            "status": "done" if error is None else "failed",
+            "text": text,
+            "error": None if error is None else str(error),
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            with open(self.journal_path, mode="a", encoding="utf-8") as f:
+                f.write(f"{line}\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    # ページ番号ごとに、最後に記録された結果を取得
+    def load(self):
+        entries = {}
+        if not os.path.exists(self.journal_path):
+            return entries
+        with open(self.journal_path, mode="r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で中断された行は無視
+                    continue
+                entries[entry["page_no"]] = entry
+        return entries
+
+    # 入力ハッシュが一致する完了済みのページのテキストを取得
+    def completed(self, input_hashes):
+        entries = self.load()
+        return {
+            page_no: entries[page_no]["text"]
+            for page_no, input_hash in input_hashes.items()
+            if page_no in entries
+            and entries[page_no]["status"] == "done"
+            and entries[page_no]["input_hash"] == input_hash
+        }
+
+    # 完了済みページのテキストを、ページ順に結合
+    def assemble(self, page_nos):
+        entries = self.load()
+        return "".join(f"\n\n{entries[page_no]['text']}" for page_no in page_nos)
@@ -0,0 +1,89 @@
+import io
+import os
+import base64
+
+from PIL import Image
+
+from src.modules.image import estimate_image_tokens
+
+
+# LLMインスタンスを作成する関数（ベンチマークなどで差し替える）
+_chat_model_factory = None
+
+
+# LLMインスタンスの作成方法を差し替える
+#   factory(model_name, temperature) を渡す。None を渡すと既定（ChatOpenAI）に戻す
+def set_chat_model_factory(factory):
+    global _chat_model_factory
+    _chat_model_factory = factory
+
+
+# LLMインスタンスを作成
+#   環境変数 LLM_PROVIDER=fake の場合は、OpenAIに接続しない偽のモデルを返す
+#   scheduler を渡した場合は、全ての呼び出しがスケジューラーを通るようにする（再試行もスケジューラーが行う）
+#   streaming=True の場合は、ストリーミングで応答を受け取る前提で作成する
+#   （langchain_openaiなどの読み込みに時間がかかるため、呼び出し時に読み込む）
+def create_chat_model(model_name, temperature=0, scheduler=None, streaming=False):
+    from src.modules.chat_models import FakeChatModel, ScheduledChatModel
+
+    if _chat_model_factory is not None:
+        chat_model = _chat_model_factory(model_name, temperature)
+    elif os.environ.get("LLM_PROVIDER") == "fake":
+        chat_model = FakeChatModel(model_name=model_name, temperature=temperature)
+    else:
+        from langchain_openai import ChatOpenAI
+        options = {}
+        if scheduler is not None:
+            options["max_retries"] = 0
+        if streaming:
+            # ストリーミングの場合もトークン数を受け取る（計測台帳に記録するため）
+            options["stream_usage"] = True
+        chat_model = ChatOpenAI(model=model_name, temperature=temperature, **options)
+
+    if scheduler is not None:
+        return ScheduledChatModel(chat_model=chat_model, scheduler=scheduler)
+    return chat_model
+
+
+# トークン数の概算（日本語を想定し、2文字で1トークンとする）
+def estimate_tokens(text):
+    return max(1, len(text) // 2)
+
+
+# data URL形式の画像の入力トークン数を、画像サイズとdetailから推定
+def estimate_image_url_tokens(image_url):
+    image_data = base64.b64decode(image_url["url"].split(",", 1)[1])
+    width, height = Image.open(io.BytesIO(image_data)).size
+    return estimate_image_tokens(width, height, image_url.get("detail", "high"))
+
+
+# メッセージを (テキストのリスト, 画像のリスト) に分解
+def split_message_contents(messages):
+    texts = []
+    images = []
+    for message in messages:
+        if isinstance(message.content, str):
+            texts.append(message.content)
+            continue
+        for part in message.content:
+            if part.get("type") == "image_url":
+                images.append(part["image_url"])
+            elif part.get("type") == "text":
+                texts.append(part["text"])
+    return texts, images
+
+
+# メッセージ全体の入力トークン数を推定
+def estimate_message_tokens(messages):
+    texts, images = split_message_contents(messages)
+    return \
+        sum(estimate_tokens(text) for text in texts) + \
+        sum(estimate_image_url_tokens(image) for image in images)
+
+
+# 応答の実際のトークン数（取得できない場合は None）
+def result_total_tokens(result):
+    usage = getattr(result.generations[0].message, "usage_metadata", None)
+    if not usage:
+        return None
+    return usage["total_tokens"]
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+
+# ファイルの内容のハッシュ値を取得
+def hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# 複数の値をまとめたハッシュ値を取得
+def hash_values(*values):
+    sha256 = hashlib.sha256()
+    for value in values:
+        if not isinstance(value, (bytes, bytearray)):
+            value = json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        sha256.update(hashlib.sha256(value).digest())
+    return sha256.hexdigest()
+
+
+# 各ステージの入力ハッシュと出力パスを記録するマニフェスト
+#   {output_dir}/manifest.json に保存し、再実行時に入力が変わっていないステージを省略する
+class Manifest:
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+        self.stages = {}
+        # 複数のスレッドから記録する場合（解説の並列作成など）に備える
+        self._lock = threading.Lock()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, mode="r", encoding="utf-8") as f:
+                self.stages = json.load(f).get("stages", {})
+
+    # 記録済みのエントリを取得
+    def get(self, stage, key):
+        return self.stages.get(stage, {}).get(key)
+
+    # 入力が変わっておらず、出力が全て存在する場合にTrue
+    def is_fresh(self, stage, key, input_hash):
+        entry = self.get(stage, key)
+        if entry is None or entry["status"] != "done" or entry["input_hash"] != input_hash:
+            return False
+        return all(
+            os.path.exists(os.path.join(self.output_dir, output_path))
+            for output_path in entry["outputs"]
+        )
+
+    # ステージの完了を記録（出力パスは出力ディレクトリからの相対パスで保存）
+    def record(self, stage, key, input_hash, outputs=(), **extra):
+        with self._lock:
+            self.stages.setdefault(stage, {})[key] = {
+                "status": "done",
+                "input_hash": input_hash,
+                "outputs": [os.path.relpath(output_path, self.output_dir) for output_path in outputs],
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                **extra,
+            }
+            self._save()
+
+    # ステージの失敗を記録
+    def record_failure(self, stage, key, input_hash, error):
+        with self._lock:
+            self.stages.setdefault(stage, {})[key] = {
+                "status": "failed",
+                "input_hash": input_hash,
+                "outputs": [],
+                "error": str(error),
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._save()
+
+    # マニフェストを保存
+    def save(self):
+        with self._lock:
+            self._save()
+
+    # 書き込み途中で中断しても壊れないよう、一時ファイルから置き換える
+    def _save(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, mode="w", encoding="utf-8") as f:
+            json.dump({"stages": self.stages}, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+
+# 指定した試験の、最新の出力ディレクトリを取得
+def find_latest_output_dir(output_dir, exam_id):
+    if not os.path.isdir(output_dir):
+        return None
+    candidates = [
+        os.path.join(output_dir, dir_name) for dir_name in os.listdir(output_dir)
+        if dir_name.startswith(f"{exam_id}_")
+        and os.path.exists(os.path.join(output_dir, dir_name, "manifest.json"))
+    ]
+    if len(candidates) == 0:
+        return None
+    return max(candidates)
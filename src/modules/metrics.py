@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# LLM呼び出しのコスト（USD）を計算（料金表にないモデルは0とする）
+def calc_cost(model_name, prompt_tokens, completion_tokens):
+    from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+
+    try:
+        return \
+            get_openai_token_cost_for_model(model_name, prompt_tokens) + \
+            get_openai_token_cost_for_model(model_name, completion_tokens, is_completion=True)
+    except ValueError:
+        return 0.0
+
+
+# LLM呼び出しとdoclingの変換を1件ずつ記録する計測台帳
+#   LLM呼び出しは、config={"callbacks": [ledger], "metadata": {...}} で渡したメタデータ
+#   （stage, exam, section, page, image_bytes）とともに自動で記録する
+class MetricsLedger(BaseCallbackHandler):
+
+    def __init__(self, jsonl_path):
+        self.jsonl_path = jsonl_path
+        self.run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        self.events = []
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._origin = time.perf_counter()
+        jsonl_dir = os.path.dirname(jsonl_path)
+        if jsonl_dir:
+            os.makedirs(jsonl_dir, exist_ok=True)
+
+    # LLM呼び出しに渡すconfigを作成
+    def config(self, **metadata):
+        return {"callbacks": [self], "metadata": metadata}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        with self._lock:
+            self._pending[run_id] = (time.perf_counter(), dict(metadata or {}))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        start_time, metadata = pending
+
+        generation = response.generations[0][0]
+        generation_info = generation.generation_info or {}
+        cache_hit = bool(generation_info.get("cache_hit", False))
+        usage = getattr(generation.message, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        model_name = (response.llm_output or {}).get("model_name") or metadata.get("ls_model_name", "")
+
+        self._record_llm_event(
+            metadata, start_time,
+            model=model_name,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            # キャッシュから返した場合は課金されない
+            cost=0.0 if cache_hit else calc_cost(model_name, prompt_tokens, completion_tokens),
+            cache_hit=cache_hit,
+            # スケジューラーでの待機時間・再試行回数・待ち行列の長さ（キャッシュの場合は記録時の値のため除く）
+            throttle=0.0 if cache_hit else generation_info.get("throttle", 0.0),
+            retries=0 if cache_hit else generation_info.get("retries", 0),
+            queue_depth=0 if cache_hit else generation_info.get("queue_depth", 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            pending = self._pending.pop(run_id, None)
+        if pending is None:
+            return
+        start_time, metadata = pending
+        self._record_llm_event(metadata, start_time, error=str(error))
+
+    def _record_llm_event(self, metadata, start_time, **fields):
+        self.record(
+            stage=metadata.get("stage", "llm"),
+            exam=metadata.get("exam"),
+            section=metadata.get("section"),
+            page=metadata.get("page"),
+            latency=time.perf_counter() - start_time,
+            image_bytes=metadata.get("image_bytes", 0),
+            # 入力を絞り込んで削減したプロンプトのトークン数（推定）
+            prompt_tokens_saved=metadata.get("prompt_tokens_saved", 0),
+            **fields,
+        )
+
+    # イベントを1件記録し、JSONLファイルに追記
+    def record(self, stage, exam=None, section=None, page=None, latency=0.0, **fields):
+        event = {
+            "run_id": self.run_id,
+            "timestamp": datetime.now().isoformat(timespec="milliseconds"),
+            "stage": stage,
+            "exam": exam,
+            "section": section,
+            "page": page,
+            "latency": latency,
+            # 台帳作成からの開始時刻（s）。ステージごとの経過時間の集計に使う
+            "start": time.perf_counter() - self._origin - latency,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "image_bytes": 0,
+            "cost": 0.0,
+            "cache_hit": False,
+            "throttle": 0.0,
+            "retries": 0,
+            **fields,
+        }
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            self.events.append(event)
+            with open(self.jsonl_path, mode="a", encoding="utf-8") as f:
+                f.write(f"{line}\n")
+
+    # 時間計測用のコンテキストマネージャー（doclingの変換などに使用）
+    def timer(self, stage, **fields):
+        return _Timer(self, stage, fields)
+
+    # 実行全体の集計
+    def summary(self, top_n=5):
+        with self._lock:
+            events = list(self.events)
+
+        def aggregate(group_events):
+            return {
+                "calls": len(group_events),
+                "latency": sum(e["latency"] for e in group_events),
+                "prompt_tokens": sum(e["prompt_tokens"] for e in group_events),
+                "completion_tokens": sum(e["completion_tokens"] for e in group_events),
+                "prompt_tokens_saved": sum(e.get("prompt_tokens_saved", 0) for e in group_events),
+                "image_bytes": sum(e["image_bytes"] for e in group_events),
+                "cost": sum(e["cost"] for e in group_events),
+                "cache_hits": sum(1 for e in group_events if e["cache_hit"]),
+                "throttle": sum(e["throttle"] for e in group_events),
+                "retries": sum(e["retries"] for e in group_events),
+                "errors": sum(1 for e in group_events if "error" in e),
+            }
+
+        def group_by(key_func):
+            groups = {}
+            for event in events:
+                groups.setdefault(key_func(event), []).append(event)
+            return {key: aggregate(group_events) for key, group_events in groups.items()}
+
+        page_events = [e for e in events if e["stage"] == "ocr" and e["page"] is not None]
+        return {
+            "run_id": self.run_id,
+            "total": aggregate(events),
+            "by_stage": group_by(lambda e: e["stage"]),
+            "by_section": group_by(lambda e: f"{e['exam']}/{e['section']}"),
+            "top_pages_by_cost": [
+                {key: e[key] for key in ("exam", "section", "page", "cost", "latency")}
+                for e in sorted(page_events, key=lambda e: e["cost"], reverse=True)[:top_n]
+            ],
+            "top_pages_by_latency": [
+                {key: e[key] for key in ("exam", "section", "page", "cost", "latency")}
+                for e in sorted(page_events, key=lambda e: e["latency"], reverse=True)[:top_n]
+            ],
+        }
+
+    # 集計をJSONファイルに保存
+    def save_summary(self, summary_path):
+        with open(summary_path, mode="w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    # 集計を表示
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\n=============== 計測結果 ({summary['run_id']}) ===============")
+        print(f"{'区分':<24}{'回数':>6}{'時間(s)':>10}{'Prompt':>10}{'Completion':>12}{'Cost(USD)':>12}{'Cache':>7}{'待機(s)':>10}{'再試行':>7}")
+        for title, groups in (("stage", summary["by_stage"]), ("section", summary["by_section"])):
+            for key, total in groups.items():
+                label = f"{title}:{key}"
+                print(
+                    f"{label:<24}{total['calls']:>6}{total['latency']:>10.1f}"
+                    f"{total['prompt_tokens']:>10}{total['completion_tokens']:>12}"
+                    f"{total['cost']:>12.4f}{total['cache_hits']:>7}"
+                    f"{total['throttle']:>10.1f}{total['retries']:>7}")
+        total = summary["total"]
+        print(f"\nTotal Tokens: {total['prompt_tokens'] + total['completion_tokens']}")
+        print(f"Prompt Tokens: {total['prompt_tokens']}")
+        print(f"Completion Tokens: {total['completion_tokens']}")
+        if total["prompt_tokens_saved"] > 0:
+            print(f"Prompt Tokens Saved (推定): {total['prompt_tokens_saved']}")
+        print(f"Total Cost (USD): ${total['cost']}\n")
+
+
+class _Timer:
+
+    def __init__(self, ledger, stage, fields):
+        self.ledger = ledger
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        fields = dict(self.fields)
+        if exc is not None:
+            fields["error"] = str(exc)
+        self.ledger.record(self.stage, latency=time.perf_counter() - self.start_time, **fields)
+        return False
@@ -0,0 +1,63 @@
+import base64
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables.config import ContextThreadPoolExecutor
+
+
+# 画像ファイルをbase64形式のデータに変換
+def encode_image(image_path):
+    with open(image_path, "rb") as image_file:
+        # base64エンコード
+        encoded_string = base64.b64encode(image_file.read())
+        # バイト列を文字列にデコードして返す
+        return encoded_string.decode('utf-8')
+
+
+# 画像1枚分のメッセージを作成
+def build_image_messages(system_prompt, image_data, mime_type="image/png", detail="high"):
+    image_message = HumanMessage(
+        content=[
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:{mime_type};base64,{image_data}", "detail": detail},
+            },
+        ],
+    )
+    return [system_prompt, image_message]
+
+
+# LLMの出力からコードブロックの記号を除去
+def clean_result_text(result_text):
+    return result_text.replace("```plaintext", "").replace("```", "")
+
+
+# 複数の画像を並列にOCRし、入力順に (番号, 結果) をyieldするジェネレーター
+#   on_complete を指定した場合、各ページの完了時（順不同）に on_complete(番号, 結果) を呼ぶ
+#   run_configs を指定した場合、各ページの呼び出しにそのconfig（コールバック・メタデータ）を渡す
+#   失敗したページは、結果として例外オブジェクトを返す
+def iter_ocr_images(
+    chat_model, system_prompt, image_data_list, max_concurrency=4,
+    mime_type="image/png", detail="high", on_complete=None, run_configs=None,
+):
+    if len(image_data_list) == 0:
+        return
+
+    def ocr_one(index, image_data):
+        messages = build_image_messages(system_prompt, image_data, mime_type, detail)
+        try:
+            config = run_configs[index] if run_configs is not None else None
+            result = clean_result_text(chat_model.invoke(messages, config=config).content)
+        except Exception as e:
+            result = e
+        if on_complete is not None:
+            on_complete(index, result)
+        return result
+
+    # 同時リクエスト数を制限して並列実行（コールバックのコンテキストをスレッドに引き継ぐ）
+    with ContextThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [
+            executor.submit(ocr_one, index, image_data)
+            for index, image_data in enumerate(image_data_list)
+        ]
+        for index, future in enumerate(futures):
+            yield index, future.result()
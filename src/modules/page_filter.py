@@ -0,0 +1,278 @@
+import os
+import re
+import time
+import zlib
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+from src.modules.preprocess import ink_mask, ink_rows_mask, find_footer_top, DEFAULT_PREPROCESS_OPTIONS
+
+
+# OCRの前のページの分類の既定値（高さ・面積はページに対する割合で指定する）
+#   enabled: 白紙のページを省き、既にOCRしたページとほぼ同じページはOCR結果を使い回す
+#   blank_ink_ratio: 文字などの画素の割合がこれ未満のページを白紙とする（フッターのページ番号などは除いて数える）
+#   skip_notice: 文字が1行のみのページは、OCRした結果が「このページは白紙です」などの注記の場合のみ白紙とする
+#   notice_max_height, notice_max_ink_ratio: 1行のみとみなす、文字のある範囲の高さと文字の画素の割合の上限
+#   dedupe: ほぼ同じページのOCR結果を使い回す
+#   max_hash_distance: 知覚ハッシュ（256ビット）の違うビット数の上限（候補の絞り込み）
+#   max_tile_diff: 縮小した文字の画像を小さな区画に分け、一方にのみある画素の数の上限（1文字の違いも区別する）
+#   match_prompt: 同じプロンプト・モデルでOCRしたページのみ使い回す（false の場合は解答例と問題の間でも使い回す）
+#   index_path: OCRしたページのハッシュと結果を保存するファイル（空の場合は実行中のみ使い回す）
+#   max_size_mb: index_path の索引のサイズの上限（超えた場合は、最後に使い回した時刻が古いものから削除）
+DEFAULT_PAGE_FILTER_OPTIONS = {
+    "enabled": True,
+    "blank_ink_ratio": 0.0015,
+    "skip_notice": False,
+    "notice_max_height": 0.04,
+    "notice_max_ink_ratio": 0.01,
+    "dedupe": True,
+    "max_hash_distance": 32,
+    "max_tile_diff": 8,
+    "match_prompt": True,
+    "index_path": ".cache/page_index.sqlite3",
+    "max_size_mb": 256,
+}
+
+# 比較用に縮小した文字の画像の大きさ（幅, 高さ）と、違いを数える区画の大きさ（px）
+THUMBNAIL_SIZE = (960, 1344)
+DIFF_TILE_SIZE = 16
+# 分類に使うページ画像の幅（解像度によらず同じ結果になるよう、この幅に揃える）
+CLASSIFY_WIDTH = 1240
+# 文字のある範囲の縦横比がこれ以上違うページは、同じページとみなさない
+MAX_ASPECT_DIFF = 0.03
+
+# 白紙とする注記（1行のみのページのOCR結果の各行が、これとページ番号のみの場合は白紙とする）
+NOTICE_TEXT_PATTERN = re.compile(
+    r"[\s\-－―ー(（\[〔【]*(?:この(?:ページ|頁)は)?(?:白紙|余白|空白|メモ用紙)(?:です|のページ)?[。．.\s\-－―ー)）\]〕】]*")
+PAGE_NUMBER_PATTERN = re.compile(r"[\s\-－―ー]*\d+[\s\-－―ー]*")
+
+
+# ページの分類の設定を取得（省略した項目は既定値）
+def get_page_filter_options(options=None):
+    return {**DEFAULT_PAGE_FILTER_OPTIONS, **(options or {})}
+
+
+# 知覚ハッシュ（dHash）: 縮小した画像で、横に隣り合う画素の明暗を比べた256ビット
+def difference_hash(gray_image):
+    small = cv2.resize(gray_image, (17, 16), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hash_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+
+# 縮小した文字の画像（2値）を、1画素1ビットに詰める（索引にはこの形で持つ）
+def pack_thumbnail(thumbnail):
+    return np.packbits(thumbnail)
+
+
+def unpack_thumbnail(bits):
+    width, height = THUMBNAIL_SIZE
+    return np.unpackbits(bits)[:width * height].reshape(height, width).astype(bool)
+
+
+# 詰めた画像を、保存用に圧縮（白い部分が多いため、圧縮すると小さくなる）
+def compress_thumbnail(bits):
+    return zlib.compress(bits.tobytes())
+
+
+def decompress_thumbnail(data):
+    return np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+
+
+# 1行のみのページのOCR結果が、白紙の注記（とページ番号）のみかどうか
+def is_notice_text(text):
+    lines = [line for line in text.splitlines() if line.strip() and not PAGE_NUMBER_PATTERN.fullmatch(line)]
+    return len(lines) > 0 and all(NOTICE_TEXT_PATTERN.fullmatch(line) for line in lines)
+
+
+# 2つの縮小した文字の画像が同じページかどうか
+#   一方にのみある画素を区画ごとに数え、全ての区画で max_tile_diff 以下なら同じとする
+#   （ページ全体の割合で比べると、1文字の違いは圧縮のノイズなどに埋もれてしまうため）
+def same_thumbnail(thumbnail1, thumbnail2, max_tile_diff):
+    diff = thumbnail1 ^ thumbnail2
+    height, width = diff.shape
+    tiles = diff[:height // DIFF_TILE_SIZE * DIFF_TILE_SIZE, :width // DIFF_TILE_SIZE * DIFF_TILE_SIZE].reshape(
+        height // DIFF_TILE_SIZE, DIFF_TILE_SIZE, width // DIFF_TILE_SIZE, DIFF_TILE_SIZE)
+    return int(tiles.sum(axis=(1, 3)).max()) <= max_tile_diff
+
+
+# ページ画像を分類する
+#   (種類, 特徴, 統計) を返す。種類は blank（白紙） / notice（1行のみ。白紙の注記かどうかはOCRした結果で判定する） / page
+#   特徴は同じページの判定に使う {"hash", "aspect", "thumbnail"}（白紙の場合はNone）
+def classify_page(pil_image, options=None):
+    options = get_page_filter_options(options)
+
+    gray_image = np.asarray(pil_image.convert("L"))
+    scale = CLASSIFY_WIDTH / gray_image.shape[1]
+    gray_image = cv2.resize(
+        gray_image, (CLASSIFY_WIDTH, max(round(gray_image.shape[0] * scale), 1)),
+        interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+    mask = ink_mask(
+        gray_image, DEFAULT_PREPROCESS_OPTIONS["threshold"],
+        DEFAULT_PREPROCESS_OPTIONS["block_size"], DEFAULT_PREPROCESS_OPTIONS["offset"])
+    # ページ番号などのフッターは、同じ内容のページでも異なるため除く
+    footer_top = find_footer_top(
+        mask, DEFAULT_PREPROCESS_OPTIONS["footer_ratio"], DEFAULT_PREPROCESS_OPTIONS["min_footer_gap"])
+    if footer_top is not None:
+        mask = mask[:footer_top]
+
+    height, width = gray_image.shape
+    ink_ratio = np.count_nonzero(mask) / (height * width)
+    ink_rows = np.flatnonzero(ink_rows_mask(mask))
+    ink_cols = np.flatnonzero(ink_rows_mask(mask.T))
+    stats = {"ink_ratio": ink_ratio}
+
+    if ink_ratio < options["blank_ink_ratio"] or len(ink_rows) == 0 or len(ink_cols) == 0:
+        return "blank", None, stats
+    top, bottom = ink_rows[0], ink_rows[-1] + 1
+    left, right = ink_cols[0], ink_cols[-1] + 1
+    if options["skip_notice"] and (bottom - top) < options["notice_max_height"] * height \
+            and ink_ratio < options["notice_max_ink_ratio"]:
+        return "notice", None, stats
+
+    # ＜同じページの判定に使う特徴＞（文字のある範囲を切り出して縮小し、位置のずれや余白の違いを除く）
+    ink_image = mask[top:bottom, left:right].astype(np.uint8) * 255
+    thumbnail = cv2.resize(ink_image, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    signature = {
+        "hash": difference_hash(thumbnail),
+        "aspect": (right - left) / (bottom - top),
+        # 細い線が消えないよう、薄く残った画素も文字とする
+        "thumbnail": thumbnail > 64,
+    }
+    return "page", signature, stats
+
+
+
+
+# OCRしたページの索引（知覚ハッシュ・縮小した文字の画像・OCR結果）
+#   並列OCRや、バッチ実行で並行する試験から呼ばれるため、ロックで保護する
+#   index_path を指定した場合はSQLiteに保存して次回以降の実行でも使い回し、
+#   合計サイズが max_size_mb を超えた場合は、最後に使い回した（登録した）時刻が古いものから削除する
+class PageIndex:
+
+    def __init__(self, index_path=None, max_size_mb=256):
+        self.index_path = index_path or None
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # 登録内容（ID -> 内容）。候補の絞り込みのため、全てメモリ上にも持つ
+        self._entries = {}
+        self._conn = None
+        if self.index_path is None:
+            return
+
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS page_index (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                hash TEXT NOT NULL,
+                aspect REAL NOT NULL,
+                thumbnail BLOB NOT NULL,
+                prompt_key TEXT NOT NULL,
+                text TEXT,
+                source TEXT,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_page_last_access ON page_index (last_access)"
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT id, hash, aspect, thumbnail, prompt_key, text, source FROM page_index"
+        ).fetchall()
+        for entry_id, hash_hex, aspect, thumbnail, prompt_key, text, source in rows:
+            self._entries[entry_id] = {
+                "hash": int(hash_hex, 16), "aspect": aspect, "thumbnail": decompress_thumbnail(thumbnail),
+                "prompt_key": prompt_key, "text": text, "source": source,
+            }
+
+    # ほぼ同じページの登録内容を探す（無い場合はNone）
+    #   prompt_key が異なるページ（別のプロンプト・モデルでOCRした結果）は使わない
+    def find(self, signature, prompt_key, max_hash_distance=32, max_tile_diff=8):
+        with self._lock:
+            entries = list(self._entries.items())
+        candidates = sorted(
+            (hash_distance(signature["hash"], entry["hash"]), i)
+            for i, (_, entry) in enumerate(entries)
+            if entry["prompt_key"] == prompt_key
+            and abs(entry["aspect"] - signature["aspect"]) <= MAX_ASPECT_DIFF * signature["aspect"]
+        )
+        for distance, i in candidates:
+            if distance > max_hash_distance:
+                break
+            entry_id, entry = entries[i]
+            if same_thumbnail(signature["thumbnail"], unpack_thumbnail(entry["thumbnail"]), max_tile_diff):
+                with self._lock:
+                    self.hits += 1
+                    if self._conn is not None:
+                        self._conn.execute(
+                            "UPDATE page_index SET last_access = ? WHERE id = ?", (time.time(), entry_id))
+                        self._conn.commit()
+                return entry
+        return None
+
+    # OCRしたページを登録（source は表示用の "試験/セクション page-N"）
+    def add(self, signature, prompt_key, text, source):
+        entry = {
+            **signature, "thumbnail": pack_thumbnail(signature["thumbnail"]),
+            "prompt_key": prompt_key, "text": text, "source": source,
+        }
+        with self._lock:
+            if self._conn is None:
+                self._entries[len(self._entries)] = entry
+                return
+            thumbnail = compress_thumbnail(entry["thumbnail"])
+            size = len(thumbnail) + len((text or "").encode("utf-8"))
+            cursor = self._conn.execute(
+                "INSERT INTO page_index (hash, aspect, thumbnail, prompt_key, text, source, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (format(entry["hash"], "064x"), entry["aspect"], thumbnail, prompt_key, text, source, size,
+                 time.time()),
+            )
+            self._entries[cursor.lastrowid] = entry
+            self._evict()
+            self._conn.commit()
+
+    # 合計サイズが上限を超えた場合、最後に使い回した時刻が古いものから削除
+    def _evict(self):
+        total_size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM page_index"
+        ).fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT id, size FROM page_index ORDER BY last_access ASC"
+        ).fetchall()
+        for entry_id, size in rows:
+            if total_size <= self.max_size_bytes:
+                break
+            self._conn.execute("DELETE FROM page_index WHERE id = ?", (entry_id,))
+            self._entries.pop(entry_id, None)
+            total_size -= size
+            self.evictions += 1
+
+    def print_stats(self):
+        print(f"ページの索引: {len(self._entries)}件（使い回し {self.hits}件、削除 {self.evictions}件）")
+
+
+# ページの分類の設定から索引を作成（使い回さない場合はNone）
+def setup_page_index(options=None):
+    options = get_page_filter_options(options)
+    if not options["enabled"] or not options["dedupe"]:
+        return None
+    return PageIndex(options["index_path"], options["max_size_mb"])
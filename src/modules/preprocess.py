@@ -0,0 +1,243 @@
+import cv2
+import numpy as np
+
+
+# ページ画像の前処理の既定値（長さはページの高さに対する割合で指定し、解像度によらず同じ結果にする）
+#   enabled: 前処理を行う（false の場合は、固定のしきい値での2値化のみ）
+#   binarize_method: global（固定のしきい値） / adaptive（固定のしきい値に加え、周辺より暗い画素のみ。地色のむら・ノイズに強い）
+#     PDFから生成したきれいなページでは adaptive は細い線が欠けやすく、トークン数も減らないため、スキャンしたPDFのみ adaptive にする
+#   threshold: 固定のしきい値
+#   block_size, offset: adaptive の場合の近傍の大きさ（px、奇数）と、近傍の平均からどれだけ暗ければ文字とするか
+#   denoise: 2値化の前にメディアンフィルタで細かいノイズを除く（ノイズの多いスキャン向け。細い文字は潰れやすい）
+#   deskew: 傾きを補正する（max_skew_angle 度までを skew_step 度刻みで探し、min_skew_angle 度未満は補正しない）
+#   remove_footer: ページ下端 footer_ratio の範囲にある、本文と min_footer_gap 以上離れた短い行（ページ番号など）を除く
+#   collapse_blank_rows: max_blank_rows を超える空白の行を詰める
+DEFAULT_PREPROCESS_OPTIONS = {
+    "enabled": True,
+    "binarize_method": "global",
+    "threshold": 128,
+    "block_size": 31,
+    "offset": 30,
+    "denoise": False,
+    "deskew": True,
+    "max_skew_angle": 3.0,
+    "min_skew_angle": 0.2,
+    "skew_step": 0.1,
+    "remove_footer": True,
+    "footer_ratio": 0.07,
+    "min_footer_gap": 0.01,
+    "collapse_blank_rows": True,
+    "max_blank_rows": 0.02,
+}
+
+BINARIZE_METHODS = ("global", "adaptive")
+
+# 傾きの推定に使う画像の幅の上限（大きい場合は縮小してから推定する）
+SKEW_ESTIMATE_WIDTH = 1000
+# 傾きの推定に使う文字の画素数の上限（多い場合は間引く）
+MAX_SKEW_POINTS = 100000
+# 文字のある行とみなす、行の中の文字の画素の割合（残ったノイズの点を無視する）
+MIN_ROW_INK_RATIO = 0.002
+# フッターとみなす行数の上限と、各行の幅の上限・本文の左端からの距離の下限（本文の幅に対する割合）
+FOOTER_MAX_LINES = 2
+FOOTER_MAX_WIDTH = 0.5
+FOOTER_MIN_INDENT = 0.1
+# 同じテキストの行の中の隙間とみなす空白の高さの上限（ページの高さに対する割合）
+LINE_GAP_RATIO = 0.004
+
+
+# 前処理の設定を取得（省略した項目は既定値）
+def get_preprocess_options(options=None):
+    options = {**DEFAULT_PREPROCESS_OPTIONS, **(options or {})}
+    if options["binarize_method"] not in BINARIZE_METHODS:
+        raise ValueError(f"2値化の方法が無効です: {options['binarize_method']}（{list(BINARIZE_METHODS)}）")
+    return options
+
+
+# グレースケール画像を2値化（文字が黒、背景が白）
+#   adaptive は、固定のしきい値より暗く、かつ近傍の平均より offset 以上暗い画素を文字とする
+#   （暗い地色やノイズを除き、文字の縁のにじみで文字が太らないようにする。
+#     近傍より大きい黒い塗りつぶしは輪郭のみになる）
+def binarize(gray_image, method="adaptive", threshold=128, block_size=31, offset=30):
+    _, binary_image = cv2.threshold(gray_image, threshold, 255, cv2.THRESH_BINARY)
+    if method == "global":
+        return binary_image
+    # 近傍の平均を使う（ガウス重みより5倍ほど速く、文字の2値化では差がほとんどない）
+    adaptive_image = cv2.adaptiveThreshold(
+        gray_image, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, block_size | 1, offset)
+    return cv2.max(binary_image, adaptive_image)
+
+
+# 各行に文字があるかどうか
+def ink_rows_mask(mask):
+    return np.count_nonzero(mask, axis=1) > max(mask.shape[1] * MIN_ROW_INK_RATIO, 1)
+
+
+# 文字などの画素の位置（True）を取得
+def ink_mask(gray_image, threshold=128, block_size=31, offset=30):
+    return binarize(gray_image, "adaptive", threshold, block_size, offset) == 0
+
+
+# 文字の行が水平になる角度（度）を推定
+#   角度ごとに画素を斜めに射影した行ごとのヒストグラムを作り、行の境目が最もはっきりする角度を選ぶ
+#   （粗い刻みで探した後、最も良い角度の周辺を step 刻みで探す）
+def estimate_skew_angle(mask, max_angle=3.0, step=0.1):
+    scale = min(1.0, SKEW_ESTIMATE_WIDTH / mask.shape[1])
+    if scale < 1.0:
+        mask = cv2.resize(mask.astype(np.uint8) * 255, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) > 64
+    ys, xs = np.nonzero(mask)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > MAX_SKEW_POINTS:
+        index = np.linspace(0, len(ys) - 1, MAX_SKEW_POINTS).astype(np.int64)
+        ys, xs = ys[index], xs[index]
+    xs = xs - mask.shape[1] / 2
+
+    def best_of(angles):
+        scores = []
+        for angle in angles:
+            rows = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+            histogram = np.bincount(rows - rows.min()).astype(np.float64)
+            scores.append(np.sum(np.diff(histogram) ** 2))
+        return float(angles[int(np.argmax(scores))])
+
+    coarse_step = max(step, 0.5)
+    angle = best_of(np.arange(-max_angle, max_angle + coarse_step / 2, coarse_step))
+    angle = best_of(np.arange(angle - coarse_step, angle + coarse_step + step / 2, step))
+    return round(max(-max_angle, min(max_angle, angle)), 3) + 0.0
+
+
+# 画像を回転して傾きを補正（はみ出した部分は白で埋める）
+def rotate_image(image_array, angle, border_value=255, interpolation=cv2.INTER_LINEAR):
+    height, width = image_array.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    if image_array.ndim == 3:
+        border_value = (border_value,) * image_array.shape[2]
+    return cv2.warpAffine(
+        image_array, matrix, (width, height), flags=interpolation,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
+
+
+# 文字のある行の連続（テキストの行）の (開始行, 終了行) のリスト
+#   max_gap 行以下の空白は、同じテキストの行の中の隙間（「-」や記号の上下など）として繋げる
+def ink_row_runs(mask, max_gap=0):
+    ink_rows = np.flatnonzero(ink_rows_mask(mask))
+    if len(ink_rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(ink_rows) > max_gap + 1)
+    starts = np.concatenate(([ink_rows[0]], ink_rows[breaks + 1]))
+    ends = np.concatenate((ink_rows[breaks], [ink_rows[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+# 文字のある列の範囲 (左端, 右端)（無い場合はNone）
+def ink_col_range(mask):
+    ink_cols = np.flatnonzero(ink_rows_mask(mask.T))
+    if len(ink_cols) == 0:
+        return None
+    return int(ink_cols[0]), int(ink_cols[-1]) + 1
+
+
+# フッター（ページ下端の、本文と離れた行）の開始位置を取得（無い場合はNone）
+#   ページ下端 footer_ratio の範囲にある、本文と min_gap 以上離れた行のうち、
+#   FOOTER_MAX_LINES 行以内で、各行が本文の行の高さの2倍以内かつ本文の幅に対して狭く、
+#   本文の左端から離れている（中央・右寄せのページ番号やコピーライト）場合のみフッターとする
+#   （本文の最後の行が下端に近い場合に、本文を消さないため）
+def find_footer_top(mask, footer_ratio=0.07, min_gap=0.01):
+    height = mask.shape[0]
+    runs = ink_row_runs(mask, max(int(LINE_GAP_RATIO * height), 1))
+    if len(runs) < 2:
+        return None
+    # 空白を挟んで次の行がフッターの範囲から始まる位置のうち、それ以降の行が全てフッターらしい最も上のもの
+    for i in range(1, len(runs)):
+        if runs[i][0] - runs[i - 1][1] > min_gap * height and runs[i][0] >= height * (1 - footer_ratio) \
+                and is_footer(mask, runs[:i], runs[i:]):
+            return int((runs[i - 1][1] + runs[i][0]) // 2)
+    return None
+
+
+# ページ下端の行（footer_runs）が、本文の行（body_runs）に対してフッターらしいかどうか
+def is_footer(mask, body_runs, footer_runs):
+    if len(footer_runs) > FOOTER_MAX_LINES:
+        return False
+    body_left, body_right = ink_col_range(mask[body_runs[0][0]:body_runs[-1][1]])
+    body_width = body_right - body_left
+    line_height = float(np.median([end - start for start, end in body_runs]))
+    for start, end in footer_runs:
+        col_range = ink_col_range(mask[start:end])
+        if col_range is None:
+            continue
+        left, right = col_range
+        if end - start > 2 * line_height \
+                or right - left > FOOTER_MAX_WIDTH * body_width \
+                or left - body_left < FOOTER_MIN_INDENT * body_width:
+            return False
+    return True
+
+
+# 空白の行が max_blank_rows 行を超えて続く部分を詰める
+#   文字などの画素が全く無い行のみ空白とする（図の接続線や表の縦罫線のみの行は、割合が小さくても詰めない）
+#   (詰めた画像, 詰めたマスク, 除いた行数) を返す
+def collapse_blank_rows(image_array, mask, max_blank_rows):
+    blank = np.count_nonzero(mask, axis=1) == 0
+    row_index = np.arange(len(blank))
+    # 各行が、直前の文字のある行から何行目の空白か
+    run_start = np.maximum.accumulate(np.where(blank, 0, row_index + 1))
+    keep = ~blank | (row_index - run_start < max_blank_rows)
+    return image_array[keep], mask[keep], int(np.count_nonzero(~keep))
+
+
+# ページ画像の前処理（2値化・傾き補正・フッター除去・空白の行の詰め）
+#   binarize_page=False の場合は色を残し、文字の位置の検出にのみ2値化を使う
+#   (前処理した画像（グレースケールまたはBGR）, 統計) を返す
+def preprocess_page(pil_image, binarize_page=False, options=None):
+    options = get_preprocess_options(options)
+
+    gray_image = np.asarray(pil_image.convert("L"))
+    if options["denoise"]:
+        gray_image = cv2.medianBlur(gray_image, 3)
+    if binarize_page:
+        image_array = binarize(
+            gray_image, options["binarize_method"], options["threshold"], options["block_size"], options["offset"])
+    else:
+        image_array = cv2.cvtColor(np.asarray(pil_image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    if binarize_page and options["binarize_method"] == "adaptive":
+        mask = image_array == 0
+    else:
+        mask = ink_mask(gray_image, options["threshold"], options["block_size"], options["offset"])
+    original_height, original_width = mask.shape
+
+    # ＜傾き補正＞
+    skew_angle = 0.0
+    if options["deskew"]:
+        skew_angle = estimate_skew_angle(mask, options["max_skew_angle"], options["skew_step"])
+        if abs(skew_angle) >= options["min_skew_angle"]:
+            image_array = rotate_image(image_array, skew_angle)
+            if binarize_page:
+                # 補間で生じた中間色を戻す
+                image_array = np.where(image_array < 128, 0, 255).astype(np.uint8)
+            mask = rotate_image(mask.astype(np.uint8), skew_angle, 0, cv2.INTER_NEAREST) > 0
+        else:
+            skew_angle = 0.0
+
+    # ＜フッター除去＞
+    footer_rows = 0
+    if options["remove_footer"]:
+        footer_top = find_footer_top(mask, options["footer_ratio"], options["min_footer_gap"])
+        if footer_top is not None:
+            footer_rows = mask.shape[0] - footer_top
+            image_array, mask = image_array[:footer_top], mask[:footer_top]
+
+    # ＜空白の行の詰め＞
+    blank_rows = 0
+    if options["collapse_blank_rows"]:
+        image_array, mask, blank_rows = collapse_blank_rows(
+            image_array, mask, max(int(options["max_blank_rows"] * original_height), 1))
+
+    stats = {
+        "skew_angle": skew_angle,
+        "footer_rows": footer_rows,
+        "blank_rows": blank_rows,
+        "preprocessed_size": (image_array.shape[1], image_array.shape[0]),
+    }
+    return image_array, stats
@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import math
+import glob
+import unicodedata
+from collections import Counter
+
+from src.modules.answer_index import QUESTION_PATTERN, SUBQUESTION_PATTERN, build_answer_index
+from src.modules.exam_files import exam_id_of
+from src.modules.manifest import hash_file
+from src.modules.utils import write_text_atomic
+
+
+# 検索の設定の既定値
+#   enabled: 試験問題・解説の全文の代わりに、質問ごとに関連する部分を検索して渡す
+#   top_k: 1回の質問で渡す部分の数
+#   max_chunk_chars: 1つの部分の最大文字数（問題・設問で分けた上で、長い場合は段落で分ける）
+DEFAULT_RETRIEVAL_OPTIONS = {
+    "enabled": False,
+    "top_k": 5,
+    "max_chunk_chars": 800,
+}
+
+# 索引ファイル名（試験の出力ディレクトリに保存する）
+INDEX_FILE_NAME = "retrieval_index.json"
+# 索引の形式が変わった場合に作り直すためのバージョン
+INDEX_VERSION = 2
+
+# 問題・設問の番号（「問1」「設問2」を1つの語とし、番号の違う問題・設問と区別する）
+LOCATION_PATTERN = re.compile(r"(?:設問|問)\s*\d+")
+# 英数字の単語
+WORD_PATTERN = re.compile(r"[0-9a-z]+")
+# 日本語などの文字の並び（記号・空白で区切る）
+TEXT_PATTERN = re.compile(r"[^\x00-\x7f\s、。，．・「」『』（）【】〔〕［］｛｝：；！？＜＞〈〉《》“”‘’―…]+")
+# マークダウンの見出し
+HEADING_PATTERN = re.compile(r"^\s*#+\s")
+
+
+# 検索の設定を取得（省略した項目は既定値）
+def get_retrieval_options(options=None):
+    return {**DEFAULT_RETRIEVAL_OPTIONS, **(options or {})}
+
+
+# 検索用に文章を語に分割（英数字は単語、日本語は2文字ずつ。問題・設問の番号は1つの語）
+def tokenize(text):
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = [re.sub(r"\s+", "", location) for location in LOCATION_PATTERN.findall(text)]
+    text = LOCATION_PATTERN.sub(" ", text)
+    tokens += WORD_PATTERN.findall(text)
+    for run in TEXT_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+    return tokens
+
+
+# 長い文章を、段落（空行）の区切りで max_chars 以内に分ける（段落自体が長い場合は文字数で分ける）
+def _split_long_text(text, max_chars):
+    if len(text) <= max_chars:
+        return [text]
+    parts = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        while len(paragraph) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+
+# 問題文・解説のマークダウンを、問題（問N）・設問（設問N）・見出しの単位で分ける
+#   見出しの行は続く本文と同じ部分に含め、見出しのみの部分は作らない
+#   (問題番号, 設問番号, 文章) のリストを返す
+def split_markdown(text, question_no=None, max_chars=800):
+    blocks = []
+    lines = []
+    has_body = False
+    subquestion_no = None
+
+    def flush():
+        block_text = "\n".join(lines).strip()
+        if block_text and has_body:
+            blocks.extend((question_no, subquestion_no, part) for part in _split_long_text(block_text, max_chars))
+
+    for line in text.splitlines():
+        normalized = unicodedata.normalize("NFKC", line)
+        question_match = QUESTION_PATTERN.match(normalized)
+        subquestion_match = SUBQUESTION_PATTERN.match(normalized)
+        if question_match or subquestion_match or HEADING_PATTERN.match(normalized):
+            # 本文の後の見出しで区切る（見出しが続く場合は、次の本文の部分にまとめる。
+            # ただし、本文の無い問題の見出しは次の問題に含めない）
+            if has_body or question_match:
+                flush()
+                lines = []
+                has_body = False
+            if question_match:
+                question_no = int(question_match.group(1))
+                subquestion_no = None
+            if subquestion_match:
+                subquestion_no = int(subquestion_match.group(1))
+        elif normalized.strip():
+            has_body = True
+        lines.append(line)
+    flush()
+    return blocks
+
+
+# 解答例のマークダウンを、問題・設問の単位で分ける
+def split_answer_markdown(text, max_chars=800):
+    index = build_answer_index(text)
+    blocks = []
+    for question_no, question in sorted(index["questions"].items()):
+        subquestions = sorted(question["subquestions"].items())
+        if len(subquestions) == 0:
+            subquestions = [(None, question["text"])]
+        for subquestion_no, subquestion_text in subquestions:
+            blocks.extend(
+                (question_no, subquestion_no, part) for part in _split_long_text(subquestion_text, max_chars))
+    return blocks
+
+
+# 試験の出力ディレクトリから、索引に含めるファイルを取得
+#   [(種類, セクション名, 問題番号, パス)] を返す（種類は question / review / answer）
+def find_exam_sources(exam_dir):
+    sources = []
+    for ans_md_path in sorted(glob.glob(os.path.join(exam_dir, "ans", "*.md"))):
+        sources.append(("answer", "ans", None, ans_md_path))
+
+    mon_dirs = [
+        dir_name for dir_name in os.listdir(exam_dir)
+        if dir_name.startswith("mon") and os.path.isdir(os.path.join(exam_dir, dir_name))
+    ]
+    for dir_name in sorted(mon_dirs, key=lambda name: int(name[3:]) if name[3:].isdigit() else 0):
+        mon_dir = os.path.join(exam_dir, dir_name)
+        question_no = int(dir_name[3:]) if dir_name[3:].isdigit() else None
+        # 整形済みのマークダウンがあればそれを使い、無い場合はOCRの結果を使う
+        question_paths = glob.glob(os.path.join(mon_dir, f"*_{dir_name}_md.md")) or \
+            glob.glob(os.path.join(mon_dir, f"*_{dir_name}.md"))
+        for question_path in sorted(question_paths)[:1]:
+            sources.append(("question", dir_name, question_no, question_path))
+        for review_path in sorted(glob.glob(os.path.join(mon_dir, f"*_{dir_name}_review.md"))):
+            sources.append(("review", dir_name, question_no, review_path))
+    return sources
+
+
+# 入力ディレクトリから、試験の出力ディレクトリのリストを取得
+#   試験の出力ディレクトリ・問題ごとのディレクトリ（monN）・複数の試験を含むディレクトリのいずれにも対応する
+#   （同じ試験の出力ディレクトリが複数ある場合は、最新のもののみ）
+def find_exam_dirs(input_dir):
+    input_dir = os.path.normpath(input_dir)
+
+    def is_exam_dir(path):
+        return os.path.isdir(os.path.join(path, "ans")) or len(glob.glob(os.path.join(path, "mon*"))) > 0
+
+    if os.path.basename(input_dir).startswith("mon") and is_exam_dir(os.path.dirname(input_dir)):
+        return [os.path.dirname(input_dir)]
+    if is_exam_dir(input_dir):
+        return [input_dir]
+
+    latest = {}
+    for dir_name in sorted(os.listdir(input_dir)):
+        path = os.path.join(input_dir, dir_name)
+        if os.path.isdir(path) and is_exam_dir(path):
+            latest[exam_id_of(path)] = path
+    return [latest[exam_id] for exam_id in sorted(latest)]
+
+
+# 部分の問題・設問の位置（「問1 設問2」。どちらも無い場合は空）
+def chunk_location(chunk):
+    location = []
+    if chunk["question_no"] is not None:
+        location.append(f"問{chunk['question_no']}")
+    if chunk["subquestion_no"] is not None:
+        location.append(f"設問{chunk['subquestion_no']}")
+    return " ".join(location)
+
+
+# 検索用の索引（BM25）
+#   語は、部分の位置（問題・設問）と文章から作る（設問の文章に問題の番号が無くても、問題の番号で検索できる）
+#   chunks は {"exam_id", "section", "kind", "question_no", "subquestion_no", "source", "text"} のリスト
+class RetrievalIndex:
+
+    def __init__(self, chunks=(), k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []
+        self._terms = []
+        self._document_frequency = Counter()
+        self._total_length = 0
+        self.add(chunks)
+
+    # 部分を索引に追加（語の出現回数が計算済みの場合は "terms" を使う）
+    def add(self, chunks):
+        for chunk in chunks:
+            terms = Counter(chunk.get("terms") or tokenize(f"{chunk_location(chunk)}\n{chunk['text']}"))
+            self.chunks.append({key: value for key, value in chunk.items() if key != "terms"})
+            self._terms.append(terms)
+            self._document_frequency.update(terms.keys())
+            self._total_length += sum(terms.values())
+
+    # 他の索引の部分を全て追加
+    def merge(self, index):
+        self.add({**chunk, "terms": terms} for chunk, terms in zip(index.chunks, index._terms))
+
+    # 質問に関連する部分を、スコアの高い順に top_k 件返す（[(スコア, 部分)]）
+    #   質問で問題・設問を指定した場合（「問1の設問2」など）は、その位置に一致する部分を優先する
+    def search(self, query, top_k=5):
+        if len(self.chunks) == 0:
+            return []
+        num_chunks = len(self.chunks)
+        average_length = self._total_length / num_chunks
+        query_terms = set(tokenize(query))
+        query_locations = {re.sub(r"\s+", "", location) for location in LOCATION_PATTERN.findall(
+            unicodedata.normalize("NFKC", query).lower())}
+
+        scores = []
+        for i, terms in enumerate(self._terms):
+            length = sum(terms.values())
+            score = 0.0
+            for term in query_terms:
+                frequency = terms.get(term, 0)
+                if frequency == 0:
+                    continue
+                document_frequency = self._document_frequency[term]
+                idf = math.log(1 + (num_chunks - document_frequency + 0.5) / (document_frequency + 0.5))
+                score += idf * frequency * (self.k1 + 1) / (
+                    frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+            if score > 0:
+                location_matches = len(query_locations & set(chunk_location(self.chunks[i]).split()))
+                scores.append((location_matches, score, i))
+
+        scores.sort(reverse=True)
+        return [(score, self.chunks[i]) for _, score, i in scores[:top_k]]
+
+    # 索引をJSONファイルに保存（extra は索引の作成条件など）
+    def save(self, index_path, **extra):
+        data = {
+            **extra,
+            "chunks": [{**chunk, "terms": dict(terms)} for chunk, terms in zip(self.chunks, self._terms)],
+        }
+        write_text_atomic(index_path, json.dumps(data, ensure_ascii=False))
+
+
+# 試験の出力ディレクトリの文章を分けて、索引に入れる部分のリストを作成
+def build_exam_chunks(exam_dir, max_chars=800):
+    exam_id = exam_id_of(exam_dir)
+    chunks = []
+    for kind, section, question_no, path in find_exam_sources(exam_dir):
+        with open(path, mode="r", encoding="utf-8") as f:
+            text = f.read()
+        if kind == "answer":
+            blocks = split_answer_markdown(text, max_chars)
+        else:
+            blocks = split_markdown(text, question_no, max_chars)
+        for block_question_no, subquestion_no, block_text in blocks:
+            chunks.append({
+                "id": len(chunks),
+                "exam_id": exam_id,
+                "section": section,
+                "kind": kind,
+                "question_no": block_question_no,
+                "subquestion_no": subquestion_no,
+                "source": os.path.relpath(path, exam_dir),
+                "text": block_text,
+            })
+    return chunks
+
+
+# 試験の索引を読み込む（元のファイルが変わっている場合や、索引が無い場合は作成して保存する）
+def load_exam_index(exam_dir, max_chars=800):
+    index_path = os.path.join(exam_dir, INDEX_FILE_NAME)
+    source_hashes = {
+        os.path.relpath(path, exam_dir): hash_file(path) for _, _, _, path in find_exam_sources(exam_dir)
+    }
+    if os.path.exists(index_path):
+        with open(index_path, mode="r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") == INDEX_VERSION and data.get("sources") == source_hashes \
+                and data.get("max_chars") == max_chars:
+            return RetrievalIndex(data["chunks"])
+
+    index = RetrievalIndex(build_exam_chunks(exam_dir, max_chars))
+    index.save(index_path, version=INDEX_VERSION, sources=source_hashes, max_chars=max_chars)
+    print(f"{exam_dir} の索引を作成しました（{len(index.chunks)}件）。")
+    return index
+
+
+# 入力ディレクトリに含まれる全ての試験の索引を読み込み、1つにまとめる
+def load_index(input_dir, max_chars=800):
+    index = RetrievalIndex()
+    for exam_dir in find_exam_dirs(input_dir):
+        index.merge(load_exam_index(exam_dir, max_chars))
+    return index
+
+
+# 検索結果を、LLMに渡す参考資料の文章にする
+def format_chunks(results):
+    kind_names = {"question": "問題文", "review": "解説", "answer": "解答例"}
+    lines = ["<参考資料>"]
+    for i, (_, chunk) in enumerate(results):
+        location = " ".join(part for part in (chunk["exam_id"], chunk["section"], chunk_location(chunk)) if part)
+        lines.append(f"[{i + 1}] {location}（{kind_names.get(chunk['kind'], chunk['kind'])}）")
+        lines.append(chunk["text"])
+        lines.append("")
+    lines.append("</参考資料>")
+    return "\n".join(lines)
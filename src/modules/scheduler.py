@@ -0,0 +1,208 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+
+
+# 1分あたりの上限に合わせて補充されるトークンバケット
+class TokenBucket:
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = capacity_per_minute
+        self.rate = capacity_per_minute / 60
+        self.tokens = capacity_per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # amount を消費できるまでの待ち時間（s）
+    #   上限を超える量は、バケットが満杯になれば消費できるものとする
+    def wait_time(self, amount):
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    # 見積もりと実績の差を戻す（実績が多い場合は追加で消費する）
+    def refund(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+# レート制限（429）のエラーか
+def is_rate_limit_error(error):
+    return getattr(error, "status_code", None) == 429
+
+
+# 再試行すべきエラーか（レート制限・タイムアウト・接続エラー・サーバーエラー）
+def is_retryable_error(error):
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    return getattr(error, "status_code", None) in (408, 409, 429, 500, 502, 503, 504)
+
+
+# サーバーから指定された待ち時間（Retry-Afterヘッダー）を取得
+def retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# 全てのLLM呼び出しを通す、レート制限を考慮したスケジューラー
+#   - 1分あたりのリクエスト数（rpm）とトークン数（tpm）をトークンバケットで管理し、上限内で送信する
+#   - 同時実行数を max_concurrency に制限し、待機中の呼び出しは優先度（小さいほど先）の順に送信する
+#   - 一時的なエラーはジッター付きの指数バックオフで再試行し、429の場合は全体の送信を一時停止する
+class RequestScheduler:
+
+    def __init__(
+        self, rpm=500, tpm=30000, max_concurrency=8, max_retries=6,
+        base_delay=1.0, max_delay=60.0,
+    ):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.throttle_time = 0.0
+        self.max_queue_depth = 0
+
+    # 送信枠を確保するまで待機し、(待機時間（s）, 待機開始時の待ち行列の長さ) を返す
+    def _acquire(self, estimated_tokens, priority):
+        start_time = time.monotonic()
+        with self._condition:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._queue, entry)
+            queue_depth = len(self._queue)
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+            while True:
+                timeout = None
+                if self._queue[0] == entry and self._active < self.max_concurrency:
+                    timeout = max(
+                        self._paused_until - time.monotonic(),
+                        self.request_bucket.wait_time(1),
+                        self.token_bucket.wait_time(estimated_tokens),
+                    )
+                    if timeout <= 0:
+                        break
+                self._condition.wait(timeout)
+
+            heapq.heappop(self._queue)
+            self._active += 1
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(estimated_tokens)
+            # 次の呼び出しが送信できるか判定させる
+            self._condition.notify_all()
+
+        return time.monotonic() - start_time, queue_depth
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    # 再試行までの待ち時間（指数バックオフ＋ジッター）
+    def _backoff(self, attempt, error):
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+        return delay
+
+    # func() をスケジュールして実行し、(結果, 実行情報) を返す
+    #   usage_func を指定した場合、結果から実際のトークン数を取得してバケットを補正する
+    def run(self, func, estimated_tokens, priority=1, usage_func=None):
+        throttle_time = 0.0
+        for attempt in range(self.max_retries + 1):
+            wait_time, queue_depth = self._acquire(estimated_tokens, priority)
+            throttle_time += wait_time
+            try:
+                result = func()
+            except Exception as e:
+                self._release()
+                if not is_retryable_error(e) or attempt == self.max_retries:
+                    with self._condition:
+                        self.failures += 1
+                        self.throttle_time += throttle_time
+                    raise
+
+                delay = self._backoff(attempt, e)
+                with self._condition:
+                    self.retries += 1
+                    if is_rate_limit_error(e):
+                        # 上限に達しているため、全ての呼び出しの送信を止める
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"LLM呼び出しでエラーが出たため、{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_retries}回目）: {e}")
+                time.sleep(delay)
+                throttle_time += delay
+                continue
+
+            self._release()
+            if usage_func is not None:
+                actual_tokens = usage_func(result)
+                if actual_tokens is not None:
+                    with self._condition:
+                        self.token_bucket.refund(estimated_tokens - actual_tokens)
+            with self._condition:
+                self.requests += 1
+                self.throttle_time += throttle_time
+            return result, {"throttle": throttle_time, "retries": attempt, "queue_depth": queue_depth}
+
+    # 待機中の呼び出し数
+    def queue_depth(self):
+        with self._condition:
+            return len(self._queue)
+
+    # 統計情報を取得
+    def stats(self):
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "throttle_time": self.throttle_time,
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+    # 統計情報を表示
+    def print_stats(self):
+        stats = self.stats()
+        print(f"\nScheduled Requests: {stats['requests']}")
+        print(f"Retries: {stats['retries']}")
+        print(f"Failures: {stats['failures']}")
+        print(f"Throttle Time (s): {stats['throttle_time']:.1f}")
+        print(f"Max Queue Depth: {stats['max_queue_depth']}\n")
+
+
+# 設定からスケジューラーを作成（rate_limit を指定しない場合は None）
+def setup_scheduler(rate_limit):
+    if not rate_limit:
+        return None
+    return RequestScheduler(**rate_limit)
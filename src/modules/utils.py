@@ -1,14 +1,17 @@
+import io
 import os
+import json
 import PyPDF2
 
+# doclingは読み込みに時間がかかるため、使用する関数の中で読み込む
 
-from docling.datamodel.base_models import FigureElement, InputFormat, Table
-from docling.datamodel.pipeline_options import (
-    PdfPipelineOptions,
-    EasyOcrOptions,
-    TableFormerMode,
-)
-from docling.document_converter import DocumentConverter, PdfFormatOption
+
+# テキストファイルを書き込む（書き込み途中で中断しても壊れないよう、一時ファイルから置き換える）
+def write_text_atomic(output_path, text):
+    temp_path = f"{output_path}.tmp"
+    with open(temp_path, mode="w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_path, output_path)
 
 
 # PDFを分割
@@ -39,20 +42,117 @@ def split_pdf(input_pdf, output_folder, start_page, end_page):
 
         return output_pdf
 
-def setup_pdf_converter():
 
-    IMAGE_RESOLUTION_SCALE = 2.0
+# PDFを一度だけ読み込み、複数のページ範囲に分割
+#   output_folders を指定した場合は範囲ごとにPDFファイルを保存してパスのリストを返し、
+#   as_stream=True の場合はファイルを作らず、doclingで直接読めるDocumentStreamのリストを返す
+def split_pdf_ranges(input_pdf, ranges, output_folders=None, as_stream=False):
+    if not as_stream and (output_folders is None or len(output_folders) != len(ranges)):
+        raise ValueError("output_foldersはページ範囲と同じ数だけ指定してください。")
+
+    with open(input_pdf, "rb") as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        num_pages = len(pdf_reader.pages)
+
+        # 全てのページ範囲を事前に確認
+        invalid_ranges = [
+            (start_page, end_page) for start_page, end_page in ranges
+            if start_page < 1 or end_page > num_pages or start_page > end_page
+        ]
+        if len(invalid_ranges) > 0:
+            raise ValueError(f"ページ範囲が無効です（全{num_pages}ページ）: {invalid_ranges}")
+
+        outputs = []
+        for i, (start_page, end_page) in enumerate(ranges):
+            # 同じReaderから指定したページ範囲を含むPDFを作成
+            pdf_writer = PyPDF2.PdfWriter()
+            for page_num in range(start_page - 1, end_page):
+                pdf_writer.add_page(pdf_reader.pages[page_num])
+
+            file_name = f"pages_{start_page}_to_{end_page}.pdf"
+            if as_stream:
+                from docling.datamodel.base_models import DocumentStream
+                stream = io.BytesIO()
+                pdf_writer.write(stream)
+                stream.seek(0)
+                outputs.append(DocumentStream(name=file_name, stream=stream))
+            else:
+                os.makedirs(output_folders[i], exist_ok=True)
+                output_pdf = os.path.join(output_folders[i], file_name)
+                with open(output_pdf, "wb") as output_file:
+                    pdf_writer.write(output_file)
+                print(f"ページ {start_page} から {end_page} までを保存しました: {output_pdf}")
+                outputs.append(output_pdf)
+
+        return outputs
+
+
+# PDFコンバーターの設定プロファイル
+#   table_structure: 表の構造解析のモード（"accurate" / "fast"）。Noneの場合は構造解析を省略する
+#                    （図や表の切り出しはレイアウト解析で行うため、省略しても table-N.png は作成される）
+#   images_scale: 画像の解像度の倍率（ページ画像はGPTでOCRするため、小さくしすぎないこと）
+#   image_types: 生成する画像の種類（pages / tables / pictures）
+CONVERTER_PROFILES = {
+    "fast": {
+        "table_structure": None,
+        "do_cell_matching": False,
+        "images_scale": 1.5,
+        "image_types": ["pages", "tables", "pictures"],
+    },
+    "balanced": {
+        "table_structure": "fast",
+        "do_cell_matching": False,
+        "images_scale": 2.0,
+        "image_types": ["pages", "tables", "pictures"],
+    },
+    "accurate": {
+        "table_structure": "accurate",
+        "do_cell_matching": True,
+        "images_scale": 2.0,
+        "image_types": ["pages", "tables", "pictures"],
+    },
+}
+
+DEFAULT_CONVERTER_PROFILE = "accurate"
+
+
+# プロファイル名（または設定の辞書）から、PDFコンバーターの設定を取得
+#   辞書の場合は、"base" に指定したプロファイル（省略時は既定のプロファイル）の設定を上書きする
+def get_converter_options(profile=None):
+    if profile is None:
+        profile = DEFAULT_CONVERTER_PROFILE
+    if isinstance(profile, dict):
+        base = profile.get("base", DEFAULT_CONVERTER_PROFILE)
+        return {**get_converter_options(base), **{key: value for key, value in profile.items() if key != "base"}}
+    if profile not in CONVERTER_PROFILES:
+        raise ValueError(f"PDFコンバーターのプロファイルが無効です: {profile}（{list(CONVERTER_PROFILES)}）")
+    return dict(CONVERTER_PROFILES[profile])
+
+
+# プロファイルを区別するキー（同じ設定になるプロファイルは同じキーになる）
+def converter_profile_key(profile=None):
+    return json.dumps(get_converter_options(profile), sort_keys=True)
+
+
+def setup_pdf_converter(profile=None):
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, TableFormerMode
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+
+    options = get_converter_options(profile)
 
     # パイプラインの設定
     pipeline_options = PdfPipelineOptions()
     pipeline_options.do_ocr = False
-    pipeline_options.do_table_structure = True
-    pipeline_options.table_structure_options.do_cell_matching = True
-    pipeline_options.table_structure_options.mode = TableFormerMode.ACCURATE
-    pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
-    pipeline_options.generate_page_images = True
-    pipeline_options.generate_table_images = True
-    pipeline_options.generate_picture_images = True
+    pipeline_options.do_table_structure = options["table_structure"] is not None
+    if options["table_structure"] is not None:
+        pipeline_options.table_structure_options.do_cell_matching = options["do_cell_matching"]
+        pipeline_options.table_structure_options.mode = \
+            TableFormerMode.ACCURATE if options["table_structure"] == "accurate" else TableFormerMode.FAST
+    pipeline_options.images_scale = options["images_scale"]
+    pipeline_options.generate_page_images = "pages" in options["image_types"]
+    pipeline_options.generate_table_images = "tables" in options["image_types"]
+    pipeline_options.generate_picture_images = "pictures" in options["image_types"]
 
     # PDFを解析
     doc_converter = DocumentConverter(
@@ -61,4 +161,4 @@ def setup_pdf_converter():
         }
     )
 
-    return doc_converter
\ No newline at end of file
+    return doc_converter
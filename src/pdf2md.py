@@ -1,60 +1,36 @@
 import os
-import cv2
 import yaml
-import base64
+import PyPDF2
 import argparse
-import tempfile
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_community.callbacks.manager import get_openai_callback
 
 from datetime import datetime
-from docling_core.types.doc import ImageRefMode, PictureItem, TableItem
 
-from src.modules.utils import split_pdf, setup_pdf_converter
+from src.modules.utils import split_pdf_ranges, get_converter_options, DEFAULT_CONVERTER_PROFILE
+from src.modules.convert import convert_pdfs_in_pool, save_element_images
+from src.modules.convert_client import ConverterClient, DEFAULT_SERVER_URL
+from src.modules.ocr import iter_ocr_images, clean_result_text
+from src.modules.image import to_base64, optimize_page_image, DEFAULT_IMAGE_OPTIONS
+from src.modules.preprocess import get_preprocess_options
+from src.modules.page_filter import PageIndex, classify_page, get_page_filter_options, setup_page_index, is_notice_text
+from src.modules.cache import setup_llm_cache
+from src.modules.manifest import Manifest, hash_file, hash_values, find_latest_output_dir
+from src.modules.journal import PageJournal
+from src.modules.metrics import MetricsLedger
+from src.modules.llm import create_chat_model
+from src.modules.scheduler import setup_scheduler
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
 
-def main(configs):
+# 使用するモデル
+MODEL_NAME = "gpt-4o"
 
-    print(f"=============== 実行開始 ===============")
-
-    # 設定値を取得
-    output_dir = configs["output_dir"]
-    pdf_path = configs["pdf_path"]
-    ans_pdf_path = configs["ans_pdf_path"]
-    split_page = configs["split_page"]
-
-
-    # ＜入力ファイル名からタイムスタンプ付きディレクトリの作成＞
-    exam_id = os.path.splitext(os.path.basename(pdf_path))[0]
-    file_name = f"{exam_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    output_dir = os.path.join(output_dir, file_name)
-    os.makedirs(output_dir, exist_ok=True)
-
-
-    # PDFを問題ごとに分割
-    split_pdf_path_list = []
-    for i, (start_page, end_page) in enumerate(split_page):
-        split_output_dir = os.path.join(output_dir, f"mon{i+1}")
-        os.makedirs(split_output_dir, exist_ok=True)
-        split_pdf_path = split_pdf(pdf_path, split_output_dir, start_page, end_page)
-        if split_pdf_path == None:
-            continue
-        split_pdf_path_list.append((split_output_dir, split_pdf_path))
-
-    print(f"=============== 分割完了 ===============")
-
-    # PDFコンバーターを生成
-    pdf_converter = setup_pdf_converter()
-    # OpenAIのLLMインスタンス作成
-    chat_model = ChatOpenAI(model="gpt-4o", temperature=0)
-    # システムプロンプト
-    system_prompt0 = SystemMessage(
-        content=\
+# システムプロンプト
+SYSTEM_PROMPT0 = SystemMessage(
+    content=\
 """
 あなたは天才的な文書作成者です。
 画像から文章を読み取り、テキスト形式にまとめてください。
@@ -63,10 +39,10 @@ def main(configs):
 
 出力は、必ずテキスト文章のみで、余計な文章は含めないでください。
 """
-    )
+)
 
-    system_prompt1 = SystemMessage(
-        content=\
+SYSTEM_PROMPT1 = SystemMessage(
+    content=\
 """
 あなたは天才的な文書作成者です。
 画像から文章を読み取り、テキスト形式にまとめてください。
@@ -84,205 +60,608 @@ def main(configs):
 
 出力は、必ずテキスト文章のみで、余計な文章は含めないでください。
 """
-    )
+)
 
-    system_prompt2 = SystemMessage(
-        content=\
+SYSTEM_PROMPT2 = SystemMessage(
+    content=\
 """
 あなたは天才的な文書編集者です。
 与えられたテキスト文章を、文章は絶対に変えずに、マークダウンの見出しや段落を付与して見やすくしてください。
 与えられた元の文章は絶対に変えないでください！
 出力には、余計な文章は含めないでください。
 """
+)
+
+
+# ページOCRの入力ハッシュ（変換の入力・ページ番号・プロンプト・モデルから決まる）
+def page_ocr_hash(section, page_no, model_name):
+    return hash_values(
+        section["convert_hash"], page_no, section["system_prompt"].content, model_name,
+        section["image_options"], section["preprocess_options"], section["page_filter_options"])
+
+
+# セクションのOCR結果を記録するジャーナル
+def section_journal(section):
+    return PageJournal(os.path.join(section["output_dir"], "ocr", "journal.jsonl"))
+
+
+# 再実行が必要なページ番号を取得（変換結果が未記録の場合はNone）
+def stale_page_nos(manifest, section, model_name):
+    if not manifest.is_fresh("convert", section["name"], section["convert_hash"]):
+        return None
+    page_nos = manifest.get("convert", section["name"])["page_nos"]
+    input_hashes = {page_no: page_ocr_hash(section, page_no, model_name) for page_no in page_nos}
+    completed = section_journal(section).completed(input_hashes)
+    return [page_no for page_no in page_nos if page_no not in completed]
+
+
+# 変換結果（図・表の画像）を保存し、マニフェストに記録
+def record_conversion(manifest, section, images):
+    save_element_images(images, section["output_dir"])
+    outputs = \
+        [os.path.join(section["output_dir"], f"table-{i+1}.png") for i in range(len(images["tables"]))] + \
+        [os.path.join(section["output_dir"], f"picture-{i+1}.png") for i in range(len(images["pictures"]))]
+    manifest.record(
+        "convert", section["name"], section["convert_hash"], outputs,
+        page_nos=[page_no for page_no, _ in images["pages"]],
     )
 
+
+# セクションの各ページのOCR結果を、ページ順に (ページ番号, テキスト) としてyieldするジェネレーター
+#   完了済みのページはジャーナルから返し、未完了のページは並列にOCRして完了次第ジャーナルに追記する
+#   白紙のページと、既にOCRしたページとほぼ同じページは、OCRせずにジャーナルに追記する
+#   1行のみのページはOCRし、結果が白紙の注記の場合のみ白紙とする（skip_notice の場合）
+#   失敗したページは、テキストの代わりに例外オブジェクトを返す
+def iter_ocr_section(exam, section, images, chat_model, model_name, max_concurrency, save_page_images):
+    manifest = exam["manifest"]
+    ledger = exam["ledger"]
+    journal = section_journal(section)
+    page_nos = manifest.get("convert", section["name"])["page_nos"]
+    input_hashes = {page_no: page_ocr_hash(section, page_no, model_name) for page_no in page_nos}
+    completed = journal.completed(input_hashes)
+    pil_images = dict(images["pages"]) if images is not None else {}
+
+    # ページの分類の設定（使い回すOCR結果は、match_prompt の場合は同じプロンプト・モデルのもののみ）
+    page_filter_options = section["page_filter_options"]
+    page_index = exam["page_index"] if page_filter_options is not None and page_filter_options["dedupe"] else None
+    if page_filter_options is not None and page_filter_options["match_prompt"]:
+        prompt_key = hash_values(section["system_prompt"].content, model_name)
+    else:
+        prompt_key = model_name
+    # OCRするページの特徴（OCR後に索引に登録する）と、このセクション内で同じページを探すための索引
+    signatures = {}
+    section_index = PageIndex()
+    # このセクション内で先にOCRするページとほぼ同じページ（ページ番号 -> 元のページ番号）
+    duplicate_page_nos = {}
+    # 1行のみのページ（OCRした結果が白紙の注記の場合は、白紙とする）
+    notice_page_nos = set()
+    num_blank = 0
+    num_reused = 0
+
+    # OCRを省略したページ（OCR結果を省いたページ）の結果を、ジャーナルに追記して台帳に記録
+    def record_skip(page_no, text, reason, source=None):
+        journal.append(page_no, input_hashes[page_no], text=text)
+        ledger.record("page_skip", exam=exam["exam_id"], section=section["name"], page=page_no,
+                      reason=reason, source=source)
+
+    def skip_page(page_no, text, reason, source=None):
+        record_skip(page_no, text, reason, source)
+        completed[page_no] = text
+
+    # 再実行が必要なページの画像を、メモリ上で送信用に最適化
+    image_options = section["image_options"]
+    # 元のページ画像のバイト数を計測し、削減したバイト数を表示する
+    measure_original = exam["configs"].get("measure_original_bytes", False)
+    mime_type = None
+    target_page_nos = []
+    image_data_list = []
+    run_configs = []
+    for page_no in page_nos:
+        if page_no in completed:
+            continue
+        pil_image = pil_images[page_no]
+
+        if save_page_images:
+            page_image_filename = os.path.join(
+                section["output_dir"], f"{section['page_prefix']}-{page_no}.png")
+            with open(page_image_filename, "wb") as fp:
+                pil_image.save(fp, format="PNG")
+
+        # ＜白紙のページの省略・ほぼ同じページのOCR結果の使い回し＞
+        if page_filter_options is not None:
+            with ledger.timer("page_filter", exam=exam["exam_id"], section=section["name"], page=page_no):
+                page_kind, signature, filter_stats = classify_page(pil_image, page_filter_options)
+            if page_kind == "blank":
+                print(
+                    f"{section['name']} page-{page_no}: 白紙のため、OCRを省略します"
+                    f"（文字の画素 {filter_stats['ink_ratio']:.2%}）")
+                skip_page(page_no, "", page_kind)
+                num_blank += 1
+                continue
+            if page_kind == "notice":
+                notice_page_nos.add(page_no)
+            elif page_index is not None:
+                match_args = (
+                    signature, prompt_key, page_filter_options["max_hash_distance"], page_filter_options["max_tile_diff"])
+                entry = page_index.find(*match_args)
+                if entry is not None:
+                    print(f"{section['name']} page-{page_no}: {entry['source']} とほぼ同じページのため、OCR結果を使い回します")
+                    skip_page(page_no, entry["text"], "duplicate", source=entry["source"])
+                    num_reused += 1
+                    continue
+                entry = section_index.find(*match_args)
+                if entry is not None:
+                    print(f"{section['name']} page-{page_no}: page-{entry['source']} とほぼ同じページのため、OCR結果を使い回します")
+                    duplicate_page_nos[page_no] = entry["source"]
+                    num_reused += 1
+                    continue
+                section_index.add(signature, prompt_key, None, page_no)
+                signatures[page_no] = signature
+
+        # 問題のページは2値化してから送る（前処理が有効な場合は、傾き補正・フッター除去なども行う）
+        with ledger.timer("image_prep", exam=exam["exam_id"], section=section["name"], page=page_no):
+            image_bytes, mime_type, stats = optimize_page_image(
+                pil_image, binarize=section["binarize"], image_options=image_options,
+                preprocess_options=section["preprocess_options"], measure_original=measure_original)
+        bytes_text = f"{stats['bytes']:,} bytes"
+        if "original_bytes" in stats:
+            bytes_text += \
+                f"（元のPNG {stats['original_bytes']:,} bytes から {stats['original_bytes'] - stats['bytes']:,} bytes 削減）"
+        print(
+            f"{section['name']} page-{page_no}: "
+            f"{stats['original_size'][0]}x{stats['original_size'][1]} -> {stats['size'][0]}x{stats['size'][1]}"
+            f"（画素数 {stats['pixel_reduction']:.0%} 削減"
+            f"{'、傾き ' + format(stats['skew_angle'], '+.1f') + '°補正' if stats.get('skew_angle') else ''}"
+            f"{'、フッター除去' if stats.get('footer_rows') else ''}）, "
+            f"{bytes_text}, "
+            f"推定 {stats['tokens']} tokens（{stats['original_tokens'] - stats['tokens']} tokens 削減）")
+        target_page_nos.append(page_no)
+        image_data_list.append(to_base64(image_bytes))
+        run_configs.append(ledger.config(
+            stage="ocr", exam=exam["exam_id"], section=section["name"], page=page_no,
+            image_bytes=len(image_bytes), priority=section["priority"]))
+
+    if num_blank + num_reused > 0:
+        print(f"{section['name']}: 白紙 {num_blank}ページ・使い回し {num_reused}ページのOCRを省略しました。")
+
+    # 1行のみのページのOCR結果が白紙の注記の場合は、白紙とする
+    def is_notice_page(page_no, result):
+        return page_no in notice_page_nos and not isinstance(result, Exception) and is_notice_text(result)
+
+    # 完了したページから順にジャーナルへ追記し、ほぼ同じページで使い回せるよう索引に登録
+    def on_complete(index, result):
+        page_no = target_page_nos[index]
+        if isinstance(result, Exception):
+            journal.append(page_no, input_hashes[page_no], error=result)
+        elif is_notice_page(page_no, result):
+            print(f"{section['name']} page-{page_no}: 白紙の注記のため、OCR結果を省きます（{result.strip()}）")
+            record_skip(page_no, "", "notice")
+        else:
+            journal.append(page_no, input_hashes[page_no], text=result)
+            if page_no in signatures:
+                page_index.add(
+                    signatures[page_no], prompt_key, result, f"{exam['exam_id']}/{section['name']} page-{page_no}")
+
+    # ＜GPT-4oでOCR＞（画像を並列で投げ、結果はページ順に返す）
+    results = iter_ocr_images(
+        chat_model, section["system_prompt"], image_data_list,
+        max_concurrency=max_concurrency, mime_type=mime_type, detail=image_options["detail"],
+        on_complete=on_complete, run_configs=run_configs)
+
+    ocr_results = {}
+    for page_no in page_nos:
+        if page_no in completed:
+            yield page_no, completed[page_no]
+        elif page_no in duplicate_page_nos:
+            # 元のページ（先にOCRしたページ）の結果を使う
+            source_page_no = duplicate_page_nos[page_no]
+            result = ocr_results[source_page_no]
+            if isinstance(result, Exception):
+                journal.append(page_no, input_hashes[page_no], error=result)
+            else:
+                skip_page(page_no, result, "duplicate", source=f"{exam['exam_id']}/{section['name']} page-{source_page_no}")
+            yield page_no, result
+        else:
+            _, result = next(results)
+            if is_notice_page(page_no, result):
+                result = ""
+            ocr_results[page_no] = result
+            yield page_no, result
+
+
+# 未完了のページをOCRし、全ページのテキストをジャーナルからページ順に結合して返す
+def ocr_section(exam, section, images, chat_model, model_name, max_concurrency, save_page_images):
+    manifest = exam["manifest"]
+    failed_page_nos = []
+    for page_no, result in iter_ocr_section(
+        exam, section, images, chat_model, model_name, max_concurrency, save_page_images,
+    ):
+        if isinstance(result, Exception):
+            failed_page_nos.append(page_no)
+
+    if len(failed_page_nos) > 0:
+        raise RuntimeError(
+            f"{section['name']} のOCRに失敗したページがあります: {failed_page_nos}（--resumeで再実行できます）")
+
+    # ページ順に結合
+    page_nos = manifest.get("convert", section["name"])["page_nos"]
+    journal = section_journal(section)
+    input_hash = hash_values([page_ocr_hash(section, page_no, model_name) for page_no in page_nos])
+    manifest.record("ocr", section["name"], input_hash, [journal.journal_path])
+    return journal.assemble(page_nos)
+
+
+# テキストをマークダウン形式に整形（入力が変わっていなければ省略）
+def format_section(exam, section, all_text, chat_model, system_prompt, model_name, output_path):
+    manifest = exam["manifest"]
+    input_hash = hash_values(all_text, system_prompt.content, model_name)
+    if manifest.is_fresh("format", section["name"], input_hash):
+        print(f"{section['name']} のマークダウン形式変換は完了済みのため、省略します。")
+        return
+
+    format_message = HumanMessage(content=all_text)
+    messages = [system_prompt, format_message]
+
+    result = chat_model.invoke(
+        messages,
+        config=exam["ledger"].config(
+            stage="format", exam=exam["exam_id"], section=section["name"], priority=section["priority"]))
+    result_text = clean_result_text(result.content)
+
+    with open(output_path, mode="w", encoding="utf-8") as f:
+        f.write(result_text)
+    manifest.record("format", section["name"], input_hash, [output_path])
+
+
+# 解答例と各問題のセクションの定義を作成（ディレクトリは作成しない）
+def build_sections(configs, output_dir):
+
+    # 設定値を取得
+    pdf_path = configs["pdf_path"]
+    ans_pdf_path = configs["ans_pdf_path"]
+    split_page = configs["split_page"]
+    convert_mode = configs.get("convert_mode", "whole")
+    convert_workers = configs.get("convert_workers", 1)
+    image_options = {**DEFAULT_IMAGE_OPTIONS, **configs.get("image_options", {})}
+    # ページ画像の前処理（無効の場合は、問題のページを固定のしきい値で2値化するのみ）
+    preprocess_options = get_preprocess_options(configs.get("preprocess"))
+    if not preprocess_options["enabled"]:
+        preprocess_options = None
+    # OCRの前のページの分類（白紙のページの省略・ほぼ同じページのOCR結果の使い回し）
+    page_filter_options = get_page_filter_options(configs.get("page_filter"))
+    if not page_filter_options["enabled"]:
+        page_filter_options = None
+    # 変換プロファイルが変わった場合も再変換する
+    converter_options = get_converter_options(configs.get("converter_profile"))
+
+    ans_section = {
+        "name": "ans",
+        "output_dir": os.path.join(output_dir, "ans"),
+        "pdf_path": ans_pdf_path,
+        "page_range": None,
+        "convert_hash": hash_values(hash_file(ans_pdf_path), converter_options),
+        "page_prefix": "ans",
+        "binarize": False,
+        "system_prompt": SYSTEM_PROMPT0,
+        "image_options": image_options,
+        "preprocess_options": preprocess_options,
+        "page_filter_options": page_filter_options,
+        # スケジューラーでの優先度（解答例を先に処理する）
+        "priority": 0,
+    }
+    pdf_hash = hash_file(pdf_path)
+    # 分割PDFを変換する場合のみ、ページ番号が各問題の先頭からの番号になる
+    page_numbering = "split" if convert_mode == "split" and convert_workers <= 1 else "whole"
+    mon_section_list = []
+    for i, page_range in enumerate(split_page):
+        mon_section_list.append({
+            "name": f"mon{i+1}",
+            "output_dir": os.path.join(output_dir, f"mon{i+1}"),
+            "pdf_path": pdf_path,
+            "page_range": page_range,
+            "convert_hash": hash_values(pdf_hash, list(page_range), page_numbering, converter_options),
+            "page_prefix": "page",
+            "binarize": True,
+            "system_prompt": SYSTEM_PROMPT1,
+            "image_options": image_options,
+            "preprocess_options": preprocess_options,
+            "page_filter_options": page_filter_options,
+            "priority": 1,
+        })
+
+    return ans_section, mon_section_list
+
+
+# 試験の設定から、出力ディレクトリ・マニフェスト・各セクションの定義を準備
+#   ledger を渡した場合はそれに計測結果を記録し、渡さない場合は出力ディレクトリに作成する
+#   page_index を渡した場合はそれでOCR結果を使い回し、渡さない場合は設定に応じて作成する
+def prepare_exam(configs, resume_dir=None, ledger=None, page_index=None):
+
+    exam_id = os.path.splitext(os.path.basename(configs["pdf_path"]))[0]
+    if resume_dir is not None:
+        # ＜既存の出力ディレクトリから再開＞
+        output_dir = resume_dir
+        print(f"{output_dir} から再開します。")
+    else:
+        # ＜入力ファイル名からタイムスタンプ付きディレクトリの作成＞
+        file_name = f"{exam_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        output_dir = os.path.join(configs["output_dir"], file_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # ＜解答例と各問題の定義＞
+    ans_section, mon_section_list = build_sections(configs, output_dir)
+    for section in [ans_section] + mon_section_list:
+        os.makedirs(section["output_dir"], exist_ok=True)
+
+    return {
+        "configs": configs,
+        "exam_id": exam_id,
+        "output_dir": output_dir,
+        # 各ステージの実行状況を記録するマニフェスト
+        "manifest": Manifest(output_dir),
+        # LLM呼び出しと変換の計測台帳
+        "ledger": ledger if ledger is not None else MetricsLedger(os.path.join(output_dir, "metrics.jsonl")),
+        # ほぼ同じページのOCR結果を使い回すための索引（使い回さない場合はNone）
+        "page_index": page_index if page_index is not None else setup_page_index(configs.get("page_filter")),
+        "ans_section": ans_section,
+        "mon_section_list": mon_section_list,
+    }
+
+
+# 変換が必要なセクションのPDFを画像に変換し、図や表を抽出する
+#   converter（ConverterClient）を渡した場合はそれを使い、渡さない場合は設定に応じて生成する
+#   変換サーバーが起動していればサーバーで変換し、起動していなければプロセス内で変換する
+def convert_exam(exam, converter=None):
+    configs = exam["configs"]
+    manifest = exam["manifest"]
+    ledger = exam["ledger"]
+    exam_id = exam["exam_id"]
+    pdf_path = configs["pdf_path"]
+    convert_mode = configs.get("convert_mode", "whole")
+    convert_workers = configs.get("convert_workers", 1)
+    converter_profile = configs.get("converter_profile")
+    ans_section = exam["ans_section"]
+    own_converter = converter is None
+    if own_converter:
+        converter = ConverterClient(configs.get("convert_server_url", DEFAULT_SERVER_URL))
+
+    # ＜変換が必要なセクションを判定＞
+    #   変換結果が記録済みで、全ページのOCRが完了している場合は変換を省略
+    convert_targets = []
+    for section in [ans_section] + exam["mon_section_list"]:
+        page_nos = stale_page_nos(manifest, section, MODEL_NAME)
+        if page_nos is None or len(page_nos) > 0:
+            convert_targets.append(section)
+        else:
+            print(f"{section['name']} の変換とOCRは完了済みのため、省略します。")
+
+    # ＜PDFを画像に変換＆PDFから図や表を抽出する＞
+    images_dict = {}
+    mon_targets = [section for section in convert_targets if section["name"] != "ans"]
+    if len(convert_targets) == 0:
+        pass
+    elif own_converter and convert_workers > 1 and not converter.server_available():
+        # 解答例と各問題を、プロセスプールで並列に変換
+        jobs = [
+            (section["pdf_path"], None if section["page_range"] is None else [section["page_range"]])
+            for section in convert_targets
+        ]
+        with ledger.timer("convert", exam=exam_id, section="pool", jobs=len(jobs)):
+            results = convert_pdfs_in_pool(jobs, convert_workers, converter_profile)
+        for section, result in zip(convert_targets, results):
+            images_dict[section["name"]] = result[0]
+    else:
+        if len(mon_targets) == 0:
+            pass
+        elif convert_mode == "whole" or convert_workers > 1:
+            # PDF全体を一度だけ変換し、ページ番号で各問題に振り分ける
+            with ledger.timer(
+                "convert", exam=exam_id, section=",".join(section["name"] for section in mon_targets)):
+                results = converter.convert_pdf(
+                    pdf_path, [section["page_range"] for section in mon_targets], profile=converter_profile)
+            for section, result in zip(mon_targets, results):
+                images_dict[section["name"]] = result
+        else:
+            # PDFを問題ごとに分割し、それぞれ変換（PDFの読み込みは1回のみ）
+            with ledger.timer("split", exam=exam_id, section=",".join(section["name"] for section in mon_targets)):
+                split_pdf_path_list = split_pdf_ranges(
+                    pdf_path,
+                    [section["page_range"] for section in mon_targets],
+                    output_folders=[section["output_dir"] for section in mon_targets],
+                )
+            print(f"=============== 分割完了 ===============")
+            for section, split_pdf_path in zip(mon_targets, split_pdf_path_list):
+                manifest.record("split", section["name"], section["convert_hash"], [split_pdf_path])
+                with ledger.timer("convert", exam=exam_id, section=section["name"]):
+                    images_dict[section["name"]] = converter.convert_pdf(split_pdf_path, profile=converter_profile)[0]
+
+        if ans_section in convert_targets:
+            with ledger.timer("convert", exam=exam_id, section="ans"):
+                images_dict["ans"] = converter.convert_pdf(ans_section["pdf_path"], profile=converter_profile)[0]
+
+    for section in convert_targets:
+        record_conversion(manifest, section, images_dict[section["name"]])
+
+    print(f"=============== 変換完了 ===============")
+
+    return images_dict
+
+
+# 解答例と各問題のページをOCRし、マークダウン形式に整形する
+def process_exam(exam, images_dict, chat_model):
+    configs = exam["configs"]
+    exam_id = exam["exam_id"]
+    ans_pdf_path = configs["ans_pdf_path"]
+    max_concurrency = configs.get("max_concurrency", 4)
+    save_page_images = configs.get("save_page_images", False)
+    ans_section = exam["ans_section"]
+
     # 解答例に対して、処理を実施
     print(f"=============== 解答例 解析開始 ===============")
 
-    # ＜PDFを画像に変換＞
-    conv_res = pdf_converter.convert(ans_pdf_path)
-
-    # ページ画像を保存
-    ans_output_dir = os.path.join(output_dir, "ans")
-    os.makedirs(ans_output_dir, exist_ok=True)
-    ans_files = []
-    for page_no, page in conv_res.document.pages.items():
-        page_no = page.page_no
-        page_image_filename = os.path.join(ans_output_dir, f"ans-{page_no}.png")
-        with open(page_image_filename, "wb") as fp:
-            page.image.pil_image.save(fp, format="PNG")
-        ans_files.append(page_image_filename)
-
-    # ＜GPT-4oでOCR＞
-    ans_files.sort()
-    ans_all_text = ""
-    for image_path in ans_files:
-        # 画像をbase64形式のデータに変換
-        with open(image_path, "rb") as image_file:
-            # base64エンコード
-            encoded_string = base64.b64encode(image_file.read())
-            # バイト列を文字列にデコードして返す
-            image_data = encoded_string.decode('utf-8')
-
-        image_message = HumanMessage(
-            content=[
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
-                },
-            ],
-        )
-        messages = [system_prompt0, image_message]
-        result = chat_model.invoke(messages)
-
-        result_text = result.content
-        result_text = result_text.replace("```plaintext", "").replace("```", "")
-
-        ans_all_text += f"\n\n{result_text}"
-    
+    ans_all_text = ocr_section(
+        exam, ans_section, images_dict.get("ans"), chat_model,
+        MODEL_NAME, max_concurrency, save_page_images)
+
     output_path = os.path.join(
-        ans_output_dir, os.path.basename(ans_pdf_path).replace(".pdf", ".txt"))
+        ans_section["output_dir"], os.path.basename(ans_pdf_path).replace(".pdf", ".txt"))
     with open(output_path, mode="w", encoding="utf-8") as f:
         f.write(ans_all_text)
 
     # マークダウン形式に整形する
-
-    format_message = HumanMessage(content=ans_all_text)
-    messages = [system_prompt2, format_message]
-
-    ans_result = chat_model.invoke(messages)
-    ans_md = ans_result.content
-    ans_md = ans_md.replace("```plaintext", "").replace("```", "")
-
     output_path = os.path.join(
-        ans_output_dir, os.path.basename(ans_pdf_path).replace(".pdf", ".md"))
-    with open(output_path, mode="w", encoding="utf-8") as f:
-        f.write(ans_md)
+        ans_section["output_dir"], os.path.basename(ans_pdf_path).replace(".pdf", ".md"))
+    format_section(
+        exam, ans_section, ans_all_text, chat_model, SYSTEM_PROMPT2, MODEL_NAME, output_path)
 
     # exit()
 
     # 各問題で、処理を実施
-    for i, (split_output_dir, split_pdf_path) in enumerate(split_pdf_path_list):
+    for i, section in enumerate(exam["mon_section_list"]):
 
         # if i != 1:
         #     continue
 
         print(f"=============== {i+1}問目 処理中 ===============")
 
-        # ＜PDFを画像に変換＆PDFから図や表を抽出する＞
-        conv_res = pdf_converter.convert(split_pdf_path)
+        # ＜GPT-4oでOCR＞
+        mon_all_text = ocr_section(
+            exam, section, images_dict.get(section["name"]), chat_model,
+            MODEL_NAME, max_concurrency, save_page_images)
+
+        output_path = os.path.join(section["output_dir"], f"{exam_id}_mon{i+1}.md")
+        with open(output_path, mode="w", encoding="utf-8") as f:
+            f.write(mon_all_text)
+
+        print("GPT4oによる画像OCR、完了")
+
+        # マークダウン形式に整形する
+        output_path = os.path.join(section["output_dir"], f"{exam_id}_mon{i+1}_md.md")
+        format_section(
+            exam, section, mon_all_text, chat_model, SYSTEM_PROMPT2, MODEL_NAME, output_path)
+
+        print("GPT4oによるマークダウン形式変換、完了")
+
+
+# 再開する出力ディレクトリを取得（"latest" の場合は最新のものを探す）
+def resolve_resume_dir(configs, resume):
+    if resume != "latest":
+        return resume
+    exam_id = os.path.splitext(os.path.basename(configs["pdf_path"]))[0]
+    resume_dir = find_latest_output_dir(configs["output_dir"], exam_id)
+    if resume_dir is None:
+        print("再開できる出力ディレクトリがないため、新規に実行します。")
+    return resume_dir
+
+
+# 実行内容を確認する（変換・LLM呼び出しは行わず、新しい出力ディレクトリも作成しない）
+#   入力PDFとページ範囲を検証し、再開する場合は各セクションで再実行が必要なページを表示する
+def dry_run(configs, resume_dir=None):
+    print(f"=============== ドライラン ===============")
+
+    errors = []
+    num_pages = {}
+    for key in ("pdf_path", "ans_pdf_path"):
+        pdf_path = configs[key]
+        if not os.path.exists(pdf_path):
+            errors.append(f"{key} が見つかりません: {pdf_path}")
+            continue
+        with open(pdf_path, "rb") as file:
+            num_pages[key] = len(PyPDF2.PdfReader(file).pages)
+        print(f"{key}: {pdf_path}（{num_pages[key]}ページ）")
+
+    for i, (start_page, end_page) in enumerate(configs["split_page"]):
+        print(f"mon{i+1}: {start_page}〜{end_page}ページ")
+        if start_page < 1 or start_page > end_page or end_page > num_pages.get("pdf_path", end_page):
+            errors.append(f"mon{i+1} のページ範囲が無効です: {[start_page, end_page]}")
+
+    print(f"変換: {configs.get('convert_mode', 'whole')}（ワーカー数 {configs.get('convert_workers', 1)}）")
+    try:
+        get_converter_options(configs.get("converter_profile"))
+        print(f"変換プロファイル: {configs.get('converter_profile', DEFAULT_CONVERTER_PROFILE)}")
+    except ValueError as e:
+        errors.append(str(e))
+    try:
+        preprocess_options = get_preprocess_options(configs.get("preprocess"))
+        print(
+            f"前処理: {preprocess_options['binarize_method']}（傾き補正 {preprocess_options['deskew']}、"
+            f"フッター除去 {preprocess_options['remove_footer']}、空白の詰め {preprocess_options['collapse_blank_rows']}）"
+            if preprocess_options["enabled"] else "前処理: なし（固定のしきい値で2値化）")
+    except ValueError as e:
+        errors.append(str(e))
+    page_filter_options = get_page_filter_options(configs.get("page_filter"))
+    print(
+        f"ページの分類: 白紙の省略（文字の画素 {page_filter_options['blank_ink_ratio']:.2%} 未満）、"
+        f"使い回し {page_filter_options['dedupe']}（索引 {page_filter_options['index_path'] or 'なし'}）"
+        if page_filter_options["enabled"] else "ページの分類: なし（全てのページをOCR）")
+    print(f"OCRの同時実行数: {configs.get('max_concurrency', 4)}")
+
+    if resume_dir is not None and len(errors) == 0:
+        print(f"{resume_dir} から再開します。")
+        manifest = Manifest(resume_dir)
+        ans_section, mon_section_list = build_sections(configs, resume_dir)
+        for section in [ans_section] + mon_section_list:
+            page_nos = stale_page_nos(manifest, section, MODEL_NAME)
+            if page_nos is None:
+                print(f"  {section['name']}: 変換から実行")
+            elif len(page_nos) > 0:
+                print(f"  {section['name']}: OCRが必要なページ {page_nos}")
+            else:
+                print(f"  {section['name']}: OCR完了済み")
+
+    for error in errors:
+        print(f"エラー: {error}")
+
+    return len(errors) == 0
+
+
+def main(configs, resume_dir=None):
 
-        # ページ画像を保存
-        for page_no, page in conv_res.document.pages.items():
-            page_no = page.page_no
-            page_image_filename = os.path.join(split_output_dir, f"page-{page_no}.png")
-            with open(page_image_filename, "wb") as fp:
-                page.image.pil_image.save(fp, format="PNG")
-
-        # 図と表を保存
-        table_counter = 0
-        picture_counter = 0
-        for element, _level in conv_res.document.iterate_items():
-            if isinstance(element, TableItem):
-                table_counter += 1
-                element_image_filename = \
-                    os.path.join(split_output_dir, f"table-{table_counter}.png")
-                
-                with open(element_image_filename, "wb") as fp:
-                    element.image.pil_image.save(fp, "PNG")
-
-            if isinstance(element, PictureItem):
-                picture_counter += 1
-                element_image_filename = \
-                    os.path.join(split_output_dir, f"picture-{picture_counter}.png")
-                with open(element_image_filename, "wb") as fp:
-                    element.image.pil_image.save(fp, "PNG")
-        
-        print("図と表、抽出完了")
+    print(f"=============== 実行開始 ===============")
 
-        # ＜GPT-4oでOCR＞
-        with get_openai_callback() as cb:
-
-            # ページ画像のファイルパスを全て取得
-            page_files = []
-            for filename in os.listdir(split_output_dir):
-                if filename.startswith("page-"):
-                    file_path = os.path.join(split_output_dir, filename)
-                    page_files.append(file_path)
-            page_files.sort()
-
-            # 画像をGPTに投げる
-            mon_all_text = ""
-            for image_path in page_files:
-
-                with tempfile.TemporaryDirectory() as dname:
-
-                    # 画像を2値化
-                    image = cv2.imread(image_path)
-                    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-                    threshold_value = 128
-                    _, binary_image = cv2.threshold(gray_image, threshold_value, 255, cv2.THRESH_BINARY)
-                    temp_img_path = os.path.join(dname, 'temp.png')
-                    cv2.imwrite(temp_img_path, binary_image)
- 
-                    # 画像をbase64形式のデータに変換
-                    with open(temp_img_path, "rb") as image_file:
-                        # base64エンコード
-                        encoded_string = base64.b64encode(image_file.read())
-                        # バイト列を文字列にデコードして返す
-                        image_data = encoded_string.decode('utf-8')
-            
-                    image_message = HumanMessage(
-                        content=[
-                            {
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/jpeg;base64,{image_data}"},
-                            },
-                        ],
-                    )
-                    messages = [system_prompt1, image_message]
-                    result = chat_model.invoke(messages)
-
-                    result_text = result.content
-                    result_text = result_text.replace("```plaintext", "").replace("```", "")
-
-                    mon_all_text += f"\n\n{result_text}"
-
-            output_path = os.path.join(split_output_dir, f"{exam_id}_mon{i+1}.md")
-            with open(output_path, mode="w", encoding="utf-8") as f:
-                f.write(mon_all_text)
-            
-            print("GPT4oによる画像OCR、完了")
-            
-            # マークダウン形式に整形する
-
-            format_message = HumanMessage(content=mon_all_text)
-            messages = [system_prompt2, format_message]
-
-            final_result = chat_model.invoke(messages)
-            final_text = final_result.content
-            final_text = final_text.replace("```plaintext", "").replace("```", "")
-
-            output_path = os.path.join(split_output_dir, f"{exam_id}_mon{i+1}_md.md")
-            with open(output_path, mode="w", encoding="utf-8") as f:
-                f.write(final_text)
-
-            print("GPT4oによるマークダウン形式変換、完了")
-
-            print(f"\nTotal Tokens: {cb.total_tokens}")
-            print(f"Prompt Tokens: {cb.prompt_tokens}")
-            print(f"Completion Tokens: {cb.completion_tokens}")
-            print(f"Total Cost (USD): ${cb.total_cost}\n")
-        
+    # 試験の出力先と各セクションを準備
+    exam = prepare_exam(configs, resume_dir)
+
+    # ＜PDFを画像に変換＆PDFから図や表を抽出する＞
+    images_dict = convert_exam(exam)
+
+    # LLMキャッシュを設定
+    llm_cache = setup_llm_cache(
+        configs.get("cache_path", ".cache/llm_cache.sqlite3"),
+        max_size_mb=configs.get("cache_max_size_mb", 1024),
+    )
+    # 全てのLLM呼び出しを通すスケジューラー（レート制限内で送信し、一時的なエラーは再試行する）
+    scheduler = setup_scheduler(configs.get("rate_limit"))
+    # OpenAIのLLMインスタンス作成
+    chat_model = create_chat_model(MODEL_NAME, temperature=0, scheduler=scheduler)
+
+    # ＜GPT-4oでOCR＆マークダウン形式に整形＞
+    process_exam(exam, images_dict, chat_model)
+
+    if llm_cache is not None:
+        llm_cache.print_stats()
+    if scheduler is not None:
+        scheduler.print_stats()
+    if exam["page_index"] is not None:
+        exam["page_index"].print_stats()
+
+    # 計測結果を集計
+    exam["ledger"].print_summary()
+    exam["ledger"].save_summary(os.path.join(exam["output_dir"], "metrics_summary.json"))
 
     print(f"=============== 実行終了 ===============")
 
+    return exam["output_dir"]
+
 
 if __name__=="__main__":
 
     # コマンドライン引数の取得
     parser = argparse.ArgumentParser(description="モデル作成")
     parser.add_argument("-c", "--config", help="設定ファイルのパスを指定してください。")
+    parser.add_argument(
+        "--resume", nargs="?", const="latest", default=None,
+        help="既存の出力ディレクトリから再開します。ディレクトリ省略時は最新のものを使用します。")
 
     args = parser.parse_args()
     config_path = args.config
@@ -291,4 +670,7 @@ if __name__=="__main__":
     with open(config_path) as file:
         configs = yaml.safe_load(file)
 
-    main(configs)
\ No newline at end of file
+    # 再開する出力ディレクトリを取得
+    resume_dir = resolve_resume_dir(configs, args.resume)
+
+    main(configs, resume_dir=resume_dir)
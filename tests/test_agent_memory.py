@@ -0,0 +1,51 @@
+from PIL import Image
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.tools import tool
+from langgraph.checkpoint.memory import MemorySaver
+
+from src.exam_agent import build_agent
+from src.modules.agent_memory import apply_memory, get_memory_options
+from src.modules.chat_models import FakeChatModel
+from src.modules.llm import set_chat_model_factory
+
+
+MEMORY_OPTIONS = {"strategy": "summarize", "window_turns": 0, "summarize_every": 1}
+
+
+@tool
+def get_figure(number: int):
+    """試験問題の図の画像を取得する。
+
+    Args:
+        number: 図の番号（図1なら1）
+    """
+    return ""
+
+
+def test_empty_summary_does_not_drop_turns():
+    # 要約のプロンプトに「図1」を含むため、ツールを渡したモデルは要約の代わりにツールを呼び出す
+    chat_model = FakeChatModel(latency=0).bind_tools([get_figure])
+    state = {"messages": [
+        HumanMessage(content="図1の構成について教えてください"), AIMessage(content="図1はネットワークの構成です。"),
+        HumanMessage(content="設問1の答えは？"),
+    ]}
+    _, updates, stats = apply_memory(state, chat_model, get_memory_options(MEMORY_OPTIONS))
+    assert updates == {"summary": "", "summarized": 0}
+    assert stats["dropped_turns"] == 0
+
+
+def test_agent_with_tools_summarizes_old_turns(tmp_path):
+    Image.new("RGB", (32, 32), "white").save(tmp_path / "picture-1.png")
+    set_chat_model_factory(lambda model_name, temperature: FakeChatModel(model_name=model_name, latency=0))
+    try:
+        agent = build_agent(MEMORY_OPTIONS, figure_dir=str(tmp_path), checkpointer=MemorySaver())
+        config = {"configurable": {"thread_id": "test"}}
+        for question in ("図1の構成について教えてください", "設問1の答えは？"):
+            agent.invoke({"messages": [("user", question)]}, config)
+    finally:
+        set_chat_model_factory(None)
+
+    # ツールを使う場合も、古い会話は要約される
+    values = agent.get_state(config).values
+    assert values["summarized"] == 1
+    assert values["summary"] != ""
@@ -0,0 +1,7 @@
+from src.modules.agent_session import new_session_id, session_thread_id
+
+
+def test_sessions_started_in_same_second_have_distinct_threads():
+    session_ids = [new_session_id() for _ in range(10)]
+    assert len(set(session_ids)) == 10
+    assert len({session_thread_id("2021r03h_nw_pm1", "mon1", session_id) for session_id in session_ids}) == 10
@@ -0,0 +1,37 @@
+from src.modules.answer_index import build_answer_index, answer_slice
+
+
+HEADING_AND_TABLE_MARKDOWN = """\
+## 問1
+
+| 問 | 設問 | 解答例 |
+|---|---|---|
+| 問1 | 設問1 | VLAN |
+| 問1 | 設問2 | ファイアウォール |
+
+## 問2
+
+| 問 | 設問 | 解答例 |
+|---|---|---|
+| 問2 | 設問1 | ロードバランサ |
+"""
+
+SPLIT_TABLE_MARKDOWN = """\
+| 問 | 設問 | 解答例 |
+|---|---|---|
+| 問1 | 設問1 | VLAN |
+| 問2 | 設問1 | ロードバランサ |
+"""
+
+
+def test_heading_and_table_keep_one_header():
+    index = build_answer_index(HEADING_AND_TABLE_MARKDOWN)
+    for question_no in (1, 2):
+        assert answer_slice(index, question_no).count("| 問 | 設問 | 解答例 |") == 1
+    # 設問の解答例には、表の見出し行を付ける
+    assert answer_slice(index, 1, 2) == "| 問 | 設問 | 解答例 |\n|---|---|---|\n| 問1 | 設問2 | ファイアウォール |"
+
+
+def test_table_rows_get_header():
+    index = build_answer_index(SPLIT_TABLE_MARKDOWN)
+    assert answer_slice(index, 2) == "| 問 | 設問 | 解答例 |\n|---|---|---|\n| 問2 | 設問1 | ロードバランサ |"
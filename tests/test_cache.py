@@ -0,0 +1,17 @@
+import warnings
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from src.modules.cache import SQLiteLRUCache
+
+
+def test_lookup_does_not_warn(tmp_path):
+    cache = SQLiteLRUCache(str(tmp_path / "llm_cache.sqlite3"))
+    cache.update("prompt", "llm", [ChatGeneration(message=AIMessage(content="回答"))])
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        generations = cache.lookup("prompt", "llm")
+    assert generations[0].message.content == "回答"
+    assert generations[0].generation_info["cache_hit"]
+    assert caught == []
@@ -0,0 +1,25 @@
+from src.modules.exam_files import exam_id_of, find_exam_files, find_mon_md_path, review_md_path
+
+
+# pdf2md.pyの出力（問題PDF名の「_qs」付き）と同じ構成の出力ディレクトリを作成
+def write_pdf2md_output(tmp_path):
+    exam_dir = tmp_path / "2021r03h_nw_pm1_qs_20240101000000"
+    mon_dir = exam_dir / "mon1"
+    mon_dir.mkdir(parents=True)
+    (exam_dir / "ans").mkdir()
+    (mon_dir / "2021r03h_nw_pm1_qs_mon1.md").write_text("問1", encoding="utf-8")
+    (mon_dir / "2021r03h_nw_pm1_qs_mon1_md.md").write_text("## 問1", encoding="utf-8")
+    return exam_dir
+
+
+def test_resolves_pdf2md_output_names(tmp_path):
+    exam_dir = write_pdf2md_output(tmp_path)
+    mon_dir = exam_dir / "mon1"
+    assert exam_id_of(exam_dir) == "2021r03h_nw_pm1"
+    assert find_mon_md_path(str(mon_dir), "2021r03h_nw_pm1", formatted=False) == \
+        str(mon_dir / "2021r03h_nw_pm1_qs_mon1.md")
+    assert review_md_path(str(mon_dir), "2021r03h_nw_pm1") == str(mon_dir / "2021r03h_nw_pm1_mon1_review.md")
+
+    exam_id, ans_md_path, mon_md_path_list = find_exam_files(str(exam_dir))
+    assert ans_md_path == str(exam_dir / "ans" / "2021r03h_nw_pm1_ans.md")
+    assert mon_md_path_list == [(str(mon_dir), str(mon_dir / "2021r03h_nw_pm1_qs_mon1_md.md"))]
@@ -0,0 +1,58 @@
+import numpy as np
+from PIL import Image
+
+from src.modules.page_filter import PageIndex, classify_page, is_notice_text
+
+
+# 1行の文と、ページ番号のみのページ
+def make_one_line_page():
+    image_array = np.full((1754, 1240), 255, dtype=np.uint8)
+    for x in range(200, 1040, 14):
+        image_array[800:814, x:x + 8] = 0
+    image_array[1700:1714, 610:630] = 0
+    return Image.fromarray(image_array)
+
+
+# 文字の位置を変えたページの特徴
+def make_signature(seed):
+    rng = np.random.default_rng(seed)
+    image_array = np.full((1754, 1240), 255, dtype=np.uint8)
+    for top in range(100, 1600, 40):
+        for x in rng.choice(np.arange(100, 1100, 20), 30, replace=False):
+            image_array[top:top + 14, x:x + 12] = 0
+    _, signature, _ = classify_page(Image.fromarray(image_array))
+    return signature
+
+
+def test_notice_text():
+    assert is_notice_text("このページは白紙です。")
+    assert is_notice_text("（白紙）\n- 12 -")
+    assert not is_notice_text("次の記述を読んで，設問に答えよ。")
+    assert not is_notice_text("- 12 -")
+
+
+def test_one_line_page_is_ocr_target_by_default():
+    page_kind, signature, _ = classify_page(make_one_line_page())
+    assert page_kind == "page"
+    assert signature is not None
+    page_kind, _, _ = classify_page(make_one_line_page(), {"skip_notice": True})
+    assert page_kind == "notice"
+
+
+def test_page_index_evicts_least_recently_used(tmp_path):
+    index_path = str(tmp_path / "page_index.sqlite3")
+    signatures = [make_signature(seed) for seed in range(3)]
+    page_index = PageIndex(index_path)
+    page_index.add(signatures[0], "key", "page 1", "exam/mon1 page-1")
+    # 2件まで保存できる上限にする
+    page_index.max_size_bytes = int(page_index._conn.execute("SELECT size FROM page_index").fetchone()[0] * 2.5)
+    page_index.add(signatures[1], "key", "page 2", "exam/mon1 page-2")
+    # 1件目を使い回した後に3件目を登録すると、使い回していない2件目が削除される
+    assert page_index.find(signatures[0], "key") is not None
+    page_index.add(signatures[2], "key", "page 3", "exam/mon1 page-3")
+    assert page_index.evictions == 1
+
+    page_index = PageIndex(index_path)
+    assert page_index.find(signatures[1], "key") is None
+    assert page_index.find(signatures[0], "key")["text"] == "page 1"
+    assert page_index.find(signatures[2], "key")["text"] == "page 3"
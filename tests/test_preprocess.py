@@ -0,0 +1,71 @@
+import numpy as np
+from PIL import Image
+
+from src.modules.image import optimize_page_image
+from src.modules.preprocess import find_footer_top, collapse_blank_rows, preprocess_page
+
+
+# 本文の行（幅の広い帯）と、ページ番号（中央の狭い帯）を描いたマスクを作成
+#   1190x1684 のページで、本文の最後の行はページ下端の7%の範囲にある
+def make_page_mask(last_line_top=1575, with_page_number=True):
+    mask = np.zeros((1684, 1190), dtype=bool)
+    for top in range(100, 1540, 32):
+        mask[top:top + 15, 80:1000] = True
+    mask[last_line_top:last_line_top + 15, 80:700] = True
+    if with_page_number:
+        mask[1646:1660, 580:610] = True
+    return mask
+
+
+def test_footer_keeps_body_line_near_bottom():
+    mask = make_page_mask()
+    footer_top = find_footer_top(mask)
+    # ページ番号のみ除き、下端に近い本文の行は残す
+    assert footer_top is not None
+    assert 1590 <= footer_top <= 1646
+
+
+def test_footer_not_found_without_page_number():
+    mask = make_page_mask(with_page_number=False)
+    assert find_footer_top(mask) is None
+
+
+def test_footer_keeps_wide_bottom_line():
+    mask = make_page_mask(with_page_number=False)
+    # 本文と離れていても、本文と同じ幅の行はフッターとしない
+    mask[1646:1660, 80:1000] = True
+    assert find_footer_top(mask) is None
+
+
+def test_preprocess_page_keeps_body_line_near_bottom():
+    mask = make_page_mask()
+    pil_image = Image.fromarray(np.where(mask, 0, 255).astype(np.uint8))
+    image_array, stats = preprocess_page(pil_image, binarize_page=True, options={"deskew": False})
+    assert 0 < stats["footer_rows"] <= 1684 - 1590
+    # 本文の最後の行が残っている
+    assert np.count_nonzero(image_array[-40:] == 0) > 0
+
+
+def test_collapse_keeps_rows_with_thin_vertical_lines():
+    mask = np.zeros((1000, 1000), dtype=bool)
+    mask[100:115, 50:950] = True
+    mask[900:915, 50:950] = True
+    # 図の接続線（1px幅の縦線）のみの行は詰めない
+    mask[115:900, 500] = True
+    image_array = np.where(mask, 0, 255).astype(np.uint8)
+    collapsed_image, collapsed_mask, blank_rows = collapse_blank_rows(image_array, mask, 20)
+    # 上下の余白のみ詰め、縦線のある行は全て残す
+    assert blank_rows == (100 - 20) + (85 - 20)
+    assert collapsed_image.shape[0] == 1000 - blank_rows
+
+
+def test_optimize_page_image_scales_cropped_image():
+    # 2倍の解像度のページで、本文はページの上半分のみ
+    image_array = np.full((3508, 2480), 255, dtype=np.uint8)
+    for top in range(200, 1800, 64):
+        image_array[top:top + 30, 200:1700] = 0
+    _, _, stats = optimize_page_image(
+        Image.fromarray(image_array), binarize=True, preprocess_options={"deskew": False})
+    # 切り取った画像が長辺の上限に収まる場合は、縮小しない
+    assert stats["scale"] == 1.0
+    assert max(stats["size"]) <= 2048
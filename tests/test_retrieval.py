@@ -0,0 +1,60 @@
+from src.modules.retrieval import RetrievalIndex, build_exam_chunks, split_markdown, format_chunks
+
+
+QUESTION_MARKDOWN = """\
+## 問1
+
+ネットワークの構成について述べたものである。
+
+### 設問1
+
+社内LANのVLANの設定で、空欄に入れる字句を答えよ。
+
+### 設問2
+
+ファイアウォールのルールの変更点を答えよ。
+
+## 問2
+
+Webサーバの冗長化について述べたものである。
+
+### 設問1
+
+ロードバランサの負荷分散の方式を答えよ。
+"""
+
+
+def write_exam(tmp_path):
+    exam_dir = tmp_path / "2021r03h_nw_pm1_20240101000000"
+    mon_dir = exam_dir / "mon1"
+    mon_dir.mkdir(parents=True)
+    (mon_dir / "2021r03h_nw_pm1_qs_mon1.md").write_text(QUESTION_MARKDOWN, encoding="utf-8")
+    return exam_dir
+
+
+def test_split_markdown_folds_headings_into_blocks():
+    blocks = split_markdown(QUESTION_MARKDOWN)
+    assert [(question_no, subquestion_no) for question_no, subquestion_no, _ in blocks] == \
+        [(1, None), (1, 1), (1, 2), (2, None), (2, 1)]
+    # 見出しのみの部分は作らず、見出しは続く本文と同じ部分に含める
+    for _, _, block_text in blocks:
+        assert len([line for line in block_text.splitlines() if line.strip() and not line.startswith("#")]) > 0
+    assert blocks[1][2].startswith("### 設問1")
+
+
+def test_search_returns_subquestion_of_named_question(tmp_path):
+    index = RetrievalIndex(build_exam_chunks(write_exam(tmp_path)))
+    results = index.search("問1の設問1について", top_k=3)
+    _, chunk = results[0]
+    assert (chunk["question_no"], chunk["subquestion_no"]) == (1, 1)
+    assert "VLAN" in chunk["text"]
+
+    results = index.search("問2の設問1について", top_k=3)
+    _, chunk = results[0]
+    assert (chunk["question_no"], chunk["subquestion_no"]) == (2, 1)
+
+
+def test_format_chunks_includes_location(tmp_path):
+    index = RetrievalIndex(build_exam_chunks(write_exam(tmp_path)))
+    text = format_chunks(index.search("問1の設問1について", top_k=1))
+    assert "mon1 問1 設問1" in text